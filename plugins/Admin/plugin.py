@@ -33,6 +33,7 @@ import time
 import supybot.conf as conf
 import supybot.ircdb as ircdb
 import supybot.utils as utils
+import supybot.registry as registry
 from supybot.commands import *
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
@@ -119,6 +120,7 @@ class Admin(callbacks.Plugin):
                 networkGroup = conf.supybot.networks.get(irc.network)
                 irc.queueMsg(networkGroup.channels.join(channel))
                 conf.supybot.networks.get(irc.network).channels().add(channel)
+                registry.changed()
             else:
                 self.log.warning('Invited to %s by %s, but '
                                  'supybot.alwaysJoinOnInvite was False and '
@@ -135,6 +137,7 @@ class Admin(callbacks.Plugin):
             irc.errorInvalid('channel', channel, Raise=True)
         networkGroup = conf.supybot.networks.get(irc.network)
         networkGroup.channels().add(channel)
+        registry.changed()
         if key:
             networkGroup.channels.key.get(channel).setValue(key)
         maxchannels = irc.state.supported.get('maxchannels', sys.maxint)
@@ -226,6 +229,7 @@ class Admin(callbacks.Plugin):
         try:
             network = conf.supybot.networks.get(irc.network)
             network.channels().remove(channel)
+            registry.changed()
         except KeyError:
             pass
         if channel not in irc.state.channels:
@@ -53,8 +53,6 @@ class ChannelLogger(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(ChannelLogger, self)
         self.__parent.__init__(irc)
-        self.lastMsgs = {}
-        self.lastStates = {}
         self.logs = {}
         self.flusher = self.flush
         world.flushers.append(self.flusher)
@@ -64,26 +62,10 @@ class ChannelLogger(callbacks.Plugin):
             log.close()
         world.flushers = [x for x in world.flushers if x is not self.flusher]
 
-    def __call__(self, irc, msg):
-        try:
-            # I don't know why I put this in, but it doesn't work, because it
-            # doesn't call doNick or doQuit.
-            # if msg.args and irc.isChannel(msg.args[0]):
-            self.__parent.__call__(irc, msg)
-            if irc in self.lastMsgs:
-                if irc not in self.lastStates:
-                    self.lastStates[irc] = irc.state.copy()
-                self.lastStates[irc].addMsg(irc, self.lastMsgs[irc])
-        finally:
-            # We must make sure this always gets updated.
-            self.lastMsgs[irc] = msg
-
     def reset(self):
         for log in self._logs():
             log.close()
         self.logs.clear()
-        self.lastMsgs.clear()
-        self.lastStates.clear()
 
     def _logs(self):
         for logs in self.logs.itervalues():
@@ -199,10 +181,9 @@ class ChannelLogger(callbacks.Plugin):
     def doNick(self, irc, msg):
         oldNick = msg.nick
         newNick = msg.args[0]
-        for (channel, c) in irc.state.channels.iteritems():
-            if newNick in c.users:
-                self.doLog(irc, channel,
-                           '*** %s is now known as %s\n', oldNick, newNick)
+        for channel in irc.state.channelsOf(newNick):
+            self.doLog(irc, channel,
+                       '*** %s is now known as %s\n', oldNick, newNick)
     def doJoin(self, irc, msg):
         for channel in msg.args[0].split(','):
             self.doLog(irc, channel,
@@ -255,11 +236,10 @@ class ChannelLogger(callbacks.Plugin):
             reason = ""
         if not isinstance(irc, irclib.Irc):
             irc = irc.getRealIrc()
-        for (channel, chan) in self.lastStates[irc].channels.iteritems():
-            if msg.nick in chan.users:
-                self.doLog(irc, channel,
-                           '*** %s <%s> has quit IRC%s\n',
-                           msg.nick, msg.prefix, reason)
+        for channel in msg.tagged('channels') or ():
+            self.doLog(irc, channel,
+                       '*** %s <%s> has quit IRC%s\n',
+                       msg.nick, msg.prefix, reason)
 
     def outFilter(self, irc, msg):
         # Gotta catch my own messages *somehow* :)
@@ -47,7 +47,7 @@ class Smileys(registry.Value):
 
     def setValue(self, v):
         self.s = ' '.join(v)
-        self.value = re.compile('|'.join(map(re.escape, v)))
+        registry.Value.setValue(self, re.compile('|'.join(map(re.escape, v))))
 
     def __str__(self):
         return self.s
@@ -144,6 +144,7 @@ class StatsDB(plugins.ChannelUserDB):
             if (channel, 'channelStats') not in self:
                 self[channel, 'channelStats'] = ChannelStat()
             self[channel, 'channelStats'].addMsg(msg)
+            self.markChanged(channel, 'channelStats')
             try:
                 if id is None:
                     id = ircdb.users.getUserId(msg.prefix)
@@ -152,6 +153,7 @@ class StatsDB(plugins.ChannelUserDB):
             if (channel, id) not in self:
                 self[channel, id] = UserStat()
             self[channel, id].addMsg(msg)
+            self.markChanged(channel, id)
 
     def getChannelStats(self, channel):
         return self[channel, 'channelStats']
@@ -165,8 +167,6 @@ class ChannelStats(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(ChannelStats, self)
         self.__parent.__init__(irc)
-        self.lastmsg = None
-        self.laststate = None
         self.outFiltering = False
         self.db = StatsDB(filename)
         self._flush = self.db.flush
@@ -178,13 +178,6 @@ class ChannelStats(callbacks.Plugin):
         self.__parent.die()
 
     def __call__(self, irc, msg):
-        try:
-            if self.lastmsg:
-                self.laststate.addMsg(irc, self.lastmsg)
-            else:
-                self.laststate = irc.state.copy()
-        finally:
-            self.lastmsg = msg
         self.db.addMsg(msg)
         super(ChannelStats, self).__call__(irc, msg)
 
@@ -205,6 +198,7 @@ class ChannelStats(callbacks.Plugin):
         oldUsers = self.db[channel, 'channelStats'].users
         newUsers = len(irc.state.channels[channel].users)
         self.db[channel, 'channelStats'].users = max(oldUsers, newUsers)
+        self.db.markChanged(channel, 'channelStats')
 
     def doJoin(self, irc, msg):
         self._setUsers(irc, msg.args[0])
@@ -217,15 +211,16 @@ class ChannelStats(callbacks.Plugin):
             id = ircdb.users.getUserId(msg.prefix)
         except KeyError:
             id = None
-        for (channel, c) in self.laststate.channels.iteritems():
-            if msg.nick in c.users:
-                if (channel, 'channelStats') not in self.db:
-                    self.db[channel, 'channelStats'] = ChannelStat()
-                self.db[channel, 'channelStats'].quits += 1
-                if id is not None:
-                    if (channel, id) not in self.db:
-                        self.db[channel, id] = UserStat()
-                    self.db[channel, id].quits += 1
+        for channel in msg.tagged('channels') or ():
+            if (channel, 'channelStats') not in self.db:
+                self.db[channel, 'channelStats'] = ChannelStat()
+            self.db[channel, 'channelStats'].quits += 1
+            self.db.markChanged(channel, 'channelStats')
+            if id is not None:
+                if (channel, id) not in self.db:
+                    self.db[channel, id] = UserStat()
+                self.db[channel, id].quits += 1
+                self.db.markChanged(channel, id)
 
     def doKick(self, irc, msg):
         (channel, nick, _) = msg.args
@@ -237,6 +232,7 @@ class ChannelStats(callbacks.Plugin):
         if (channel, id) not in self.db:
             self.db[channel, id] = UserStat()
         self.db.channels[channel][id].kicked += 1
+        self.db.markChanged(channel, id)
 
     def stats(self, irc, msg, args, channel, name):
         """[<channel>] [<name>]
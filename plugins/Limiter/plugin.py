@@ -66,7 +66,7 @@ class Limiter(callbacks.Plugin):
     doKick = doJoin
 
     def doQuit(self, irc, msg):
-        for channel in irc.state.channels:
+        for channel in msg.tagged('channels') or ():
             self._enforceLimit(irc, channel)
 
 
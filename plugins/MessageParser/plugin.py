@@ -40,6 +40,8 @@ import supybot.ircdb as ircdb
 import re
 import os
 import time
+import sre_parse
+import sre_constants
 
 #try:
     #import sqlite
@@ -61,6 +63,74 @@ import supybot.world as world
 import supybot.log as log
 
 
+def requiredLiteral(regexp):
+    """Returns (literal, ignoreCase), where literal is the longest string
+    which every match of regexp must contain, or None if there's no such
+    string we can be sure of.  If ignoreCase is True, the literal is
+    lowercase and should be looked for in lowercased text."""
+    try:
+        parsed = sre_parse.parse(regexp)
+    except (sre_constants.error, OverflowError):
+        return (None, False)
+    flags = parsed.pattern.flags
+    if flags & (sre_constants.SRE_FLAG_LOCALE | sre_constants.SRE_FLAG_UNICODE):
+        return (None, False)
+    ignoreCase = bool(flags & sre_constants.SRE_FLAG_IGNORECASE)
+    # Every item of the top-level sequence has to match, so any run of
+    # literals in it has to appear in the text.  Anything else (groups,
+    # repeats, classes, alternations) just ends the current run.
+    best = ''
+    current = []
+    for (op, av) in list(parsed) + [(None, None)]:
+        if op == sre_constants.LITERAL and av < 256:
+            current.append(chr(av))
+        else:
+            if len(current) > len(best):
+                best = ''.join(current)
+            current = []
+    if not best:
+        return (None, False)
+    if ignoreCase:
+        best = best.lower()
+    return (best, ignoreCase)
+
+
+class TriggerSet(object):
+    """The compiled triggers for one database.  Each trigger's required
+    literal is checked with a plain substring test before its regexp is
+    run, so most messages only run a handful of regexps."""
+    def __init__(self, triggers):
+        self.triggers = []
+        for (regexp, action) in triggers:
+            try:
+                compiled = re.compile(regexp)
+            except Exception, e:
+                log.warning('MessageParser: Invalid regexp %q in database: %s',
+                            regexp, e)
+                continue
+            (literal, ignoreCase) = requiredLiteral(regexp)
+            self.triggers.append((literal, ignoreCase,
+                                  regexp, compiled, action))
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def candidates(self, text):
+        """Yields the (regexp, compiled, action) triggers which might match
+        text, in the order they were added."""
+        lowered = None
+        for (literal, ignoreCase, regexp, compiled, action) in self.triggers:
+            if literal is not None:
+                if ignoreCase:
+                    if lowered is None:
+                        lowered = text.lower()
+                    if literal not in lowered:
+                        continue
+                elif literal not in text:
+                    continue
+            yield (regexp, compiled, action)
+
+
 class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     """This plugin can set regexp triggers to activate the bot.
     Use 'add' command to add regexp trigger, 'remove' to remove."""
@@ -68,6 +138,15 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     def __init__(self, irc):
         callbacks.Plugin.__init__(self, irc)
         plugins.ChannelDBHandler.__init__(self)
+        self.triggerSets = ircutils.IrcDict()
+        self.ranks = ircutils.IrcDict()
+        self.ranksLock = threading.Lock()
+        world.flushers.append(self._flush)
+
+    def die(self):
+        world.flushers.remove(self._flush)
+        self._flush()
+        callbacks.Plugin.die(self)
     
     def makeDb(self, filename):
         """Create the database and connect to it."""
@@ -105,16 +184,74 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         db.isolation_level = None
         return db
     
+    def _dbName(self, channel):
+        # Linked channels share a database, so they share its triggers too.
+        if self.registryValue('global'):
+            return 'global'
+        return plugins.getChannel(channel)
+
+    def _getTriggerSet(self, channel):
+        name = self._dbName(channel)
+        try:
+            return self.triggerSets[name]
+        except KeyError:
+            db = self.getDb(channel)
+            cursor = db.cursor()
+            cursor.execute("SELECT regexp, action FROM triggers")
+            triggerSet = TriggerSet(cursor.fetchall())
+            self.triggerSets[name] = triggerSet
+            return triggerSet
+
+    def _invalidateTriggerSet(self, channel):
+        self.triggerSets.pop(self._dbName(channel), None)
+
     def _updateRank(self, channel, regexp):
+        # Usage counts are kept in memory and written out by _flush, rather
+        # than costing a commit for every matching message.
         if self.registryValue('keepRankInfo', channel):
+            self.ranksLock.acquire()
+            try:
+                counts = self.ranks.setdefault(channel, {})
+                counts[regexp] = counts.get(regexp, 0) + 1
+            finally:
+                self.ranksLock.release()
+
+    def _flush(self):
+        self.ranksLock.acquire()
+        try:
+            ranks = self.ranks
+            self.ranks = ircutils.IrcDict()
+        finally:
+            self.ranksLock.release()
+        for (channel, counts) in ranks.iteritems():
             db = self.getDb(channel)
             cursor = db.cursor()
-            cursor.execute("""SELECT usage_count
-                      FROM triggers
-                      WHERE regexp=?""", (regexp,))
-            old_count = cursor.fetchall()[0][0]
-            cursor.execute("UPDATE triggers SET usage_count=? WHERE regexp=?", (old_count + 1, regexp,))
-            db.commit()
+            try:
+                cursor.execute("BEGIN")
+                cursor.executemany("""UPDATE triggers
+                                      SET usage_count=usage_count+?
+                                      WHERE regexp=?""",
+                                   [(count, regexp)
+                                    for (regexp, count) in counts.iteritems()])
+                cursor.execute("COMMIT")
+            except sqlite3.Error, e:
+                self.log.warning('Unable to write rank info for %s, will '
+                                 'try again on the next flush: %s',
+                                 channel, e)
+                try:
+                    cursor.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass # No transaction was started.
+                self._unflushedRanks(channel, counts)
+
+    def _unflushedRanks(self, channel, counts):
+        self.ranksLock.acquire()
+        try:
+            unflushed = self.ranks.setdefault(channel, {})
+            for (regexp, count) in counts.iteritems():
+                unflushed[regexp] = unflushed.get(regexp, 0) + count
+        finally:
+            self.ranksLock.release()
     
     def _runCommandFunction(self, irc, msg, command):
         """Run a command from message, as if command was sent over IRC."""
@@ -147,14 +284,12 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             if callbacks.addressed(irc.nick, msg): #message is direct command
                 return
             actions = []
-            db = self.getDb(channel)
-            cursor = db.cursor()
-            cursor.execute("SELECT regexp, action FROM triggers")
-            results = cursor.fetchall()
-            if len(results) == 0:
+            triggerSet = self._getTriggerSet(channel)
+            if len(triggerSet) == 0:
                 return
-            for (regexp, action) in results:
-                for match in re.finditer(regexp, msg.args[1]):
+            for (regexp, compiled, action) in \
+                    triggerSet.candidates(msg.args[1]):
+                for match in compiled.finditer(msg.args[1]):
                     if match is not None:
                         thisaction = action
                         self._updateRank(channel, regexp)
@@ -198,6 +333,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
                               (NULL, ?, ?, ?, ?, ?, ?)""",
                             (regexp, name, int(time.time()), usage_count, action, locked,))
             db.commit()
+            self._invalidateTriggerSet(channel)
             irc.replySuccess()
         else:
             irc.error('That trigger is locked.')
@@ -236,6 +372,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         
         cursor.execute("""DELETE FROM triggers WHERE id=?""", (id,))
         db.commit()
+        self._invalidateTriggerSet(channel)
         irc.replySuccess()
     remove = wrap(remove, ['channel',
                             getopts({'id': '',}),
@@ -260,6 +397,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             return
         cursor.execute("UPDATE triggers SET locked=1 WHERE regexp=?", (regexp,))
         db.commit()
+        self._invalidateTriggerSet(channel)
         irc.replySuccess()
     lock = wrap(lock, ['channel', 'text'])
 
@@ -282,6 +420,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             return
         cursor.execute("UPDATE triggers SET locked=0 WHERE regexp=?", (regexp,))
         db.commit()
+        self._invalidateTriggerSet(channel)
         irc.replySuccess()
     unlock = wrap(unlock, ['channel', 'text'])
 
@@ -321,6 +460,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         itself.
         If option --id specified, will retrieve by regexp id, not content.
         """
+        self._flush()
         db = self.getDb(channel)
         cursor = db.cursor()
         target = 'regexp'
@@ -382,6 +522,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         message isn't sent in the channel itself.
         """
         numregexps = self.registryValue('rankListLength', channel)
+        self._flush()
         db = self.getDb(channel)
         cursor = db.cursor()
         cursor.execute("""SELECT regexp, usage_count
@@ -35,6 +35,8 @@ try:
 except ImportError:
     from pysqlite2 import dbapi2 as sqlite3 # for python2.4
 
+MessageParser = plugin.loadPluginModule('MessageParser')
+
 
 class MessageParserTestCase(ChannelPluginTestCase):
     plugins = ('MessageParser','Utilities','User') 
@@ -89,6 +91,58 @@ class MessageParserTestCase(ChannelPluginTestCase):
         self.feedMsg('this message has some stuff in it')
         m = self.getMsg(' ')
         self.failUnless(str(m).startswith('PRIVMSG #test :i saw some stuff'))
+
+    def testTriggerSetRebuilt(self):
+        self.assertNotError('messageparser add "(?i)hello (\w+)" "echo hi $1"')
+        self.assertNotError('messageparser add "fo+|bar" "echo foobar"')
+        self.feedMsg('HELLO there')
+        m = self.getMsg(' ')
+        self.failUnless(str(m).startswith('PRIVMSG #test :hi there'))
+        self.feedMsg('this is a bar')
+        m = self.getMsg(' ')
+        self.failUnless(str(m).startswith('PRIVMSG #test :foobar'))
+        self.assertNotError('messageparser remove "fo+|bar"')
+        self.feedMsg('this is a bar')
+        self.assertNoResponse(' ', 1)
+
+    def testLinkedChannelsShareTriggers(self):
+        channelSpecific = conf.supybot.databases.plugins.channelSpecific
+        orig = channelSpecific()
+        try:
+            channelSpecific.setValue(False)
+            self.feedMsg('some stuff', to='#other')
+            self.assertNoResponse(' ', 1)
+            self.assertNotError('messageparser add "stuff" "echo stuff"')
+            self.feedMsg('some stuff', to='#other')
+            m = self.getMsg(' ')
+            self.failUnless(str(m).startswith('PRIVMSG #other :stuff'))
+        finally:
+            channelSpecific.setValue(orig)
+
+    def testFailedRankFlushIsRetried(self):
+        self.assertNotError('messageparser add "stuff" "echo i saw some stuff"')
+        self.feedMsg('this message has some stuff in it')
+        self.getMsg(' ')
+        cb = self.irc.getCallback('MessageParser')
+        def getDb(channel):
+            db = sqlite3.connect(':memory:') # Has no triggers table.
+            db.isolation_level = None
+            return db
+        cb.getDb = getDb
+        try:
+            cb._flush()
+        finally:
+            del cb.getDb
+        self.assertRegexp('messageparser info "stuff"',
+                          'has been triggered 1 times')
+
+    def testRequiredLiteral(self):
+        requiredLiteral = MessageParser.plugin.requiredLiteral
+        self.assertEqual(requiredLiteral('foo'), ('foo', False))
+        self.assertEqual(requiredLiteral('a+b(c)defg'), ('defg', False))
+        self.assertEqual(requiredLiteral('(?i)FooBar'), ('foobar', True))
+        self.assertEqual(requiredLiteral('foo|bar'), (None, False))
+        self.assertEqual(requiredLiteral('fo*'), ('f', False))
     
     def testLock(self):
         self.assertNotError('messageparser add "stuff" "echo i saw some stuff"')
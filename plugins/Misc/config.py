@@ -50,6 +50,10 @@ conf.registerGlobalValue(Misc, 'timestampFormat',
     for the time module to see what formats are accepted. If you set this
     variable to the empty string, the timestamp will not be shown."""))
 conf.registerGroup(Misc, 'last')
+conf.registerGlobalValue(Misc.last, 'regexpTimeout',
+    registry.PositiveFloat(0.5, """Determines how many seconds the last command
+    will spend searching its history for a --regexp before giving up, since
+    specially crafted regexps can take exponential time."""))
 conf.registerGroup(Misc.last, 'nested')
 conf.registerChannelValue(Misc.last.nested,
     'includeTimestamp', registry.Boolean(False, """Determines whether or not
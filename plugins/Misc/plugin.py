@@ -272,6 +272,41 @@ class Misc(callbacks.Plugin):
                msg.command == 'PRIVMSG' and \
                ircutils.isChannel(msg.args[0])
 
+    def _predicateFilter(self, iterable, predicates):
+        """Yields the messages in iterable that satisfy all of predicates."""
+        for m in iterable:
+            for predicate in predicates:
+                if not predicate(m):
+                    break
+            else:
+                yield m
+
+    def _regexpFilter(self, irc, iterable, predicates, regexps, nolimit):
+        """Returns the messages in iterable that satisfy all of predicates and
+        all of regexps.  The regexps are all searched for at once in a
+        subprocess, since specially crafted regexps can take exponential time
+        and hang up the bot.  If that takes too long, replies with an error
+        and returns None."""
+        messages = list(self._predicateFilter(iterable, predicates))
+        texts = []
+        for m in messages:
+            if ircmsgs.isAction(m):
+                texts.append(ircmsgs.unAction(m))
+            else:
+                texts.append(m.args[1])
+        if nolimit:
+            limit = None
+        else:
+            limit = 1
+        try:
+            indexes = commands.regexp_filter_wrapper(texts, regexps,
+                            self.registryValue('last.regexpTimeout'),
+                            self.name(), 'last', limit=limit)
+        except commands.ProcessTimeoutError:
+            irc.error('Your regexp took too long to search my history.')
+            return None
+        return [messages[i] for i in indexes]
+
     def last(self, irc, msg, args, optlist):
         """[--{from,in,on,with,without,regexp} <value>] [--nolimit]
 
@@ -284,6 +319,7 @@ class Misc(callbacks.Plugin):
         given in is searched.
         """
         predicates = {}
+        regexps = []
         nolimit = False
         skipfirst = True
         if ircutils.isChannel(msg.args[0]):
@@ -315,29 +351,7 @@ class Misc(callbacks.Plugin):
                     return arg.lower() not in m.args[1].lower()
                 predicates.setdefault('without', []).append(f)
             elif option == 'regexp':
-                def f(m, arg=arg):
-                    def f1(s, arg):
-                        """Since we can't enqueue match objects into the multiprocessing queue,
-                        we'll just wrap the function to return bools."""
-                        if arg.search(s) is not None:
-                            return True
-                        else:
-                            return False
-                    if ircmsgs.isAction(m):
-                        m1 = ircmsgs.unAction(m)
-                        #return arg.search(ircmsgs.unAction(m))
-                    else:
-                        m1 = m.args[1]
-                        #return arg.search(m.args[1])
-                    try:
-                        # use a subprocess here, since specially crafted regexps can
-                        # take exponential time and hang up the bot.
-                        # timeout of 0.1 should be more than enough for any normal regexp.
-                        v = commands.process(f1, m1, arg, timeout=0.1, pn=self.name(), cn='last')
-                        return v
-                    except commands.ProcessTimeoutError:
-                        return False
-                predicates.setdefault('regexp', []).append(f)
+                regexps.append(arg)
             elif option == 'nolimit':
                 nolimit = True
         iterable = ifilter(self._validLastMsg, reversed(irc.state.history))
@@ -369,20 +383,23 @@ class Misc(callbacks.Plugin):
             showNick = False
         else:
             showNick = True
+        if regexps:
+            iterable = self._regexpFilter(irc, iterable, predicates, regexps,
+                                          nolimit)
+            if iterable is None:
+                return
+        else:
+            iterable = self._predicateFilter(iterable, predicates)
         for m in iterable:
-            for predicate in predicates:
-                if not predicate(m):
-                    break
+            if nolimit:
+                resp.append(ircmsgs.prettyPrint(m,
+                                                timestampFormat=tsf,
+                                                showNick=showNick))
             else:
-                if nolimit:
-                    resp.append(ircmsgs.prettyPrint(m,
-                                                    timestampFormat=tsf,
-                                                    showNick=showNick))
-                else:
-                    irc.reply(ircmsgs.prettyPrint(m,
-                                                  timestampFormat=tsf,
-                                                  showNick=showNick))
-                    return
+                irc.reply(ircmsgs.prettyPrint(m,
+                                              timestampFormat=tsf,
+                                              showNick=showNick))
+                return
         if not resp:
             irc.error('I couldn\'t find a message matching that criteria in '
                       'my history of %s messages.' % len(irc.state.history))
@@ -173,6 +173,17 @@ class MiscTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.plugins.Misc.timestampFormat.setValue(orig)
 
+    def testLastRegexp(self):
+        self.feedMsg('foo bar baz')
+        self.feedMsg('foo qux')
+        self.assertRegexp('last --nolimit --regexp m/foo/ --regexp m/ba/',
+                          'foo bar baz')
+        self.assertNotRegexp('last --nolimit --regexp m/foo/ --regexp m/ba/',
+                             'foo qux')
+        self.feedMsg('a'*40 + 'b')
+        self.assertRegexp('last --regexp m/(a+)+$/', 'too long')
+        self.assertRegexp('last --regexp m/qux/', 'foo qux')
+
     def testNestedLastTimestampConfig(self):
         tsConfig = conf.supybot.plugins.Misc.last.nested.includeTimestamp
         orig = tsConfig()
@@ -88,6 +88,7 @@ class Network(callbacks.Plugin):
         newIrc = Owner._connect(network, serverPort=serverPort,
                                 password=password, ssl=ssl)
         conf.supybot.networks().add(network)
+        registry.changed()
         assert newIrc.callbacks is irc.callbacks, 'callbacks list is different'
         irc.replySuccess('Connection to %s initiated.' % network)
     connect = wrap(connect, ['owner', getopts({'ssl': ''}), 'something',
@@ -106,6 +107,7 @@ class Network(callbacks.Plugin):
         otherIrc.queueMsg(ircmsgs.quit(quitMsg))
         otherIrc.die()
         conf.supybot.networks().discard(otherIrc.network)
+        registry.changed()
         if otherIrc != irc:
             irc.replySuccess('Disconnection to %s initiated.' %
                              otherIrc.network)
@@ -101,7 +101,9 @@ class DbiNewsDB(plugins.DbiChannelDB):
             (news.subject, news.text) = s.split(': ', 1)
             self.set(id, news)
 
-NewsDB = plugins.DB('News', {'flat': DbiNewsDB})
+NewsDB = plugins.DB('News', {'flat': DbiNewsDB,
+                             'indexed': plugins.withMapping(DbiNewsDB,
+                                                            'indexed')})
 
 class News(callbacks.Plugin):
     def __init__(self, irc):
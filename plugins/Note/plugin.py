@@ -117,7 +117,9 @@ class DbiNoteDB(dbi.DB):
                 while id in ids:
                     ids.remove(id)
 
-NoteDB = plugins.DB('Note', {'flat': DbiNoteDB})
+NoteDB = plugins.DB('Note', {'flat': DbiNoteDB,
+                             'indexed': plugins.withMapping(DbiNoteDB,
+                                                            'indexed')})
 
 class Note(callbacks.Plugin):
     def __init__(self, irc):
@@ -72,6 +72,7 @@ def registerRename(plugin, command=None, newName=None):
             in this plugin are to be renamed."""))
     if command is not None:
         g().add(command)
+        registry.changed()
         v = conf.registerGlobalValue(g, command, registry.String('', ''))
         if newName is not None:
             v.setValue(newName) # In case it was already registered.
@@ -87,6 +88,7 @@ def renameCommand(cb, name, newName):
         method = getattr(cb.__class__, name)
         setattr(cb.__class__, newName, method)
         delattr(cb.__class__, name)
+        callbacks.invalidateCommandIndex()
 
 
 registerDefaultPlugin('list', 'Misc')
@@ -507,10 +509,12 @@ class Owner(callbacks.Plugin):
         """
         if action == 'add':
             conf.supybot.capabilities().add(capability)
+            registry.changed()
             irc.replySuccess()
         elif action == 'remove':
             try:
                 conf.supybot.capabilities().remove(capability)
+                registry.changed()
                 irc.replySuccess()
             except KeyError:
                 if ircdb.isAntiCapability(capability):
@@ -519,6 +523,7 @@ class Owner(callbacks.Plugin):
                 else:
                     anticap = ircdb.makeAntiCapability(capability)
                     conf.supybot.capabilities().add(anticap)
+                    registry.changed()
                     irc.replySuccess()
     defaultcapability = wrap(defaultcapability,
                              [('literal', ['add','remove']), 'capability'])
@@ -539,6 +544,7 @@ class Owner(callbacks.Plugin):
             if plugin.isCommand(command):
                 pluginCommand = '%s.%s' % (plugin.name(), command)
                 conf.supybot.commands.disabled().add(pluginCommand)
+                registry.changed()
                 plugin._disabled.add(command)
             else:
                 irc.error('%s is not a command in the %s plugin.' %
@@ -546,6 +552,7 @@ class Owner(callbacks.Plugin):
                 return
         else:
             conf.supybot.commands.disabled().add(command)
+            registry.changed()
             self._disabled.add(command)
         irc.replySuccess()
     disable = wrap(disable, [optional('plugin'), 'commandName'])
@@ -564,6 +571,7 @@ class Owner(callbacks.Plugin):
             else:
                 self._disabled.remove(command)
             conf.supybot.commands.disabled().remove(command)
+            registry.changed()
             irc.replySuccess()
         except KeyError:
             irc.error('That command wasn\'t disabled.')
@@ -30,8 +30,11 @@
 
 from supybot.test import *
 
+import os
+
 import supybot.conf as conf
 import supybot.plugin as plugin
+import supybot.registry as registry
 
 class OwnerTestCase(PluginTestCase):
     plugins = ('Owner', 'Config', 'Misc', 'Admin')
@@ -70,6 +73,20 @@ class OwnerTestCase(PluginTestCase):
         self.assertNotError('load Channel')
         self.assertNotError('unload CHANNEL')
 
+    def testDefaultCapabilityIsWritten(self):
+        filename = conf.supybot.directories.conf.dirize('Owner.conf')
+        registry.close(conf.supybot, filename)
+        try:
+            self.assertNotError('defaultcapability add -foo')
+            s = registry.snapshot(conf.supybot, filename)
+            self.failUnless(s and '-foo' in s)
+            self.assertNotError('defaultcapability remove -foo')
+            s = registry.snapshot(conf.supybot, filename)
+            self.failUnless(s and '-foo' not in s)
+        finally:
+            conf.supybot.capabilities().discard('-foo')
+            os.remove(filename)
+
     def testDisable(self):
         self.assertError('disable enable')
         self.assertError('disable identify')
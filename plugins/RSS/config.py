@@ -108,6 +108,15 @@ conf.registerChannelValue(RSS.announce, 'showPubDate',
 conf.registerGlobalValue(RSS.announce, 'cachePeriod',
     registry.PositiveInteger(604800, """Maximum age of cached RSS headlines,
     in seconds. Headline cache is used to avoid re-announcing old news."""))
+conf.registerGlobalValue(RSS.announce, 'checkInterval',
+    registry.PositiveInteger(60, """Determines how often, in seconds, the bot
+    checks whether any announced feeds are due to be fetched again.  Feeds are
+    still only fetched every supybot.plugins.RSS.waitPeriod seconds.  Changes
+    take effect when the plugin is reloaded."""))
+conf.registerGlobalValue(RSS.announce, 'fetchers',
+    registry.PositiveInteger(4, """Determines how many announced feeds the bot
+    will fetch at once.  Changes take effect when the plugin is
+    reloaded."""))
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
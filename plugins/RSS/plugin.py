@@ -30,6 +30,7 @@
 
 import new
 import time
+import random
 import socket
 import sgmllib
 import threading
@@ -39,7 +40,9 @@ import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
 from supybot.commands import *
+import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
+import supybot.schedule as schedule
 import supybot.registry as registry
 import supybot.callbacks as callbacks
 
@@ -63,16 +66,27 @@ class RSS(callbacks.Plugin):
     the "add" command to add feeds to this plugin, and use the "announce"
     command to determine what feeds should be announced in a given channel."""
     threaded = True
+    # Each feed's next fetch is moved by up to this fraction of waitPeriod, so
+    # feeds added at the same time don't stay in lockstep.
+    jitter = 0.1
+    # Failing feeds wait at most this many waitPeriods between fetches.
+    maximumBackoff = 8
     def __init__(self, irc):
         self.__parent = super(RSS, self)
         self.__parent.__init__(irc)
         # Schema is feed : [url, command]
         self.feedNames = callbacks.CanonicalNameDict()
         self.locks = {}
-        self.lastRequest = {}
+        self.nextRequest = {}
+        self.failures = {}
+        self.etags = {}
+        self.modified = {}
+        self.fetching = set()
         self.cachedFeeds = {}
         self.cachedHeadlines = {}
         self.gettingLockLock = threading.Lock()
+        self.fetchers = world.ThreadPool(self.registryValue('announce.fetchers'),
+                                         name='RSS fetcher')
         for name in self.registryValue('feeds'):
             self._registerFeed(name)
             try:
@@ -81,7 +95,19 @@ class RSS(callbacks.Plugin):
                 self.log.warning('%s is not a registered feed, removing.',name)
                 continue
             self.makeFeedCommand(name, url)
-            self.getFeed(url) # So announced feeds don't announce on startup.
+            # So announced feeds don't announce on startup.
+            self.fetchers.submit(self.getFeed, url)
+        schedule.addPeriodicEvent(self._checkFeeds,
+                                  self.registryValue('announce.checkInterval'),
+                                  'RSS.checkFeeds', now=False)
+
+    def die(self):
+        try:
+            schedule.removeEvent('RSS.checkFeeds')
+        except KeyError:
+            pass
+        self.fetchers.stop()
+        self.__parent.die()
 
     def isCommandMethod(self, name):
         if not self.__parent.isCommandMethod(name):
@@ -106,38 +132,28 @@ class RSS(callbacks.Plugin):
         group = self.registryValue('feeds', value=False)
         conf.registerGlobalValue(group, name, registry.String(url, ''))
 
-    def __call__(self, irc, msg):
-        self.__parent.__call__(irc, msg)
-        irc = callbacks.SimpleProxy(irc, msg)
+    def _checkFeeds(self):
+        """Run periodically by the scheduler; hands each announced feed that's
+        due for a fetch to our fetcher threads."""
         newFeeds = {}
-        for channel in irc.state.channels:
-            feeds = self.registryValue('announce', channel)
-            for name in feeds:
-                commandName = callbacks.canonicalName(name)
-                if self.isCommandMethod(commandName):
-                    url = self.feedNames[commandName][0]
-                else:
-                    url = name
-                if self.willGetNewFeed(url):
-                    newFeeds.setdefault((url, name), []).append(channel)
-        for ((url, name), channels) in newFeeds.iteritems():
-            # We check if we can acquire the lock right here because if we
-            # don't, we'll possibly end up spawning a lot of threads to get
-            # the feed, because this thread may run for a number of bytecodes
-            # before it switches to a thread that'll get the lock in
-            # _newHeadlines.
-            if self.acquireLock(url, blocking=False):
-                try:
-                    t = threading.Thread(target=self._newHeadlines,
-                                         name=format('Fetching %u', url),
-                                         args=(irc, channels, name, url))
-                    self.log.info('Checking for announcements at %u', url)
-                    world.threadsSpawned += 1
-                    t.setDaemon(True)
-                    t.start()
-                finally:
-                    self.releaseLock(url)
-                    time.sleep(0.1) # So other threads can run.
+        for irc in world.ircs:
+            if irc.zombie:
+                continue
+            for channel in irc.state.channels:
+                feeds = self.registryValue('announce', channel)
+                for name in feeds:
+                    commandName = callbacks.canonicalName(name)
+                    if self.isCommandMethod(commandName):
+                        url = self.feedNames[commandName][0]
+                    else:
+                        url = name
+                    if url not in self.fetching and self.willGetNewFeed(url):
+                        L = newFeeds.setdefault((url, name), [])
+                        L.append((irc, channel))
+        for ((url, name), targets) in newFeeds.iteritems():
+            self.log.info('Checking for announcements at %u', url)
+            self.fetching.add(url)
+            self.fetchers.submit(self._newHeadlines, targets, name, url)
 
     def buildHeadlines(self, headlines, channel, linksconfig='announce.showLinks', dateconfig='announce.showPubDate'):
         newheadlines = []
@@ -159,7 +175,7 @@ class RSS(callbacks.Plugin):
                                        pubDate))
         return newheadlines
 
-    def _newHeadlines(self, irc, channels, name, url):
+    def _newHeadlines(self, targets, name, url):
         try:
             # We acquire the lock here so there's only one announcement thread
             # in this code at any given time.  Otherwise, several announcement
@@ -208,7 +224,7 @@ class RSS(callbacks.Plugin):
                             v = False
                             break
                     return v
-                for channel in channels:
+                for (irc, channel) in targets:
                     if len(oldheadlines) == 0:
                         channelnewheadlines = newheadlines[:self.registryValue('initialAnnounceHeadlines', channel)]
                     else:
@@ -220,7 +236,7 @@ class RSS(callbacks.Plugin):
                     if len(blacklist) != 0:
                         channelnewheadlines = filter(filter_blacklist, channelnewheadlines)
                     if len(channelnewheadlines) == 0:
-                        return
+                        continue
                     bold = self.registryValue('bold', channel)
                     sep = self.registryValue('headlineSeparator', channel)
                     prefix = self.registryValue('announcementPrefix', channel)
@@ -229,18 +245,31 @@ class RSS(callbacks.Plugin):
                         pre = ircutils.bold(pre)
                         sep = ircutils.bold(sep)
                     headlines = self.buildHeadlines(channelnewheadlines, channel)
-                    irc.replies(headlines, prefixer=pre, joiner=sep,
+                    msg = ircmsgs.IrcMsg(prefix=irc.prefix, command='PRIVMSG',
+                                         args=(channel, name))
+                    proxy = callbacks.SimpleProxy(irc, msg)
+                    proxy.replies(headlines, prefixer=pre, joiner=sep,
                                 to=channel, prefixNick=False, private=True)
         finally:
             self.releaseLock(url)
+            self.fetching.discard(url)
 
     def willGetNewFeed(self, url):
-        now = time.time()
+        return time.time() >= self.nextRequest.get(url, 0)
+
+    def _scheduleNextRequest(self, url, failed=False):
         wait = self.registryValue('waitPeriod')
-        if url not in self.lastRequest or now - self.lastRequest[url] > wait:
-            return True
+        if failed:
+            # If there's a problem retrieving the feed, we back off, starting
+            # at half the usual wait, so there's time for the problem to be
+            # resolved without hammering the site meanwhile.
+            failures = self.failures.get(url, 0) + 1
+            self.failures[url] = failures
+            wait = min(wait * 2**(failures-2), wait * self.maximumBackoff)
         else:
-            return False
+            self.failures.pop(url, None)
+        wait *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.nextRequest[url] = time.time() + wait
 
     def acquireLock(self, url, blocking=True):
         try:
@@ -266,33 +295,42 @@ class RSS(callbacks.Plugin):
             # and DoS the website in question.
             self.acquireLock(url)
             if self.willGetNewFeed(url):
+                results = {}
                 try:
                     self.log.debug('Downloading new feed from %u', url)
-                    results = feedparser.parse(url)
+                    # We only get the feed itself back if it's changed since
+                    # the last time we got it.
+                    results = feedparser.parse(url,
+                                               etag=self.etags.get(url),
+                                               modified=self.modified.get(url),
+                                               handlers=utils.web.handlers)
                     if 'bozo_exception' in results:
                         raise results['bozo_exception']
                 except sgmllib.SGMLParseError:
+                    self._scheduleNextRequest(url, failed=True)
                     self.log.exception('Uncaught exception from feedparser:')
                     raise callbacks.Error, 'Invalid (unparsable) RSS feed.'
                 except socket.timeout:
+                    self._scheduleNextRequest(url, failed=True)
                     return error('Timeout downloading feed.')
                 except Exception, e:
                     # These seem mostly harmless.  We'll need reports of a
                     # kind that isn't.
                     self.log.debug('Allowing bozo_exception %r through.', e)
-                if results.get('feed', {}):
+                if results.get('status') == 304 and url in self.cachedFeeds:
+                    self.log.debug('%u has not changed.', url)
+                    self._scheduleNextRequest(url)
+                elif results.get('feed', {}):
                     self.cachedFeeds[url] = results
-                    self.lastRequest[url] = time.time()
+                    self.etags[url] = results.get('etag')
+                    self.modified[url] = results.get('modified')
+                    self._scheduleNextRequest(url)
                 else:
                     self.log.debug('Not caching results; feed is empty.')
+                    self._scheduleNextRequest(url, failed=True)
             try:
                 return self.cachedFeeds[url]
             except KeyError:
-                wait = self.registryValue('waitPeriod')
-                # If there's a problem retrieving the feed, we should back off
-                # for a little bit before retrying so that there is time for
-                # the error to be resolved.
-                self.lastRequest[url] = time.time() - .5 * wait
                 return error('Unable to download feed.')
         finally:
             self.releaseLock(url)
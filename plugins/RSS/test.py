@@ -42,6 +42,46 @@ class RSSTestCase(ChannelPluginTestCase):
     def testCantRemoveMethodThatIsntFeed(self):
         self.assertError('rss remove rss')
 
+    def testAnnounceIsScheduled(self):
+        filename = conf.supybot.directories.data.dirize('announce.rss')
+        fd = file(filename, 'w')
+        fd.write('<?xml version="1.0"?><rss version="2.0"><channel>'
+                 '<title>Test</title><link>http://example.com/</link>'
+                 '<item><title>First headline</title></item>'
+                 '</channel></rss>')
+        fd.close()
+        cb = self.irc.getCallback('RSS')
+        announce = conf.supybot.plugins.RSS.announce.get(self.channel)
+        announce.setValue(set([filename]))
+        try:
+            # Messages don't cause feeds to be checked anymore.
+            self.feedMsg('foo', to=self.channel)
+            self.failUnless(cb.willGetNewFeed(filename))
+            cb._checkFeeds()
+            m = None
+            start = time.time()
+            while m is None and time.time() - start < 5:
+                m = self.irc.takeMsg()
+                time.sleep(0.05)
+            self.failUnless(m is not None, 'No announcement.')
+            self.failUnless('First headline' in m.args[1])
+            self.failIf(cb.willGetNewFeed(filename))
+        finally:
+            announce.setValue(set())
+
+    def testBackoff(self):
+        cb = self.irc.getCallback('RSS')
+        wait = conf.supybot.plugins.RSS.waitPeriod()
+        waits = []
+        for i in range(6):
+            cb._scheduleNextRequest('http://example.com/', failed=True)
+            waits.append(cb.nextRequest['http://example.com/'] - time.time())
+        self.failUnless(waits[0] < wait)
+        self.failUnless(waits[2] > wait)
+        self.failUnless(waits[5] <= wait * cb.maximumBackoff * 1.2)
+        cb._scheduleNextRequest('http://example.com/')
+        self.failIf('http://example.com/' in cb.failures)
+
     if network:
         def testRssinfo(self):
             self.assertNotError('rss info %s' % url)
@@ -33,6 +33,7 @@ import time
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
+import supybot.registry as registry
 from supybot.commands import *
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
@@ -46,21 +47,9 @@ class Relay(callbacks.Plugin):
         self.__parent = super(Relay, self)
         self.__parent.__init__(irc)
         self._whois = {}
-        self.lastmsg = {}
-        self.ircstates = {}
         self.queuedTopics = MultiSet()
         self.lastRelayMsgs = ircutils.IrcDict()
 
-    def __call__(self, irc, msg):
-        try:
-            irc = self._getRealIrc(irc)
-            if irc not in self.ircstates:
-                self._addIrc(irc)
-            self.ircstates[irc].addMsg(irc, self.lastmsg[irc])
-        finally:
-            self.lastmsg[irc] = msg
-        self.__parent.__call__(irc, msg)
-
     def do376(self, irc, msg):
         networkGroup = conf.supybot.networks.get(irc.network)
         for channel in self.registryValue('channels'):
@@ -79,19 +68,6 @@ class Relay(callbacks.Plugin):
         # We should allow abbreviations at some point.
         return irc.network
 
-    def _addIrc(self, irc):
-        # Let's just be extra-special-careful here.
-        if irc not in self.ircstates:
-            self.ircstates[irc] = irclib.IrcState()
-        if irc not in self.lastmsg:
-            self.lastmsg[irc] = ircmsgs.ping('this is just a fake message')
-        if irc.afterConnect:
-            # We've probably been reloaded.  Let's send some messages to get
-            # our IrcState objects up to current.
-            for channel in self.registryValue('channels'):
-                irc.queueMsg(ircmsgs.who(channel))
-                irc.queueMsg(ircmsgs.names(channel))
-
     def join(self, irc, msg, args, channel):
         """[<channel>]
 
@@ -103,6 +79,7 @@ class Relay(callbacks.Plugin):
         the message was sent in.
         """
         self.registryValue('channels').add(channel)
+        registry.changed()
         for otherIrc in world.ircs:
             if channel not in otherIrc.state.channels:
                 networkGroup = conf.supybot.networks.get(otherIrc.network)
@@ -118,6 +95,7 @@ class Relay(callbacks.Plugin):
         channel.
         """
         self.registryValue('channels').discard(channel)
+        registry.changed()
         for otherIrc in world.ircs:
             if channel in otherIrc.state.channels:
                 otherIrc.queueMsg(ircmsgs.part(channel))
@@ -440,11 +418,11 @@ class Relay(callbacks.Plugin):
         newNick = msg.args[0]
         network = self._getIrcName(irc)
         s = format('nick change by %s to %s on %s', msg.nick,newNick,network)
+        channels = ircutils.IrcSet(irc.state.channelsOf(newNick))
         for channel in self.registryValue('channels'):
-            if channel in irc.state.channels:
-                if newNick in irc.state.channels[channel].users:
-                    m = self._msgmaker(channel, s)
-                    self._sendToOthers(irc, m)
+            if channel in channels:
+                m = self._msgmaker(channel, s)
+                self._sendToOthers(irc, m)
 
     def doTopic(self, irc, msg):
         irc = self._getRealIrc(irc)
@@ -481,11 +459,11 @@ class Relay(callbacks.Plugin):
             s = format('%s has quit %s (%s)', msg.nick, network, msg.args[0])
         else:
             s = format('%s has quit %s.', msg.nick, network)
+        channels = ircutils.IrcSet(msg.tagged('channels') or ())
         for channel in self.registryValue('channels'):
-            if channel in self.ircstates[irc].channels:
-                if msg.nick in self.ircstates[irc].channels[channel].users:
-                    m = self._msgmaker(channel, s)
-                    self._sendToOthers(irc, m)
+            if channel in channels:
+                m = self._msgmaker(channel, s)
+                self._sendToOthers(irc, m)
 
     def doError(self, irc, msg):
         irc = self._getRealIrc(irc)
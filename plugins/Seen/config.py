@@ -40,9 +40,9 @@ def configure(advanced):
 
 
 Seen = conf.registerPlugin('Seen')
-# This is where your configuration variables (if any) should go.  For example:
-# conf.registerGlobalValue(Seen, 'someConfigVariableName',
-#     registry.Boolean(False, """Help for someConfigVariableName."""))
+conf.registerChannelValue(Seen, 'maximumResults',
+    registry.PositiveInteger(20, """Determines how many of the nicks matching
+    a wildcard will be given, most recently seen first."""))
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -30,6 +30,8 @@
 
 import re
 import time
+import heapq
+import bisect
 
 import supybot.log as log
 import supybot.conf as conf
@@ -50,8 +52,75 @@ class IrcStringAndIntDict(utils.InsensitivePreservingDict):
         else:
             return ircutils.toLower(x)
 
+def trigrams(s):
+    return [s[i:i+3] for i in xrange(len(s) - 2)]
+
+class NickIndex(object):
+    """The nicks seen in a channel, lowered according to IRC case rules and
+    kept sorted, so those starting with a given prefix can be found by
+    bisection.  For wildcards without a prefix, an index of the nicks'
+    trigrams is built the first time it's needed."""
+    def __init__(self, nicks):
+        self.nicks = sorted(nicks)
+        self.trigrams = None
+
+    def add(self, nick):
+        i = bisect.bisect_left(self.nicks, nick)
+        if i == len(self.nicks) or self.nicks[i] != nick:
+            self.nicks.insert(i, nick)
+            if self.trigrams is not None:
+                for trigram in trigrams(nick):
+                    self.trigrams.setdefault(trigram, set()).add(nick)
+
+    def remove(self, nick):
+        i = bisect.bisect_left(self.nicks, nick)
+        if i < len(self.nicks) and self.nicks[i] == nick:
+            del self.nicks[i]
+            if self.trigrams is not None:
+                for trigram in trigrams(nick):
+                    self.trigrams[trigram].discard(nick)
+
+    def _buildTrigrams(self):
+        self.trigrams = {}
+        for nick in self.nicks:
+            for trigram in trigrams(nick):
+                self.trigrams.setdefault(trigram, set()).add(nick)
+
+    def candidates(self, parts):
+        """Returns the nicks that might match the wildcard whose (lowered)
+        parts between *s are given; any that are returned still have to be
+        checked against it."""
+        prefix = parts[0]
+        if prefix:
+            i = bisect.bisect_left(self.nicks, prefix)
+            L = []
+            while i < len(self.nicks) and self.nicks[i].startswith(prefix):
+                L.append(self.nicks[i])
+                i += 1
+            return L
+        wanted = set()
+        for part in parts:
+            wanted.update(trigrams(part))
+        if not wanted:
+            return self.nicks
+        if self.trigrams is None:
+            self._buildTrigrams()
+        sets = [self.trigrams.get(trigram, ()) for trigram in wanted]
+        sets.sort(key=len)
+        candidates = set(sets[0])
+        for nicks in sets[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(nicks)
+        return candidates
+
 class SeenDB(plugins.ChannelUserDB):
     IdDict = IrcStringAndIntDict
+    def __init__(self, *args, **kwargs):
+        # Built for a channel the first time it's searched with a wildcard.
+        self.nickIndexes = ircutils.IrcDict()
+        plugins.ChannelUserDB.__init__(self, *args, **kwargs)
+
     def serialize(self, v):
         return list(v)
 
@@ -59,28 +128,61 @@ class SeenDB(plugins.ChannelUserDB):
         (seen, saying) = L
         return (float(seen), saying)
 
+    def _isNick(self, id):
+        return isinstance(id, basestring) and id != '<last>'
+
+    def __setitem__(self, (channel, id), v):
+        plugins.ChannelUserDB.__setitem__(self, (channel, id), v)
+        if channel in self.nickIndexes and self._isNick(id):
+            self.nickIndexes[channel].add(ircutils.toLower(id))
+
+    def __delitem__(self, (channel, id)):
+        plugins.ChannelUserDB.__delitem__(self, (channel, id))
+        if channel in self.nickIndexes and self._isNick(id):
+            self.nickIndexes[channel].remove(ircutils.toLower(id))
+
     def update(self, channel, nickOrId, saying):
         seen = time.time()
         self[channel, nickOrId] = (seen, saying)
         self[channel, '<last>'] = (seen, saying)
 
-    def seenWildcard(self, channel, nick):
-        nicks = ircutils.IrcSet()
-        nickRe = re.compile('^%s$' % '.*'.join(nick.split('*')), re.I)
-        for (searchChan, searchNick) in self.keys():
-            #print 'chan: %s ... nick: %s' % (searchChan, searchNick)
-            if isinstance(searchNick, int):
-                # We need to skip the reponses that are keyed by id as they
-                # apparently duplicate the responses for the same person that
-                # are keyed by nick-string
-                continue
-            if ircutils.strEqual(searchChan, channel):
-                if nickRe.search(searchNick) is not None:
-                    nicks.add(searchNick)
-        L = [[nick, self.seen(channel, nick)] for nick in nicks]
-        def negativeTime(x):
-            return -x[1][0]
-        utils.sortBy(negativeTime, L)
+    def _nickIndex(self, channel):
+        try:
+            return self.nickIndexes[channel]
+        except KeyError:
+            # The IdDict's keys are already lowered.
+            ids = self.channels[channel].data
+            index = NickIndex([id for id in ids if self._isNick(id)])
+            self.nickIndexes[channel] = index
+            return index
+
+    def iterSeenWildcard(self, channel, nick):
+        """Yields the [nick, (seen, saying)] of each nick in channel matching
+        the given nick, in which * is a wildcard, most recently seen first."""
+        if channel not in self.channels:
+            return
+        ids = self.channels[channel]
+        parts = ircutils.toLower(nick).split('*')
+        nickRe = re.compile('^%s$' % '.*'.join(map(re.escape, parts)), re.S)
+        heap = []
+        for lowered in self._nickIndex(channel).candidates(parts):
+            if nickRe.match(lowered) is not None:
+                (searchNick, info) = ids.data[lowered]
+                heap.append((-info[0], searchNick, info))
+        heapq.heapify(heap)
+        while heap:
+            (_, searchNick, info) = heapq.heappop(heap)
+            yield [searchNick, info]
+
+    def seenWildcard(self, channel, nick, limit=None):
+        """Returns the [nick, (seen, saying)] of the nicks in channel matching
+        the given nick, in which * is a wildcard, most recently seen first.
+        If limit is given, no more than that many are returned."""
+        L = []
+        for x in self.iterSeenWildcard(channel, nick):
+            if limit is not None and len(L) >= limit:
+                break
+            L.append(x)
         return L
 
     def seen(self, channel, nickOrId):
@@ -96,8 +198,6 @@ class Seen(callbacks.Plugin):
         self.__parent.__init__(irc)
         self.db = SeenDB(filename)
         self.anydb = SeenDB(anyfilename)
-        self.lastmsg = {}
-        self.ircstates = {}
         world.flushers.append(self.db.flush)
         world.flushers.append(self.anydb.flush)
 
@@ -114,26 +214,6 @@ class Seen(callbacks.Plugin):
         self.anydb.close()
         self.__parent.die()
 
-    def __call__(self, irc, msg):
-        try:
-            if irc not in self.ircstates:
-                self._addIrc(irc)
-            self.ircstates[irc].addMsg(irc, self.lastmsg[irc])
-        finally:
-            self.lastmsg[irc] = msg
-        self.__parent.__call__(irc, msg)
-
-    def _addIrc(self, irc):
-        # Let's just be extra-special-careful here.
-        if irc not in self.ircstates:
-            self.ircstates[irc] = irclib.IrcState()
-        if irc not in self.lastmsg:
-            self.lastmsg[irc] = ircmsgs.ping('this is just a fake message')
-        if not world.testing:
-            for channel in irc.state.channels:
-                irc.queueMsg(ircmsgs.who(channel))
-                irc.queueMsg(ircmsgs.names(channel))
-
     def doPrivmsg(self, irc, msg):
         if ircmsgs.isCtcp(msg) and not ircmsgs.isAction(msg):
             return
@@ -161,25 +241,27 @@ class Seen(callbacks.Plugin):
     doJoin = doPart
     doKick = doPart
 
-    def doQuit(self, irc, msg):
+    def _updateChannels(self, msg, channels):
         said = ircmsgs.prettyPrint(msg)
-        if irc not in self.ircstates:
-            return
         try:
             id = ircdb.users.getUserId(msg.prefix)
         except KeyError:
             id = None # Not in the database.
-        for channel in self.ircstates[irc].channels:
-            if msg.nick in self.ircstates[irc].channels[channel].users:
-                self.anydb.update(channel, msg.nick, said)
-                if id is not None:
-                    self.anydb.update(channel, id, said)
+        for channel in channels:
+            self.anydb.update(channel, msg.nick, said)
+            if id is not None:
+                self.anydb.update(channel, id, said)
+
+    def doQuit(self, irc, msg):
+        # By now the nick is gone from irc.state; IrcState left us a note of
+        # where it was.
+        self._updateChannels(msg, msg.tagged('channels') or ())
     doNick = doQuit
 
     def doMode(self, irc, msg):
         # Filter out messages from network Services
         if msg.nick:
-            self.doQuit(irc, msg)
+            self._updateChannels(msg, irc.state.channelsOf(msg.nick))
     doTopic = doMode
 
     def _seen(self, irc, channel, name, any=False):
@@ -190,7 +272,8 @@ class Seen(callbacks.Plugin):
         try:
             results = []
             if '*' in name:
-                results = db.seenWildcard(channel, name)
+                limit = self.registryValue('maximumResults', channel)
+                results = db.seenWildcard(channel, name, limit)
             else:
                 results = [[name, db.seen(channel, name)]]
             if len(results) == 1:
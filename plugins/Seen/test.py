@@ -31,6 +31,8 @@ from supybot.test import *
 
 import supybot.ircdb as ircdb
 
+Seen = plugin.loadPluginModule('Seen')
+
 class ChannelDBTestCase(ChannelPluginTestCase):
     plugins = ('Seen', 'User')
     def setUp(self):
@@ -73,5 +75,46 @@ class ChannelDBTestCase(ChannelPluginTestCase):
         self.assertNotRegexp('seen user alsdkfjalsdfkj', 'KeyError')
 
 
+class SeenDBTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        filename = conf.supybot.directories.data.dirize('SeenDBTestCase.db')
+        self.db = Seen.plugin.SeenDB(filename)
+        for (i, nick) in enumerate(['foo', 'Foobar', 'barfoo', 'f[o]o',
+                                    'bar', 'baz']):
+            self.db['#test', nick] = (i, 'said %s' % nick)
+        self.db['#test', '<last>'] = (6, 'said baz')
+        self.db['#test', 1] = (5, 'said baz')
+        self.db['#other', 'fool'] = (7, 'said fool')
+
+    def nicks(self, nick, limit=None):
+        return [n for (n, _) in self.db.seenWildcard('#test', nick, limit)]
+
+    def testPrefix(self):
+        self.assertEqual(self.nicks('foo*'), ['Foobar', 'foo'])
+        self.assertEqual(self.nicks('FOO*'), ['Foobar', 'foo'])
+        self.assertEqual(self.nicks('foo*r'), ['Foobar'])
+        self.assertEqual(self.nicks('f{O}*'), ['f[o]o'])
+        self.assertEqual(self.nicks('qux*'), [])
+
+    def testInfix(self):
+        self.assertEqual(self.nicks('*foo*'), ['barfoo', 'Foobar', 'foo'])
+        self.assertEqual(self.nicks('*oo'), ['barfoo', 'foo'])
+        self.assertEqual(self.nicks('*ba*'), ['baz', 'bar', 'barfoo',
+                                              'Foobar'])
+        self.assertEqual(self.nicks('*'), ['baz', 'bar', 'f[o]o', 'barfoo',
+                                           'Foobar', 'foo'])
+
+    def testLimit(self):
+        self.assertEqual(self.nicks('*', limit=2), ['baz', 'bar'])
+
+    def testIndexIsUpdated(self):
+        self.assertEqual(self.nicks('*foo*'), ['barfoo', 'Foobar', 'foo'])
+        self.db.update('#test', 'FooQux', 'hi')
+        del self.db['#test', 'barfoo']
+        self.assertEqual(self.nicks('*foo*'), ['FooQux', 'Foobar', 'foo'])
+        self.assertEqual(self.nicks('fooq*'), ['FooQux'])
+
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -35,6 +35,7 @@ import config
 
 import supybot.conf as conf
 import supybot.utils as utils
+import supybot.registry as registry
 from supybot.commands import *
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
@@ -516,12 +517,14 @@ class Services(callbacks.Plugin):
         if not password:
             try:
                 self.registryValue('nicks').remove(nick)
+                registry.changed()
                 irc.replySuccess()
             except KeyError:
                 irc.error('That nick was not configured with a password.')
                 return
         else:
             self.registryValue('nicks').add(nick)
+            registry.changed()
             config.registerNick(nick, password)
             irc.replySuccess()
     password = wrap(password, [('checkCapability', 'admin'),
@@ -39,6 +39,7 @@ import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
 from supybot.commands import *
+import supybot.commands as supyCommands
 import supybot.callbacks as callbacks
 
 class Status(callbacks.Plugin):
@@ -127,6 +128,86 @@ class Status(callbacks.Plugin):
                    self.sentMsgs, self.sentBytes, irc.server, timeElapsed))
     net = wrap(net)
 
+    def queue(self, irc, msg, args):
+        """takes no arguments
+
+        Returns statistics about the bot's outgoing message queue on this
+        network.
+        """
+        q = irc.getRealIrc().queue
+        if q.sent:
+            average = q.totalWait / q.sent
+        else:
+            average = 0
+        irc.reply(format('I have %n waiting to be sent to %s; the oldest has '
+                         'been waiting %.2f seconds.  I have sent %n from '
+                         'the queue, waiting %.2f seconds on average and '
+                         '%.2f seconds at most.  The server is holding '
+                         '%.2f seconds of flood penalty against me.',
+                         (len(q), 'message'), irc.network, q.oldestWait(),
+                         (q.sent, 'message'), average, q.maxWait,
+                         q.penalty()))
+    queue = wrap(queue)
+
+    def snarfers(self, irc, msg, args):
+        """takes no arguments
+
+        Returns statistics about the URLs waiting to be snarfed.
+        """
+        executor = supyCommands.snarfExecutor
+        depths = executor.depths()
+        if depths:
+            L = ['%s on %s: %s' % (channel, network, depth)
+                 for ((network, channel), depth) in sorted(depths.items())]
+            waiting = format('%L', L)
+        else:
+            waiting = 'none'
+        irc.reply(format('I have %n snarfing URLs.  I have been given %n to '
+                         'snarf, ignored %n because too many were already '
+                         'waiting, and had at most %i waiting in any one '
+                         'channel.  Currently waiting: %s.',
+                         (len(executor.threads), 'thread'),
+                         (executor.submitted, 'URL'),
+                         (executor.dropped, 'URL'), executor.maxDepth,
+                         waiting))
+    snarfers = wrap(snarfers)
+
+    def flushers(self, irc, msg, args):
+        """takes no arguments
+
+        Returns how long each of the periodic flushers took the last time they
+        were run.
+        """
+        if not world.flusherTimes:
+            irc.reply('My flushers haven\'t been run yet.')
+            return
+        L = [format('%s: %.3f seconds', name, elapsed)
+             for (name, elapsed) in world.flusherTimes]
+        total = sum([elapsed for (_, elapsed) in world.flusherTimes])
+        irc.reply(format('My flushers took %.3f seconds in all: %L.',
+                         total, L))
+    flushers = wrap(flushers)
+
+    def hostmasks(self, irc, msg, args):
+        """takes no arguments
+
+        Returns how many hostmasks I remember on this network, how much memory
+        they take up, and how often they're found when looked up.
+        """
+        (size, pinned, hits, misses, expired, bytes) = \
+               irc.state.nicksToHostmasks.stats()
+        lookups = hits + misses
+        if lookups:
+            rate = format('%.1f%% of %n found one.', 100.0 * hits / lookups,
+                          (lookups, 'lookup'))
+        else:
+            rate = 'None have been looked up yet.'
+        irc.reply(format('I remember %n on %s, %i of them for nicks in '
+                         'channels I\'m in, in about %.1f kB.  %s  I\'ve '
+                         'let %n expire.', (size, 'hostmask'), irc.network,
+                         pinned, bytes / 1024.0, rate, (expired, 'hostmask')))
+    hostmasks = wrap(hostmasks)
+
     def cpu(self, irc, msg, args):
         """takes no arguments
 
@@ -38,6 +38,21 @@ class StatusTestCase(PluginTestCase):
     def testNet(self):
         self.assertNotError('net')
 
+    def testQueue(self):
+        self.assertRegexp('queue', 'flood penalty')
+
+    def testSnarfers(self):
+        self.assertRegexp('snarfers', 'Currently waiting: none')
+
+    def testFlushers(self):
+        world.flush()
+        self.assertRegexp('flushers', r'_flushUserData: \d+\.\d+ seconds')
+
+    def testHostmasks(self):
+        self.assertRegexp('hostmasks', r'I remember \d+ hostmasks? on test')
+        self.irc.state.nickToHostmask(self.nick)
+        self.assertRegexp('hostmasks', r'\d+\.\d% of \d+ lookups? found')
+
     def testCpu(self):
         m = self.assertNotError('status cpu')
         self.failIf('kB kB' in m.args[1])
@@ -28,6 +28,8 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import re
+
 import supybot.dbi as dbi
 import supybot.conf as conf
 import supybot.utils as utils
@@ -48,6 +50,7 @@ class UrlRecord(dbi.Record):
 class DbiUrlDB(plugins.DbiChannelDB):
     class DB(dbi.DB):
         Record = UrlRecord
+        indexes = {'by': ircutils.toLower}
         def add(self, url, msg):
             record = self.Record(url=url, by=msg.nick,
                                  near=msg.args[1], at=msg.receivedAt)
@@ -57,7 +60,9 @@ class DbiUrlDB(plugins.DbiChannelDB):
             L.reverse()
             return L
 
-URLDB = plugins.DB('URL', {'flat': DbiUrlDB})
+URLDB = plugins.DB('URL', {'flat': DbiUrlDB,
+                           'indexed': plugins.withMapping(DbiUrlDB,
+                                                          'indexed')})
 
 class URL(callbacks.Plugin):
     def __init__(self, irc):
@@ -104,45 +109,32 @@ class URL(callbacks.Plugin):
         <channel> is only necessary if the message isn't sent in the channel
         itself.
         """
-        predicates = []
-        f = None
-        nolimit = False
+        where = []
+        limit = 1
         for (option, arg) in optlist:
-            if isinstance(arg, basestring):
-                arg = arg.lower()
             if option == 'nolimit':
-                nolimit = True
+                limit = None
             elif option == 'from':
-                def f(record, arg=arg):
-                    return ircutils.strEqual(record.by, arg)
+                where.append(dbi.Equals('by', arg, ircutils.toLower))
             elif option == 'with':
-                def f(record, arg=arg):
-                    return arg in record.url.lower()
+                where.append(dbi.Contains('url', arg))
             elif option == 'without':
-                def f(record, arg=arg):
-                    return arg not in record.url.lower()
+                where.append(dbi.Not(dbi.Contains('url', arg)))
             elif option == 'proto':
-                def f(record, arg=arg):
-                    return record.url.lower().startswith(arg)
+                regexp = re.compile('^' + re.escape(arg), re.I)
+                where.append(dbi.Matches('url', regexp))
             elif option == 'near':
-                def f(record, arg=arg):
-                    return arg in record.near.lower()
-            if f is not None:
-                predicates.append(f)
-        def predicate(record):
-            for predicate in predicates:
-                if not predicate(record):
-                    return False
-            return True
-        urls = [record.url for record in self.db.urls(channel, predicate)]
+                where.append(dbi.Contains('near', arg))
+        records = self.db.select(channel, where=where, reverse=True,
+                                 limit=limit)
+        urls = [record.url for record in records]
         if not urls:
             irc.reply('No URLs matched that criteria.')
         else:
-            if nolimit:
+            if limit is None:
                 urls = [format('%u', url) for url in urls]
                 s = ', '.join(urls)
             else:
-                # We should optimize this with another URLDB method eventually.
                 s = urls[0]
             irc.reply(s)
     last = wrap(last, ['channeldb',
@@ -47,6 +47,10 @@ Web = conf.registerPlugin('Web')
 conf.registerChannelValue(Web, 'titleSnarfer',
     registry.Boolean(False, """Determines whether the bot will output the HTML
     title of URLs it sees in the channel."""))
+conf.registerGlobalValue(Web.titleSnarfer, 'cacheTime',
+    registry.NonNegativeInteger(300, """Determines how many seconds the bot
+    will remember the title of a URL for, so URLs pasted again don't have to
+    be fetched again.  0 disables this."""))
 conf.registerChannelValue(Web, 'nonSnarfingRegexp',
     registry.Regexp(None, """Determines what URLs are to be snarfed and stored
     in the database in the channel; URLs matching the regexp given will not be
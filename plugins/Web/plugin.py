@@ -29,6 +29,7 @@
 ###
 
 import re
+import time
 import HTMLParser
 import htmlentitydefs
 
@@ -38,6 +39,7 @@ from supybot.commands import *
 import supybot.plugins as plugins
 import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
+from supybot.utils.structures import CacheDict
 
 class Title(HTMLParser.HTMLParser):
     entitydefs = htmlentitydefs.entitydefs.copy()
@@ -45,6 +47,7 @@ class Title(HTMLParser.HTMLParser):
     entitydefs['apos'] = '\''
     def __init__(self):
         self.inTitle = False
+        self.done = False
         self.title = ''
         HTMLParser.HTMLParser.__init__(self)
 
@@ -55,6 +58,7 @@ class Title(HTMLParser.HTMLParser):
     def handle_endtag(self, tag):
         if tag == 'title':
             self.inTitle = False
+            self.done = True
 
     def handle_data(self, data):
         if self.inTitle:
@@ -69,6 +73,13 @@ class Web(callbacks.PluginRegexp):
     """Add the help for "@help Web" here."""
     threaded = True
     regexps = ['titleSnarfer']
+    # Only pages of these types are looked through for a title.
+    htmlTypes = ('text/html', 'application/xhtml+xml')
+    def __init__(self, irc):
+        self.__parent = super(Web, self)
+        self.__parent.__init__(irc)
+        self.titles = CacheDict(1000)
+
     def callCommand(self, command, irc, msg, *args, **kwargs):
         try:
             super(Web, self).callCommand(command, irc, msg, *args, **kwargs)
@@ -88,25 +99,59 @@ class Web(callbacks.PluginRegexp):
                 self.log.debug('Not titleSnarfing %q.', url)
                 return
             try:
-                size = conf.supybot.protocols.http.peekSize()
-                text = utils.web.getUrl(url, size=size)
+                (title, _) = self._getTitle(url)
             except utils.web.Error, e:
                 self.log.info('Couldn\'t snarf title of %u: %s.', url, e)
                 return
-            parser = Title()
-            try:
-                parser.feed(text)
-            except HTMLParser.HTMLParseError:
-                self.log.debug('Encountered a problem parsing %u.  Title may '
-                               'already be set, though', url)
-            if parser.title:
+            if title:
                 domain = utils.web.getDomain(url)
-                title = utils.web.htmlToText(parser.title.strip())
                 s = format('Title: %s (at %s)', title, domain)
                 irc.reply(s, prefixNick=False)
     titleSnarfer = urlSnarfer(titleSnarfer)
     titleSnarfer.__doc__ = utils.web._httpUrlRe
 
+    def _getTitle(self, url):
+        """Returns the title of url (or None if it has none) and how many bytes
+        of it were read to find that out.  The page is parsed as it's read
+        and reading stops as soon as the title is over; pages that aren't
+        HTML aren't read at all."""
+        cacheTime = self.registryValue('titleSnarfer.cacheTime')
+        cached = self.titles.get(url)
+        if cached is not None:
+            (when, title) = cached
+            if time.time() - when < cacheTime:
+                return (title, 0)
+        size = conf.supybot.protocols.http.peekSize()
+        fd = utils.web.getUrlFd(url)
+        parser = Title()
+        n = 0
+        try:
+            try:
+                contentType = fd.info().getheader('content-type', '')
+                contentType = contentType.split(';')[0].strip().lower()
+                if contentType and contentType not in self.htmlTypes:
+                    self.log.debug('Not looking for a title in %u, it\'s %s.',
+                                   url, contentType)
+                else:
+                    for chunk in utils.web.iterFd(fd, size=size):
+                        n += len(chunk)
+                        parser.feed(chunk)
+                        if parser.done:
+                            break
+            except HTMLParser.HTMLParseError:
+                self.log.debug('Encountered a problem parsing %u.  Title may '
+                               'already be set, though', url)
+        finally:
+            fd.close()
+        title = None
+        if parser.title:
+            title = utils.web.htmlToText(parser.title.strip())
+        # Pages without a title aren't remembered; the caller wants to know
+        # how much of them was looked through, and they may well get one.
+        if title and cacheTime:
+            self.titles[url] = (time.time(), title)
+        return (title, n)
+
     def _checkURLWhitelist(self, url):
         if not self.registryValue('urlWhitelist'):
             return True
@@ -194,16 +239,10 @@ class Web(callbacks.PluginRegexp):
             irc.error("This url is not on the whitelist.")
             return
         size = conf.supybot.protocols.http.peekSize()
-        text = utils.web.getUrl(url, size=size)
-        parser = Title()
-        try:
-            parser.feed(text)
-        except HTMLParser.HTMLParseError:
-            self.log.debug('Encountered a problem parsing %u.  Title may '
-                           'already be set, though', url)
-        if parser.title:
-            irc.reply(utils.web.htmlToText(parser.title.strip()))
-        elif len(text) < size:
+        (title, n) = self._getTitle(url)
+        if title:
+            irc.reply(title)
+        elif n < size:
             irc.reply('That URL appears to have no HTML title.')
         else:
             irc.reply(format('That URL appears to have no HTML title '
@@ -27,11 +27,44 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
+
 from supybot.test import *
 
 class WebTestCase(ChannelPluginTestCase):
     plugins = ('Web',)
     timeout = 10
+    def _file(self, name, contents):
+        filename = os.path.abspath(os.path.join(conf.supybot.directories.data(),
+                                                name))
+        fd = file(filename, 'w')
+        fd.write(contents)
+        fd.close()
+        return 'file://' + filename
+
+    def testGetTitle(self):
+        cb = self.irc.getCallback('Web')
+        url = self._file('title.html', '<html><head><title>Foo &amp; '
+                         'bar</title></head><body>%s</body></html>' %
+                         ('x' * 100000))
+        (title, n) = cb._getTitle(url)
+        self.assertEqual(title, 'Foo & bar')
+        # Reading stopped right after the title.
+        self.failUnless(n <= 1024)
+        # And it's remembered.
+        os.remove(url[len('file://'):])
+        self.assertEqual(cb._getTitle(url), ('Foo & bar', 0))
+        url = self._file('title.txt', '<title>Not HTML</title>')
+        self.assertEqual(cb._getTitle(url), (None, 0))
+        # Pages without a title aren't remembered.
+        url = self._file('notitle.html', '<html><body>%s</body></html>' %
+                         ('x' * 100))
+        (title, n) = cb._getTitle(url)
+        self.assertEqual(title, None)
+        self.failUnless(n > 100)
+        self.assertEqual(cb._getTitle(url), (None, n))
+        self.failIf(url in cb.titles)
+
     if network:
         def testHeaders(self):
             self.assertError('headers ftp://ftp.cdrom.com/pub/linux')
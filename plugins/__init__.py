@@ -40,6 +40,7 @@ import fnmatch
 import os.path
 import UserDict
 import threading
+from cStringIO import StringIO
 
 import supybot.log as log
 import supybot.dbi as dbi
@@ -230,10 +231,29 @@ class DbiChannelDB(object):
         return _getDbAndDispatcher
 
 
+def withMapping(cls, mapping):
+    """Returns a copy of cls, a dbi.DB or DbiChannelDB subclass, which keeps
+    its records in the given dbi mapping instead.  It's a copy rather than a
+    subclass so that the super(self.__class__, self) idiom used by many
+    dbi.DB subclasses keeps working."""
+    def copy(cls, **attrs):
+        d = dict(cls.__dict__)
+        d.pop('__dict__', None)
+        d.pop('__weakref__', None)
+        d.update(attrs)
+        return type(cls.__name__, cls.__bases__, d)
+    if issubclass(cls, DbiChannelDB):
+        return copy(cls, DB=withMapping(cls.DB, mapping))
+    return copy(cls, Mapping=mapping)
+
+
 class ChannelUserDictionary(UserDict.DictMixin):
+    """A mapping of (channel, id) to anything.  dirty is set whenever an item
+    is set or deleted."""
     IdDict = dict
     def __init__(self):
         self.channels = ircutils.IrcDict()
+        self.dirty = False
 
     def __getitem__(self, (channel, id)):
         return self.channels[channel][id]
@@ -242,9 +262,11 @@ class ChannelUserDictionary(UserDict.DictMixin):
         if channel not in self.channels:
             self.channels[channel] = self.IdDict()
         self.channels[channel][id] = v
+        self.dirty = True
 
     def __delitem__(self, (channel, id)):
         del self.channels[channel][id]
+        self.dirty = True
 
     def iteritems(self):
         for (channel, ids) in self.channels.iteritems():
@@ -257,26 +279,75 @@ class ChannelUserDictionary(UserDict.DictMixin):
             L.append(k)
         return L
 
+    def __len__(self):
+        return sum([len(ids) for ids in self.channels.itervalues()])
+
 
 # XXX The interface to this needs to be made *much* more like the dbi.DB
 #     interface.  This is just too odd and not extensible; any extension
 #     would very much feel like an extension, rather than part of the db
 #     itself.
 class ChannelUserDB(ChannelUserDictionary):
+    """A ChannelUserDictionary kept in a CSV file.  Flushing appends the
+    items changed since the last flush to a journal next to that file; once
+    the journal is longer than the database itself, it's compacted into the
+    file.  Those changing items in place should call markChanged.
+
+    Each compaction starts a new generation, whose number is written at the
+    top of the file and before each batch of items appended to the journal,
+    so what's left of an older journal (if the bot died before it could be
+    emptied) isn't read back over the newer file."""
+    minimumJournalLength = 1000
     def __init__(self, filename):
         ChannelUserDictionary.__init__(self)
         self.filename = filename
+        self.journalFilename = filename + '.journal'
+        self.changedKeys = set()
+        # Keys whose writes failed, put here by the writing thread.
+        self.unwrittenKeys = []
+        self.journalLength = 0
+        self.generation = 0
+        self.compactionFailed = False
         try:
-            fd = file(self.filename)
+            self._read(self.filename)
         except EnvironmentError, e:
             log.warning('Couldn\'t open %s: %s.', self.filename, e)
-            return
+        try:
+            self.journalLength = self._read(self.journalFilename, journal=True)
+        except EnvironmentError:
+            pass # No changes since it was last compacted.
+        self.dirty = False
+        self.changedKeys.clear()
+
+    def _read(self, filename, journal=False):
+        """Reads the items in filename into the database, and returns how
+        many items it had.  A journal's lines start with whether they set or
+        delete their item.  Lines starting with an empty field give the
+        generation of the lines after them; journal lines from before the
+        generation of the database's file are skipped."""
+        fd = file(filename)
         reader = csv.reader(fd)
+        lineno = 0
+        length = 0
+        oldest = self.generation
+        generation = 0
         try:
-            lineno = 0
             for t in reader:
                 lineno += 1
                 try:
+                    if t and not t[0]:
+                        if t[1] != 'generation':
+                            raise ValueError, 'Invalid header: %r' % t[1]
+                        generation = int(t[2])
+                        self.generation = max(self.generation, generation)
+                        continue
+                    length += 1
+                    if journal and generation < oldest:
+                        continue # Already in the database's file.
+                    if journal:
+                        op = t.pop(0)
+                    else:
+                        op = 'set'
                     channel = t.pop(0)
                     id = t.pop(0)
                     try:
@@ -284,8 +355,14 @@ class ChannelUserDB(ChannelUserDictionary):
                     except ValueError:
                         # We'll skip over this so, say, nicks can be kept here.
                         pass
-                    v = self.deserialize(channel, id, t)
-                    self[channel, id] = v
+                    if op == 'set':
+                        v = self.deserialize(channel, id, t)
+                        self[channel, id] = v
+                    elif op == 'del':
+                        if (channel, id) in self:
+                            del self[channel, id]
+                    else:
+                        raise ValueError, 'Invalid operation: %r' % op
                 except Exception, e:
                     log.warning('Invalid line #%s in %s.',
                                 lineno, self.__class__.__name__)
@@ -294,27 +371,95 @@ class ChannelUserDB(ChannelUserDictionary):
             log.warning('Invalid line #%s in %s.',
                         lineno, self.__class__.__name__)
             log.debug('Exception: %s', utils.exnToString(e))
+        fd.close()
+        return length
+
+    def __setitem__(self, key, v):
+        ChannelUserDictionary.__setitem__(self, key, v)
+        self.changedKeys.add(key)
+
+    def __delitem__(self, key):
+        ChannelUserDictionary.__delitem__(self, key)
+        self.changedKeys.add(key)
+
+    def _unwritten(self, keys=()):
+        # This is called from the writing thread, so we leave the keys for
+        # flush to pick up rather than touching changedKeys ourselves.
+        self.unwrittenKeys.append(keys)
+        self.dirty = True
+
+    def _compactionFailed(self):
+        # Called from the writing thread, like _unwritten.  The file and the
+        # journal on disk still hold everything, so we just compact again.
+        self.compactionFailed = True
+        self.dirty = True
+
+    def markChanged(self, channel, id):
+        """Notes that the item for (channel, id) has been changed in place,
+        so it's written the next time we're flushed."""
+        self.changedKeys.add((channel, id))
+        self.dirty = True
 
     def flush(self):
-        fd = utils.file.AtomicFile(self.filename, makeBackupIfSmaller=False)
+        """Appends the items changed since the last flush to the journal, or
+        compacts the journal into the database's file if it's grown longer
+        than the database.  Either is written in the background, from a
+        snapshot taken here."""
+        if not self.dirty:
+            return
+        while self.unwrittenKeys:
+            self.changedKeys.update(self.unwrittenKeys.pop())
+        length = self.journalLength + len(self.changedKeys)
+        # Someone might have set dirty without telling us what changed.
+        if not self.changedKeys or self.compactionFailed or \
+           length > max(len(self), self.minimumJournalLength):
+            self.compact()
+            return
+        fd = StringIO()
         writer = csv.writer(fd)
+        writer.writerow(['', 'generation', self.generation])
+        keys = list(self.changedKeys)
+        for (channel, id) in keys:
+            try:
+                L = ['set', channel, id] + self.serialize(self[channel, id])
+            except KeyError:
+                L = ['del', channel, id]
+            writer.writerow(L)
+        self.journalLength = length
+        self.changedKeys.clear()
+        self.dirty = False
+        world.appendFile(self.journalFilename, fd.getvalue(),
+                         onError=lambda: self._unwritten(keys))
+
+    def compact(self):
+        """Writes the whole database to its file and then empties the
+        journal.  If writing the file fails, the journal is left alone."""
         items = self.items()
         if not items:
-            log.debug('%s: Refusing to write blank file.',
-                      self.__class__.__name__)
-            fd.rollback()
-            return
+            # Everything's been deleted.  Leaving the file alone would bring
+            # it all back once the journal's emptied, so we empty both.
+            log.debug('%s: Writing blank file.', self.__class__.__name__)
+        self.generation += 1
+        self.journalLength = 0
+        self.changedKeys.clear()
+        self.dirty = False
+        self.compactionFailed = False
+        fd = StringIO()
+        writer = csv.writer(fd)
+        writer.writerow(['', 'generation', self.generation])
         items.sort()
         for ((channel, id), v) in items:
-            L = self.serialize(v)
-            L.insert(0, id)
-            L.insert(0, channel)
-            writer.writerow(L)
-        fd.close()
+            writer.writerow([channel, id] + self.serialize(v))
+        world.writeFiles([(self.filename, fd.getvalue()),
+                          (self.journalFilename, '')],
+                         makeBackupIfSmaller=False,
+                         onError=self._compactionFailed)
 
     def close(self):
-        self.flush()
-        self.clear()
+        if self.dirty or self.journalLength:
+            self.compact()
+        self.channels.clear()
+        self.changedKeys.clear()
 
     def deserialize(self, channel, id, L):
         """Should take a list of strings and return an object to be accessed
@@ -345,6 +490,7 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
                     'by',
                     'text'
                     ]
+            indexes = {'by': None}
             def add(self, at, by, text, **kwargs):
                 record = self.Record(at=at, by=by, text=text, **kwargs)
                 return super(self.__class__, self).add(record)
@@ -352,7 +498,8 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(ChannelIdDatabasePlugin, self)
         self.__parent.__init__(irc)
-        self.db = DB(self.name(), {'flat': self.DB})()
+        indexed = withMapping(self.DB, 'indexed')
+        self.db = DB(self.name(), {'flat': self.DB, 'indexed': indexed})()
 
     def die(self):
         self.db.close()
@@ -421,26 +568,22 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
 
         Searches for $types matching the criteria given.
         """
-        predicates = []
-        def p(record):
-            for predicate in predicates:
-                if not predicate(record):
-                    return False
-            return True
-
+        where = []
         for (opt, arg) in optlist:
             if opt == 'by':
-                predicates.append(lambda r, arg=arg: r.by == arg.id)
+                where.append(dbi.Equals('by', arg.id))
             elif opt == 'regexp':
-                predicates.append(lambda x: commands.regexp_wrapper(x.text, reobj=arg, 
-                        timeout=0.1, plugin_name = self.name(), fcn_name='search'))
-                #predicates.append(lambda r, arg=arg: arg.search(r.text))
+                def f(text, arg=arg):
+                    return commands.regexp_wrapper(text, reobj=arg,
+                            timeout=0.1, plugin_name=self.name(),
+                            fcn_name='search')
+                where.append(dbi.Satisfies('text', f))
         if glob:
-            def globP(r, glob=glob.lower()):
-                return fnmatch.fnmatch(r.text.lower(), glob)
-            predicates.append(globP)
+            def globP(text, glob=glob.lower()):
+                return fnmatch.fnmatch(text.lower(), glob)
+            where.append(dbi.Satisfies('text', globP))
         L = []
-        for record in self.db.select(channel, p):
+        for record in self.db.select(channel, where=where):
             L.append(self.searchSerializeRecord(record))
         if L:
             L.sort()
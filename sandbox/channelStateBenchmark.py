@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Compares how much memory ChannelState takes up, and how fast it answers
+membership questions, with its per-nick flags and with the parallel IrcSets
+of users, ops, halfops, and voices it used to keep.
+
+Usage: channelStateBenchmark.py [<users>]
+"""
+
+import sys
+import timeit
+import random
+
+import supybot.irclib as irclib
+import supybot.ircutils as ircutils
+
+class IrcSetChannelState(object):
+    """The parts of ChannelState that were IrcSets before it kept flags."""
+    def __init__(self):
+        self.ops = ircutils.IrcSet()
+        self.users = ircutils.IrcSet()
+        self.voices = ircutils.IrcSet()
+        self.halfops = ircutils.IrcSet()
+
+    def isOp(self, nick):
+        return nick in self.ops
+
+    def addUser(self, user):
+        nick = user.lstrip('@%+')
+        if user[0] == '@':
+            self.ops.add(nick)
+        elif user[0] == '%':
+            self.halfops.add(nick)
+        elif user[0] == '+':
+            self.voices.add(nick)
+        self.users.add(nick)
+
+def sizeof(x, seen=None):
+    """Returns roughly how many bytes x and everything it refers to take."""
+    if seen is None:
+        seen = set()
+    if id(x) in seen:
+        return 0
+    seen.add(id(x))
+    size = sys.getsizeof(x)
+    if isinstance(x, dict):
+        for (k, v) in x.iteritems():
+            size += sizeof(k, seen) + sizeof(v, seen)
+    elif isinstance(x, (set, list, tuple)):
+        for elt in x:
+            size += sizeof(elt, seen)
+    if hasattr(x, '__dict__'):
+        size += sizeof(x.__dict__, seen)
+    for name in getattr(type(x), '__slots__', ()):
+        if hasattr(x, name):
+            size += sizeof(getattr(x, name), seen)
+    return size
+
+def populate(chan, users):
+    r = random.Random(0)
+    names = []
+    for i in xrange(users):
+        name = 'User%s' % i
+        names.append(name)
+        chan.addUser(r.choice(['', '', '', '', '+', '@']) + name)
+    return names
+
+if __name__ == '__main__':
+    users = 10000
+    if len(sys.argv) > 1:
+        users = int(sys.argv[1])
+    for (name, cls) in [('IrcSet', IrcSetChannelState),
+                        ('flags', irclib.ChannelState)]:
+        chan = cls()
+        names = populate(chan, users)
+        size = sizeof(chan)
+        def f():
+            for nick in names[:1000]:
+                nick in chan.users
+                chan.isOp(nick)
+        elapsed = min(timeit.repeat(f, number=10, repeat=3)) / 10000
+        print '%-6s %6.1f bytes per user, %5.2f usec per lookup' % \
+              (name, float(size) / users, elapsed * 1e6 / 2)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
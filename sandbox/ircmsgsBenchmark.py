@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Measures how fast ircmsgs.IrcMsg parses messages from the network.
+
+Usage: ircmsgsBenchmark.py [<capture>]
+
+<capture> is a file of raw IRC lines as the server sent them, such as a
+driver's debug log of a busy network with the timestamps cut off.  Without
+one, a synthetic capture with the mix of messages seen on a busy channel is
+used.
+"""
+
+import sys
+import random
+import timeit
+
+import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
+
+def syntheticCapture(n=20000, seed=0):
+    r = random.Random(seed)
+    nicks = ['nick%s' % i for i in range(300)]
+    def prefix():
+        nick = r.choice(nicks)
+        return '%s!~%s@host-%s.example.net' % (nick, nick, r.randint(1, 999))
+    def tags():
+        if r.random() < 0.5:
+            return '@time=2011-10-19T16:40:51.620Z;account=%s ' % \
+                   r.choice(nicks)
+        return ''
+    templates = [
+        (60, lambda: '%s:%s PRIVMSG #busy :%s' %
+             (tags(), prefix(), ' '.join(r.choice(nicks) for _ in range(8)))),
+        (10, lambda: '%s:%s JOIN #busy' % (tags(), prefix())),
+        (8, lambda: ':%s PART #busy :Leaving' % prefix()),
+        (8, lambda: ':%s QUIT :Ping timeout: 240 seconds' % prefix()),
+        (5, lambda: ':%s MODE #busy +v %s' % (prefix(), r.choice(nicks))),
+        (4, lambda: ':%s NICK :%s_' % (prefix(), r.choice(nicks))),
+        (3, lambda: ':irc.example.net NOTICE * :*** Looking up your host'),
+        (2, lambda: 'PING :irc.example.net'),
+        ]
+    weighted = []
+    for (weight, f) in templates:
+        weighted.extend([f] * weight)
+    return [r.choice(weighted)() for _ in xrange(n)]
+
+def benchmark(lines, repeat=3):
+    def parse():
+        for line in lines:
+            ircmsgs.IrcMsg(line)
+    def parseAndSplit():
+        for line in lines:
+            ircmsgs.IrcMsg(line).nick
+    msgs = [ircmsgs.IrcMsg(line) for line in lines]
+    def regexpSplit():
+        # What every message used to pay for in its constructor.
+        for msg in msgs:
+            if ircutils.isUserHostmask(msg.prefix):
+                ircutils.splitHostmask(msg.prefix)
+    for (name, f) in [('parse', parse), ('parse, then .nick', parseAndSplit),
+                      ('regexp split (old, eager)', regexpSplit)]:
+        t = min(timeit.repeat(f, number=1, repeat=repeat))
+        print '%-26s %10.0f msgs/sec  %6.2f usec/msg' % \
+              (name, len(lines) / t, t * 1e6 / len(lines))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        fd = file(sys.argv[1])
+        lines = [line.rstrip('\r\n') for line in fd if line.strip()]
+        fd.close()
+    else:
+        lines = syntheticCapture()
+    print '%s messages.' % len(lines)
+    benchmark(lines)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Compares how long IrcState takes to handle a netsplit's worth of QUITs when it
+finds each nick's channels with its nicksToChannels index and when it scans
+every channel for them, as it used to.
+
+Usage: nickIndexBenchmark.py [<channels>] [<nicks>]
+"""
+
+import sys
+import time
+import random
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+class ScanningIrcState(irclib.IrcState):
+    """The IrcState as it was before it had its nicksToChannels index."""
+    def doQuit(self, irc, msg):
+        channels = [channel for (channel, chan) in self.channels.iteritems()
+                    if msg.nick in chan.users]
+        msg.tag('channels', channels)
+        for chan in self.channels.itervalues():
+            chan.removeUser(msg.nick)
+
+class FakeIrc:
+    nick = 'bot'
+    prefix = 'bot!bot@bot'
+
+def populate(state, channels, nicks):
+    r = random.Random(0)
+    names = ['#channel%s' % i for i in xrange(channels)]
+    for name in names:
+        state.addMsg(FakeIrc, ircmsgs.join(name, prefix=FakeIrc.prefix))
+    for i in xrange(nicks):
+        prefix = 'Nick%s!user@host%s' % (i, i)
+        for name in r.sample(names, 5):
+            state.addMsg(FakeIrc, ircmsgs.join(name, prefix=prefix))
+
+def benchmark(cls, channels, nicks):
+    state = cls()
+    populate(state, channels, nicks)
+    quits = [ircmsgs.quit('*.net *.split', prefix='Nick%s!user@host%s' % (i,i))
+             for i in xrange(nicks)]
+    start = time.time()
+    for msg in quits:
+        state.addMsg(FakeIrc, msg)
+    return time.time() - start
+
+if __name__ == '__main__':
+    (channels, nicks) = (500, 2000)
+    if len(sys.argv) > 1:
+        channels = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        nicks = int(sys.argv[2])
+    times = {}
+    for (name, cls) in [('scan', ScanningIrcState),
+                        ('index', irclib.IrcState)]:
+        times[name] = benchmark(cls, channels, nicks)
+        print '%-6s %8.2f usec per QUIT' % (name, times[name] * 1e6 / nicks)
+    print 'Speedup: %.1fx' % (times['scan'] / times['index'])
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+"""
+Compares how long PluginMixin.registryValue takes with and without its cache
+of earlier lookups, for the handful of lookups a plugin typically makes for
+each message it sees.
+
+Usage: registryValueBenchmark.py [<iterations>]
+"""
+
+import sys
+import timeit
+
+import supybot.conf as conf
+import supybot.registry as registry
+import supybot.ircutils as ircutils
+import supybot.callbacks as callbacks
+
+group = conf.registerPlugin('RegistryValueBenchmark')
+conf.registerChannelValue(group, 'enable',
+    registry.Boolean(True, """Whether anything is done at all."""))
+conf.registerGroup(group, 'snarfer')
+conf.registerChannelValue(group.snarfer, 'nonSnarfingRegexp',
+    registry.Regexp(None, """What not to snarf."""))
+conf.registerGlobalValue(group, 'maximumLength',
+    registry.PositiveInteger(400, """How much to say at once."""))
+conf.registerChannelValue(group, 'prefix',
+    registry.String('Title:', """What to say first."""))
+
+class RegistryValueBenchmark(callbacks.Plugin):
+    pass
+
+class UncachedRegistryValueBenchmark(callbacks.Plugin):
+    """registryValue as it was before it cached its lookups."""
+    def name(self):
+        return 'RegistryValueBenchmark'
+
+    def registryValue(self, name, channel=None, value=True):
+        plugin = self.name()
+        group = conf.supybot.plugins.get(plugin)
+        names = registry.split(name)
+        for name in names:
+            group = group.get(name)
+        if channel is not None:
+            if ircutils.isChannel(channel):
+                group = group.get(channel)
+            else:
+                self.log.debug('registryValue got channel=%r', channel)
+        if value:
+            return group()
+        else:
+            return group
+
+channels = ['#channel%s' % i for i in range(20)]
+
+def perMessage(cb):
+    for channel in channels:
+        cb.registryValue('enable', channel)
+        cb.registryValue('snarfer.nonSnarfingRegexp', channel)
+        cb.registryValue('maximumLength')
+        cb.registryValue('prefix', channel)
+
+def benchmark(iterations):
+    times = {}
+    for (name, cls) in [('uncached', UncachedRegistryValueBenchmark),
+                        ('cached', RegistryValueBenchmark)]:
+        cb = cls(None)
+        perMessage(cb) # Creates the channel values, if they're needed.
+        times[name] = min(timeit.repeat(lambda: perMessage(cb),
+                                        number=iterations, repeat=3))
+        print '%-8s %8.2f usec per message (4 lookups)' % \
+              (name, times[name] * 1e6 / (iterations * len(channels)))
+    print 'Speedup: %.1fx' % (times['uncached'] / times['cached'])
+
+if __name__ == '__main__':
+    iterations = 2000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    benchmark(iterations)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
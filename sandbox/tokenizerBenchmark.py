@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Checks that callbacks.Tokenizer splits commands exactly as the shlex-based
+tokenizer it replaced did, and compares how fast the two are.
+
+Usage: tokenizerBenchmark.py [<iterations>]
+"""
+
+import sys
+import random
+import timeit
+from cStringIO import StringIO
+
+import supybot.shlex as shlex
+import supybot.callbacks as callbacks
+
+class ShlexTokenizer(callbacks.Tokenizer):
+    """The tokenizer as it was before it was compiled to a regexp."""
+    def _insideBrackets(self, lexer):
+        ret = []
+        while True:
+            token = lexer.get_token()
+            if not token:
+                raise SyntaxError, 'Missing "%s".' % self.right
+            elif token == self.right:
+                return ret
+            elif token == self.left:
+                ret.append(self._insideBrackets(lexer))
+            else:
+                ret.append(self._handleToken(token))
+        return ret
+
+    def tokenize(self, s):
+        lexer = shlex.shlex(StringIO(s))
+        lexer.commenters = ''
+        lexer.quotes = self.quotes
+        lexer.wordchars = self.validChars
+        args = []
+        ends = []
+        while True:
+            token = lexer.get_token()
+            if not token:
+                break
+            elif token == '|' and self.pipe:
+                if not args:
+                    raise SyntaxError, '"|" with nothing preceding.'
+                ends.append(args)
+                args = []
+            elif token == self.left:
+                args.append(self._insideBrackets(lexer))
+            elif token == self.right:
+                raise SyntaxError, 'Spurious "%s".' % self.right
+            else:
+                args.append(self._handleToken(token))
+        if ends:
+            if not args:
+                raise SyntaxError, '"|" with nothing following.'
+            args.append(ends.pop())
+            while ends:
+                args[-1].append(ends.pop())
+        return args
+
+# Commands as they're actually given to bots.
+corpus = [
+    'help',
+    'list',
+    'echo foo bar baz',
+    'echo "foo bar" baz',
+    'echo [rot13 [rot13 nested]]',
+    'alias add foo "echo $1 [reverse $2]"',
+    'messageparser add "^(hi|hello)\\b" "echo Hello, $nick!"',
+    'config supybot.reply.whenAddressedBy.chars "!@"',
+    'seen --user jemfinch',
+    'rss announce add #supybot slashdot',
+    'google search --language en "python tokenizer"',
+    'dict "bad \\"quote\\" escaping" \\x02bold\\x02',
+    'echo it\'s a "quoted \\\\ backslash" test',
+    'math calc 2*(3+4)/5 [math calc 1+1]',
+    'echo \x02\x0312,4colored\x03\x0f',
+    'utilities last [list] [echo | bar] "|"',
+    'conditional if [nceq [echo foo] foo] "echo yes" "echo no"',
+    'format join ", " [list Admin]',
+    'echo ' + ' '.join(['word%s' % i for i in range(50)]),
+    'echo "' + 'x' * 300 + '"',
+    ]
+
+# Broken commands, which have to fail the same way.
+errors = ['"unclosed', '[unbalanced', 'spurious]', '| nothing', 'nothing |',
+          '"trailing backslash\\"', '"\\', 'foo"bar "baz']
+
+configurations = [('[]', False, '"'), ('[]', True, '"'), ('', False, '"'),
+                  ('<>', True, '`\''), ('{}', False, '')]
+
+def run(tokenizer, s):
+    try:
+        return tokenizer.tokenize(s)
+    except (SyntaxError, ValueError), e:
+        return e.__class__
+
+def fuzz(n, seed=0):
+    r = random.Random(seed)
+    alphabet = 'ab "\'`\\|[]<>{}\t\x00\x02'
+    for _ in xrange(n):
+        yield ''.join([r.choice(alphabet) for _ in xrange(r.randint(0, 12))])
+
+def checkEquivalence():
+    strings = corpus + errors + list(fuzz(20000))
+    for (brackets, pipe, quotes) in configurations:
+        new = callbacks.Tokenizer(brackets, pipe, quotes)
+        old = ShlexTokenizer(brackets, pipe, quotes)
+        for s in strings:
+            (expected, got) = (run(old, s), run(new, s))
+            if expected != got:
+                print 'Mismatch for %r with %r: expected %r, got %r.' % \
+                      (s, (brackets, pipe, quotes), expected, got)
+                return False
+    print 'Both tokenizers agree on %s strings in %s configurations.' % \
+          (len(strings), len(configurations))
+    return True
+
+def benchmark(iterations):
+    times = {}
+    for (name, cls) in [('shlex', ShlexTokenizer),
+                        ('regexp', callbacks.Tokenizer)]:
+        tokenizer = cls('[]', True, '"')
+        def f():
+            for s in corpus:
+                tokenizer.tokenize(s)
+        times[name] = min(timeit.repeat(f, number=iterations, repeat=3))
+        print '%-6s %8.2f usec per command' % \
+              (name, times[name] * 1e6 / (iterations * len(corpus)))
+    print 'Speedup: %.1fx' % (times['shlex'] / times['regexp'])
+
+if __name__ == '__main__':
+    iterations = 200
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    if not checkEquivalence():
+        sys.exit(1)
+    benchmark(iterations)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -37,11 +37,9 @@ import supybot
 import re
 import copy
 import time
-import shlex
 import getopt
 import inspect
 import operator
-from cStringIO import StringIO
 
 import supybot.log as log
 import supybot.conf as conf
@@ -270,7 +268,26 @@ class Tokenizer(object):
             self.validChars = self.validChars.translate(utils.str.chars, '|')
         self.quotes = quotes
         self.validChars = self.validChars.translate(utils.str.chars, quotes)
-
+        # Tokens are split the way supybot.shlex does it: a quoted string
+        # runs to the matching unescaped quote, a word starts with a valid
+        # character and continues through valid characters and quotes, and
+        # anything else but whitespace is a token by itself.
+        separators = '\x00\r\n \t' + brackets
+        if self.pipe:
+            separators += '|'
+        quoted = ['%s(?:[^%s\\\\]|\\\\.)*%s' % ((re.escape(q),) * 3)
+                  for q in quotes]
+        word = '[^%s][^%s]*' % (re.escape(separators + quotes),
+                                re.escape(separators))
+        self.tokenRe = re.compile('|'.join(quoted + [word, r'[^ \t\r\n]']),
+                                  re.S)
+
+    def _tokens(self, s):
+        for token in self.tokenRe.findall(s):
+            # A quote by itself is one that was never closed.
+            if len(token) == 1 and token in self.quotes:
+                raise ValueError, 'No closing quotation'
+            yield token
 
     def _handleToken(self, token):
         if token[0] == token[-1] and token[0] in self.quotes:
@@ -281,7 +298,7 @@ class Tokenizer(object):
     def _insideBrackets(self, lexer):
         ret = []
         while True:
-            token = lexer.get_token()
+            token = next(lexer, '')
             if not token:
                 raise SyntaxError, 'Missing "%s".  You may want to ' \
                                    'quote your arguments with double ' \
@@ -298,14 +315,11 @@ class Tokenizer(object):
         return ret
 
     def tokenize(self, s):
-        lexer = shlex.shlex(StringIO(s))
-        lexer.commenters = ''
-        lexer.quotes = self.quotes
-        lexer.wordchars = self.validChars
+        lexer = self._tokens(s)
         args = []
         ends = []
         while True:
-            token = lexer.get_token()
+            token = next(lexer, '')
             if not token:
                 break
             elif token == '|' and self.pipe:
@@ -338,6 +352,9 @@ class Tokenizer(object):
                 args[-1].append(ends.pop())
         return args
 
+# Tokenizers don't keep any state between calls to tokenize, so one for each
+# configuration is enough.
+_tokenizers = {}
 def tokenize(s, channel=None):
     """A utility function to create a Tokenizer and tokenize a string."""
     pipe = False
@@ -349,8 +366,14 @@ def tokenize(s, channel=None):
             pipe = True
     quotes = conf.get(conf.supybot.commands.quotes, channel)
     start = time.time()
+    key = (brackets, pipe, quotes)
+    try:
+        tokenizer = _tokenizers[key]
+    except KeyError:
+        tokenizer = Tokenizer(brackets=brackets, pipe=pipe, quotes=quotes)
+        _tokenizers[key] = tokenizer
     try:
-        ret = Tokenizer(brackets=brackets,pipe=pipe,quotes=quotes).tokenize(s)
+        ret = tokenizer.tokenize(s)
         return ret
     except ValueError, e:
         raise SyntaxError, str(e)
@@ -689,23 +712,12 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         (a list of strings) and the plugins for which it was a command."""
         assert isinstance(args, list)
         args = map(canonicalName, args)
-        cbs = []
-        maxL = []
-        for cb in self.irc.callbacks:
-            if not hasattr(cb, 'getCommand'):
-                continue
-            L = cb.getCommand(args)
-            #log.debug('%s.getCommand(%r) returned %r', cb.name(), args, L)
-            if L and L >= maxL:
-                maxL = L
-                cbs.append((cb, L))
-                assert isinstance(L, list), \
-                       'getCommand now returns a list, not a method.'
-                assert utils.iter.startswith(L, args), \
-                       'getCommand must return a prefix of the args given.  ' \
-                       '(args given: %r, returned: %r)' % (args, L)
+        irc = self.getRealIrc()
+        index = getattr(irc, 'commandIndex', None)
+        if index is None or not index.valid(irc.callbacks):
+            index = irc.commandIndex = CommandIndex(irc.callbacks)
+        (maxL, cbs) = index.find(args)
         log.debug('findCallbacksForArgs: %r', cbs)
-        cbs = [cb for (cb, L) in cbs if L == maxL]
         if len(maxL) == 1:
             # Special case: one arg determines the callback.  In this case, we
             # have to check, in order:
@@ -1017,6 +1029,81 @@ conf.registerGlobalValue(conf.supybot.commands, 'disabled',
     commands will not appear in command lists, etc.  They will appear not even
     to exist."""))
 
+class CommandIndex(object):
+    """Maps each command (as a tuple of canonical names) to the plugins it's
+    a command in, so finding the plugins for a command is a dictionary lookup
+    rather than asking every plugin in turn.  Plugins that decide for
+    themselves what their commands are, by overriding getCommand or
+    isCommandMethod, are still asked every time."""
+    version = 0
+    def __init__(self, cbs):
+        self.cbs = list(cbs)
+        self.version = CommandIndex.version
+        self.positions = {}
+        self.commands = {}
+        self.dynamic = []
+        self.depth = 0
+        for (i, cb) in enumerate(self.cbs):
+            if not hasattr(cb, 'getCommand'):
+                continue
+            self.positions[cb] = i
+            if self._isDynamic(cb):
+                self.dynamic.append(cb)
+                continue
+            name = cb.canonicalName()
+            for command in cb.listCommands():
+                command = tuple(command.split())
+                for path in (command, (name,) + command):
+                    self.commands.setdefault(path, []).append(cb)
+                    self.depth = max(self.depth, len(path))
+
+    def _isDynamic(self, cb):
+        for attr in ('getCommand', 'isCommandMethod'):
+            f = getattr(cb.__class__, attr, None)
+            if getattr(f, 'im_func', None) is not \
+               getattr(Commands, attr).im_func:
+                return True
+        for nested in getattr(cb, 'cbs', []):
+            if self._isDynamic(nested):
+                return True
+        return False
+
+    def valid(self, cbs):
+        """Returns whether this index is still up to date for cbs."""
+        return self.version == CommandIndex.version and self.cbs == cbs
+
+    def find(self, args):
+        """Returns the longest prefix of args that's a command and the plugins
+        it's a command in, in the order they were given."""
+        maxL = []
+        cbs = []
+        for i in xrange(min(len(args), self.depth), 0, -1):
+            path = tuple(args[:i])
+            if path in self.commands:
+                maxL = args[:i]
+                cbs = list(self.commands[path])
+                break
+        for cb in self.dynamic:
+            L = cb.getCommand(args)
+            if L and len(L) >= len(maxL):
+                assert isinstance(L, list), \
+                       'getCommand now returns a list, not a method.'
+                assert utils.iter.startswith(L, args), \
+                       'getCommand must return a prefix of the args given.  ' \
+                       '(args given: %r, returned: %r)' % (args, L)
+                if len(L) > len(maxL):
+                    maxL = L
+                    cbs = []
+                cbs.append(cb)
+        cbs.sort(key=self.positions.__getitem__)
+        return (maxL, cbs)
+
+def invalidateCommandIndex():
+    """Makes every CommandIndex be rebuilt before it's used again.  This
+    must be called whenever the commands a plugin has change while it's
+    loaded."""
+    CommandIndex.version += 1
+
 class DisabledCommands(object):
     def __init__(self):
         self.d = CanonicalNameDict()
@@ -1040,6 +1127,7 @@ class DisabledCommands(object):
         return False
 
     def add(self, command, plugin=None):
+        invalidateCommandIndex()
         if plugin is None:
             self.d[command] = None
         else:
@@ -1050,6 +1138,7 @@ class DisabledCommands(object):
                 self.d[command] = CanonicalNameSet([plugin])
 
     def remove(self, command, plugin=None):
+        invalidateCommandIndex()
         if plugin is None:
             del self.d[command]
         else:
@@ -1234,6 +1323,11 @@ class Commands(BasePlugin):
         else:
             return format('The %q command has no help.',formatCommand(command))
 
+# Maps (plugin, name, channel, value) to the registry version at the time
+# PluginMixin.registryValue looked it up and what it found.
+_registryValues = {}
+_valueCall = registry.Value.__call__.im_func
+
 class PluginMixin(BasePlugin, irclib.IrcCallback):
     public = True
     alwaysCall = ()
@@ -1266,6 +1360,14 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
 
     def registryValue(self, name, channel=None, value=True):
         plugin = self.name()
+        key = (plugin, name, channel, value)
+        version = registry.version
+        try:
+            (cachedVersion, ret) = _registryValues[key]
+            if cachedVersion == version:
+                return ret
+        except KeyError:
+            pass
         group = conf.supybot.plugins.get(plugin)
         names = registry.split(name)
         for name in names:
@@ -1276,9 +1378,16 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
             else:
                 self.log.debug('registryValue got channel=%r', channel)
         if value:
-            return group()
+            ret = group()
+            if group.__class__.__call__.im_func is not _valueCall:
+                # Its value is computed each time it's asked for.
+                return ret
         else:
-            return group
+            ret = group
+        # If anything changed while we were looking, version is already
+        # stale and we'll just look again next time.
+        _registryValues[key] = (version, ret)
+        return ret
 
     def setRegistryValue(self, name, value, channel=None):
         plugin = self.name()
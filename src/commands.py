@@ -32,9 +32,12 @@
 Includes wrappers for commands.
 """
 
+import os
 import time
 import types
 import getopt
+import urlparse
+import cPickle
 import inspect
 import threading
 import multiprocessing #python2.6 or later!
@@ -73,16 +76,202 @@ class ProcessTimeoutError(Exception):
     """Gets raised when a process is killed due to timeout."""
     pass
 
-def process(f, *args, **kwargs):
-    """Runs a function <f> in a subprocess.
-    
-    Several extra keyword arguments can be supplied. 
-    <pn>, the pluginname, and <cn>, the command name, are strings used to
-    create the process name, for identification purposes.
-    <timeout>, if supplied, limits the length of execution of target 
-    function to <timeout> seconds."""
-    timeout = kwargs.pop('timeout', None)
-    
+class TaskLoadError(Exception):
+    """Sent back by a ProcessPool worker that couldn't unpickle its task,
+    usually because the task's function comes from a module loaded (or
+    reloaded) since the worker was forked."""
+    pass
+
+def _closeInheritedFds(keep):
+    """Closes the file descriptors (the bot's sockets, logs, and whatnot)
+    that a worker inherited when it was forked, except keep and the standard
+    ones, so connections the bot closes don't stay open in its workers."""
+    if os.name != 'posix':
+        return
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except (EnvironmentError, ValueError):
+        try:
+            fds = range(os.sysconf('SC_OPEN_MAX'))
+        except (AttributeError, ValueError, OSError):
+            fds = range(256)
+    for fd in fds:
+        if fd > 2 and fd != keep:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+def _poolWorker(conn):
+    """The loop run by each ProcessPool worker: it receives (f, argsList,
+    kwargs) tasks and sends back f(*args, **kwargs) for each args in
+    argsList, one result at a time."""
+    _closeInheritedFds(conn.fileno())
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, IOError):
+            return
+        except Exception, e:
+            try:
+                conn.send(TaskLoadError(str(e)))
+                continue
+            except Exception:
+                return
+        if task is None:
+            return
+        (f, argsList, kwargs) = task
+        for args in argsList:
+            try:
+                r = f(*args, **kwargs)
+            except Exception, e:
+                r = e
+            try:
+                conn.send(r)
+            except (EOFError, IOError):
+                return
+            except Exception:
+                conn.send(Exception(str(r)))
+
+class PoolWorker(object):
+    def __init__(self):
+        (self.conn, child) = multiprocessing.Pipe()
+        name = 'Process #%s (pool worker)' % world.processesSpawned
+        # Plugins loaded after this won't be up to date in the worker.
+        self.pluginsLoaded = world.pluginsLoaded
+        self.process = world.SupyProcess(target=_poolWorker, args=(child,),
+                                         name=name)
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(1)
+
+
+class ProcessPool(object):
+    """A bounded pool of long-lived worker processes, so running something in
+    a subprocess doesn't cost a fork.  The pool grows to
+    supybot.commands.processes workers as they're needed; callers beyond
+    that wait for a worker to come free.  Workers forked before a plugin was
+    loaded or reloaded are replaced before they're used again."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = Queue.Queue()
+        self.workers = []
+
+    def _checkout(self):
+        try:
+            worker = self.idle.get(block=False)
+        except Queue.Empty:
+            worker = None
+        if worker is None:
+            self.lock.acquire()
+            try:
+                if len(self.workers) < conf.supybot.commands.processes():
+                    worker = PoolWorker()
+                    self.workers.append(worker)
+                    return worker
+            finally:
+                self.lock.release()
+            worker = self.idle.get()
+        if worker.pluginsLoaded != world.pluginsLoaded:
+            worker = self._replace(worker)
+        return worker
+
+    def _replace(self, worker):
+        """Kills worker and returns a fresh one that's taken its place."""
+        worker.kill()
+        self.lock.acquire()
+        try:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            worker = PoolWorker()
+            self.workers.append(worker)
+        finally:
+            self.lock.release()
+        return worker
+
+    def _respawn(self, worker):
+        """Kills worker and puts a fresh one in its place."""
+        self.idle.put(self._replace(worker))
+
+    def map(self, f, argsList, timeout=None, **kwargs):
+        """Calls f(*args, **kwargs) for each args in argsList, all in a
+        single round trip to one worker, and returns the list of results.
+        Exceptions are returned rather than raised.  A call that takes longer
+        than <timeout> seconds gets its worker killed and a
+        ProcessTimeoutError as its result, and the remaining calls go to
+        another worker.  Raises cPickle.PicklingError (or TypeError) if f or
+        its arguments can't be sent to a worker, and TaskLoadError if even a
+        freshly forked worker can't load them."""
+        argsList = list(argsList)
+        results = []
+        retried = False
+        while len(results) < len(argsList):
+            worker = self._checkout()
+            remaining = argsList[len(results):]
+            try:
+                worker.conn.send((f, remaining, kwargs))
+            except (cPickle.PicklingError, TypeError):
+                # Nothing was sent, so the worker's none the worse for it.
+                self.idle.put(worker)
+                raise
+            except Exception:
+                # The worker's dead; a new one gets one more try.
+                self._respawn(worker)
+                if retried:
+                    raise
+                retried = True
+                continue
+            for _ in remaining:
+                try:
+                    if worker.conn.poll(timeout):
+                        r = worker.conn.recv()
+                        if not isinstance(r, TaskLoadError):
+                            results.append(r)
+                            continue
+                        # The worker's code is out of date; a new one gets
+                        # one more try.
+                        self._respawn(worker)
+                        worker = None
+                        if retried:
+                            raise r
+                        retried = True
+                        break
+                    e = ProcessTimeoutError('%s aborted due to timeout.' %
+                                            worker.process.name)
+                except TaskLoadError:
+                    raise
+                except Exception, e:
+                    pass
+                self._respawn(worker)
+                worker = None
+                results.append(e)
+                break
+            if worker is not None:
+                self.idle.put(worker)
+        return results
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for worker in self.workers:
+                worker.kill()
+            self.workers = []
+            self.idle = Queue.Queue()
+        finally:
+            self.lock.release()
+
+try:
+    ignore(pool)
+except NameError:
+    pool = ProcessPool()
+
+def _oneShotProcess(f, args, kwargs, timeout):
     q = multiprocessing.Queue()
     def newf(f, q, *args, **kwargs):
         try:
@@ -99,44 +288,102 @@ def process(f, *args, **kwargs):
         p.terminate()
         raise ProcessTimeoutError, "%s aborted due to timeout." % (p.name,)
     try:
-        v = q.get(block=False)
+        return q.get(block=False)
     except Queue.Empty:
-        v = "Nothing returned."
+        return "Nothing returned."
+
+def process(f, *args, **kwargs):
+    """Runs a function <f> in a subprocess.
+    
+    Several extra keyword arguments can be supplied. 
+    <pn>, the pluginname, and <cn>, the command name, are strings used to
+    create the process name, for identification purposes.
+    <timeout>, if supplied, limits the length of execution of target 
+    function to <timeout> seconds.
+
+    <f> is run by a worker of the process pool unless it (or its arguments)
+    can't be pickled, in which case a new process is started just for it."""
+    timeout = kwargs.pop('timeout', None)
+    pn = kwargs.pop('pn', 'Unknown')
+    cn = kwargs.pop('cn', 'unknown')
+    try:
+        [v] = pool.map(f, [args], timeout=timeout, **kwargs)
+    except (cPickle.PicklingError, TypeError, TaskLoadError):
+        kwargs['pn'] = pn
+        kwargs['cn'] = cn
+        v = _oneShotProcess(f, args, kwargs, timeout)
+    if isinstance(v, ProcessTimeoutError):
+        log.debug('%s.%s: %s', pn, cn, v)
+        raise v
     if isinstance(v, Exception):
         v = "Error: " + str(v)
     return v
 
+def re_bool(s, reobj):
+    """Since we can't enqueue match objects into the multiprocessing queue,
+    we'll just wrap the function to return bools."""
+    if reobj.search(s) is not None:
+        return True
+    else:
+        return False
+
 def regexp_wrapper(s, reobj, timeout, plugin_name, fcn_name):
     '''A convenient wrapper to stuff regexp search queries through a subprocess.
     
     This is used because specially-crafted regexps can use exponential time
     and hang the bot.'''
-    def re_bool(s, reobj):
-        """Since we can't enqueue match objects into the multiprocessing queue,
-        we'll just wrap the function to return bools."""
-        if reobj.search(s) is not None:
-            return True
-        else:
-            return False
     try:
         v = process(re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
         return v
     except ProcessTimeoutError:
         return False
 
-class UrlSnarfThread(world.SupyThread):
-    def __init__(self, *args, **kwargs):
-        assert 'url' in kwargs
-        kwargs['name'] = 'Thread #%s (for snarfing %s)' % \
-                         (world.threadsSpawned, kwargs.pop('url'))
-        super(UrlSnarfThread, self).__init__(*args, **kwargs)
-        self.setDaemon(True)
-
-    def run(self):
-        try:
-            super(UrlSnarfThread, self).run()
-        except utils.web.Error, e:
-            log.debug('Exception in urlSnarfer: %s', utils.exnToString(e))
+def regexp_batch_wrapper(s, reobjs, timeout, plugin_name, fcn_name):
+    '''Like regexp_wrapper, but searches s for each of reobjs in a single
+    round trip to a subprocess, returning a list of bools.  <timeout> applies
+    to each search; one that times out counts as not found.'''
+    results = pool.map(re_bool, [(s, reobj) for reobj in reobjs],
+                       timeout=timeout)
+    L = []
+    for (reobj, v) in zip(reobjs, results):
+        if isinstance(v, Exception):
+            log.debug('%s.%s: search for %r failed: %s',
+                      plugin_name, fcn_name, reobj.pattern, v)
+            v = False
+        L.append(v)
+    return L
+
+def re_indexes(strings, reobjs, limit=None):
+    """Returns the indexes of the strings that all of reobjs match, stopping
+    once <limit> have been found."""
+    L = []
+    for (i, s) in enumerate(strings):
+        for reobj in reobjs:
+            if reobj.search(s) is None:
+                break
+        else:
+            L.append(i)
+            if len(L) == limit:
+                break
+    return L
+
+def regexp_filter_wrapper(strings, reobjs, timeout, plugin_name, fcn_name,
+                          limit=None):
+    '''Returns the indexes of the strings that all of reobjs match, searching
+    them all as a single job in a subprocess.  <timeout> applies to the whole
+    job; if it runs out, ProcessTimeoutError is raised.'''
+    args = (list(strings), list(reobjs))
+    try:
+        [v] = pool.map(re_indexes, [args], timeout=timeout, limit=limit)
+    except TaskLoadError:
+        kwargs = {'limit': limit, 'pn': plugin_name, 'cn': fcn_name}
+        v = _oneShotProcess(re_indexes, args, kwargs, timeout)
+    if isinstance(v, ProcessTimeoutError):
+        log.debug('%s.%s: %s', plugin_name, fcn_name, v)
+        raise v
+    elif isinstance(v, Exception):
+        raise v
+    return v
 
 class SnarfQueue(ircutils.FloodQueue):
     timeout = conf.supybot.snarfThrottle
@@ -158,9 +405,111 @@ class SnarfIrc(object):
         _snarfed.enqueue(self.channel, self.url)
         return self.irc.reply(*args, **kwargs)
 
-# This lock is used to serialize the calls to snarfers, so
-# earlier snarfers are guaranteed to beat out later snarfers.
-_snarfLock = threading.Lock()
+class SnarfExecutor(object):
+    """Runs snarfers on a fixed number of threads.  Snarfs are queued per
+    channel and each channel's queue is run in order, one snarf at a time, so
+    earlier snarfers are guaranteed to beat out later snarfers.  Channels
+    take turns, so many URLs in one channel can't starve the others, and at
+    most supybot.snarfers.perHost snarfs for the same host run at once."""
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queues = {} # Channel key -> list of (host, f) tasks.
+        self.ready = [] # Channel keys with tasks and none running.
+        self.hosts = {} # Host -> number of snarfs running.
+        self.threads = []
+        self.submitted = 0
+        self.dropped = 0
+        self.maxDepth = 0
+
+    def _startThreads(self):
+        while len(self.threads) < conf.supybot.snarfers.threads():
+            t = world.SupyThread(target=self._run, name='Snarfer thread #%s' %
+                                                        (len(self.threads)+1))
+            t.setDaemon(True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, key, url, f):
+        """Queues f to be run after every snarf already queued for key.
+        Returns False if key's queue is full."""
+        host = urlparse.urlparse(url)[1].lower()
+        self.cond.acquire()
+        try:
+            self._startThreads()
+            queue = self.queues.setdefault(key, [])
+            if len(queue) >= conf.supybot.snarfers.maximumQueued():
+                self.dropped += 1
+                return False
+            if not queue:
+                self.ready.append(key)
+            queue.append((host, f))
+            self.submitted += 1
+            self.maxDepth = max(self.maxDepth, len(queue))
+            self.cond.notify()
+            return True
+        finally:
+            self.cond.release()
+
+    def _next(self):
+        perHost = conf.supybot.snarfers.perHost()
+        for (i, key) in enumerate(self.ready):
+            (host, f) = self.queues[key][0]
+            if self.hosts.get(host, 0) < perHost:
+                del self.ready[i]
+                return (key, host, f)
+        return None
+
+    def _run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                task = self._next()
+                while task is None:
+                    self.cond.wait()
+                    task = self._next()
+                (key, host, f) = task
+                self.hosts[host] = self.hosts.get(host, 0) + 1
+            finally:
+                self.cond.release()
+            try:
+                f()
+            except utils.web.Error, e:
+                log.debug('Exception in urlSnarfer: %s', utils.exnToString(e))
+            except Exception:
+                log.exception('Uncaught exception in urlSnarfer:')
+            self.cond.acquire()
+            try:
+                self.hosts[host] -= 1
+                if not self.hosts[host]:
+                    del self.hosts[host]
+                queue = self.queues[key]
+                del queue[0]
+                if queue:
+                    # To the back of the line, so other channels get a turn.
+                    self.ready.append(key)
+                else:
+                    del self.queues[key]
+                self.cond.notifyAll()
+            finally:
+                self.cond.release()
+
+    def depths(self):
+        """Returns a dictionary mapping channel keys to the number of snarfs
+        queued (or running) for them."""
+        self.cond.acquire()
+        try:
+            d = {}
+            for (key, queue) in self.queues.iteritems():
+                d[key] = len(queue)
+            return d
+        finally:
+            self.cond.release()
+
+try:
+    ignore(snarfExecutor)
+except NameError:
+    snarfExecutor = SnarfExecutor()
+
 def urlSnarfer(f):
     """Protects the snarfer from loops (with other bots) and whatnot."""
     def newf(self, irc, msg, match, *L, **kwargs):
@@ -177,23 +526,21 @@ def urlSnarfer(f):
             return
         irc = SnarfIrc(irc, channel, url)
         def doSnarf():
-            _snarfLock.acquire()
-            try:
-                # This has to be *after* we've acquired the lock so we can be
-                # sure that all previous urlSnarfers have already run to
-                # completion.
-                if msg.repliedTo:
-                    self.log.debug('Not snarfing, msg is already repliedTo.')
-                    return
-                f(self, irc, msg, match, *L, **kwargs)
-            finally:
-                _snarfLock.release()
+            # This has to be checked when we're run rather than when we're
+            # queued, so we can be sure that all previous urlSnarfers for
+            # this channel have already run to completion.
+            if msg.repliedTo:
+                self.log.debug('Not snarfing, msg is already repliedTo.')
+                return
+            f(self, irc, msg, match, *L, **kwargs)
         if threading.currentThread() is not world.mainThread:
             doSnarf()
         else:
-            L = list(L)
-            t = UrlSnarfThread(target=doSnarf, url=url)
-            t.start()
+            key = (irc.network, ircutils.toLower(channel))
+            if not snarfExecutor.submit(key, url, doSnarf):
+                self.log.info('Not snarfing %s in %s, too many URLs are '
+                              'already waiting to be snarfed there.',
+                              url, channel)
     newf = utils.python.changeFunctionName(newf, f.func_name, f.__doc__)
     return newf
 
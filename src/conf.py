@@ -243,6 +243,7 @@ class Servers(registry.SpaceSeparatedListOfStrings):
     def append(self, s):
         L = registry.SpaceSeparatedListOfStrings.__call__(self)
         L.append(s)
+        registry.changed()
 
 class SpaceSeparatedSetOfChannels(registry.SpaceSeparatedListOf):
     sorted = True
@@ -542,6 +543,20 @@ registerGlobalValue(supybot, 'snarfThrottle',
     snarfed URLs, in order to prevent loops between two bots snarfing the same
     URLs and having the snarfed URL in the output of the snarf message."""))
 
+registerGroup(supybot, 'snarfers')
+registerGlobalValue(supybot.snarfers, 'threads',
+    registry.PositiveInteger(4, """Determines how many threads the bot uses to
+    run URL snarfers.  Snarfs for different channels run in parallel; those for
+    the same channel run one at a time, in order.  Changes take effect when the
+    bot is restarted."""))
+registerGlobalValue(supybot.snarfers, 'perHost',
+    registry.PositiveInteger(2, """Determines how many URLs from the same host
+    the bot will snarf at once, so one slow site can't tie up all the snarfer
+    threads."""))
+registerGlobalValue(supybot.snarfers, 'maximumQueued',
+    registry.PositiveInteger(100, """Determines how many URLs may be waiting to
+    be snarfed in any one channel.  URLs beyond that are ignored."""))
+
 registerGlobalValue(supybot, 'upkeepInterval',
     registry.PositiveInteger(3600, """Determines the number of seconds between
     running the upkeep function that flushes (commits) open databases, collects
@@ -562,6 +577,12 @@ registerGlobalValue(supybot, 'flush',
 ###
 registerGroup(supybot, 'commands')
 
+registerGlobalValue(supybot.commands, 'processes',
+    registry.PositiveInteger(2, """Determines how many worker processes the
+    bot will keep around for running things like user-supplied regexps, which
+    are run in a separate process so they can be killed if they take too
+    long."""))
+
 class ValidQuotes(registry.Value):
     """Value must consist solely of \", ', and ` characters."""
     def setValue(self, v):
@@ -665,13 +686,15 @@ registerGlobalValue(supybot.drivers, 'poll',
     driver should block waiting for input."""))
 
 class ValidDriverModule(registry.OnlySomeStrings):
-    validStrings = ('default', 'Socket', 'Twisted')
+    validStrings = ('default', 'Socket', 'Select', 'Twisted')
 
 registerGlobalValue(supybot.drivers, 'module',
     ValidDriverModule('default', """Determines what driver module the bot will
     use.  Socket, a simple driver based on timeout sockets, is used by default
-    because it's simple and stable.  Twisted is very stable and simple, and if
-    you've got Twisted installed, is probably your best bet."""))
+    because it's simple and stable.  Select waits on all of the bot's
+    connections at once, and so responds faster when the bot is connected to
+    many networks.  Twisted is very stable and simple, and if you've got
+    Twisted installed, is probably your best bet."""))
 
 registerGlobalValue(supybot.drivers, 'maxReconnectWait',
     registry.PositiveFloat(300.0, """Determines the maximum time the bot will
@@ -712,7 +735,7 @@ class DataFilename(registry.String):
         if not v.startswith(dataDir):
             v = os.path.basename(v)
             v = os.path.join(dataDir, v)
-        self.setValue(v)
+            self.setValue(v)
         return v
 
 class DataFilenameDirectory(DataFilename, Directory):
@@ -734,7 +757,12 @@ registerGlobalValue(supybot.directories.data, 'tmp',
     DataFilenameDirectory('tmp', """Determines what directory temporary files
     are put into."""))
 
+registerGlobalValue(supybot.directories.data, 'web',
+    DataFilenameDirectory('web', """Determines what directory cached HTTP
+    responses are put into."""))
+
 utils.file.AtomicFile.default.tmpDir = supybot.directories.data.tmp
+utils.web.cache.directory = supybot.directories.data.web
 utils.file.AtomicFile.default.backupDir = supybot.directories.backup
 
 registerGlobalValue(supybot.directories, 'plugins',
@@ -762,7 +790,7 @@ class Databases(registry.SpaceSeparatedListOfStrings):
     def __call__(self):
         v = super(Databases, self).__call__()
         if not v:
-            v = ['anydbm', 'cdb', 'flat', 'pickle']
+            v = ['anydbm', 'cdb', 'flat', 'pickle', 'indexed']
             if 'sqlite' in sys.modules:
                 v.insert(0, 'sqlite')
             if 'sqlite3' in sys.modules:
@@ -777,7 +805,10 @@ class Databases(registry.SpaceSeparatedListOfStrings):
 registerGlobalValue(supybot, 'databases',
     Databases([], """Determines what databases are available for use. If this
     value is not configured (that is, if its value is empty) then sane defaults
-    will be provided."""))
+    will be provided.  Plugins use the first database in this list that they
+    support, so to move a plugin's flat database to the indexed one (its
+    existing flat database is imported the first time the indexed one is
+    opened), put 'indexed' ahead of 'flat' here."""))
 
 registerGroup(supybot.databases, 'users')
 registerGlobalValue(supybot.databases.users, 'filename',
@@ -981,6 +1012,17 @@ registerGlobalValue(supybot.protocols.irc, 'maxHistoryLength',
     keep around in its history.  Changing this variable will not take effect
     until the bot is restarted."""))
 
+registerGlobalValue(supybot.protocols.irc, 'maxHostmasks',
+    registry.PositiveInteger(10000, """Determines how many hostmasks the bot
+    will remember for nicks it doesn't share a channel with.  When it has more
+    than this, it forgets those of the nicks it has heard from least
+    recently."""))
+
+registerGlobalValue(supybot.protocols.irc, 'hostmaskTimeout',
+    registry.PositiveInteger(3600, """Determines how many seconds the bot will
+    remember the hostmask of a nick it doesn't share a channel with after it
+    last heard from or about it."""))
+
 registerGlobalValue(supybot.protocols.irc, 'throttleTime',
     registry.Float(1.0, """A floating point number of seconds to throttle
     queued messages -- that is, messages will not be sent faster than once per
@@ -1005,6 +1047,21 @@ registerGlobalValue(supybot.protocols.irc.queuing, 'duplicates',
     multiple times; most of the time it doesn't matter, unless you're doing
     certain kinds of plugin hacking."""))
 
+registerGlobalValue(supybot.protocols.irc.queuing, 'penalty',
+    registry.Boolean(False, """Determines whether the bot will pace the
+    messages it sends according to the flood penalty the server charges for
+    them, rather than sending one message every
+    supybot.protocols.irc.throttleTime seconds.  This lets the bot send bursts
+    of messages when it hasn't sent much recently, without being disconnected
+    for flooding when it has."""))
+registerGlobalValue(supybot.protocols.irc.queuing.penalty, 'window',
+    registry.PositiveFloat(10.0, """Determines how many seconds of flood
+    penalty the server allows a client to accumulate before it stops
+    processing its messages."""))
+registerGlobalValue(supybot.protocols.irc.queuing.penalty, 'bytes',
+    registry.PositiveInteger(120, """Determines how many bytes of a message
+    the server charges an extra second of flood penalty for."""))
+
 registerGroup(supybot.protocols.irc.queuing, 'rateLimit')
 registerGlobalValue(supybot.protocols.irc.queuing.rateLimit, 'join',
     registry.Float(0, """Determines how many seconds must elapse between JOINs
@@ -1025,6 +1082,20 @@ registerGlobalValue(supybot.protocols.http, 'proxy',
     through.  The value should be of the form 'host:port'."""))
 utils.web.proxy = supybot.protocols.http.proxy
 
+registerGroup(supybot.protocols.http, 'cache')
+registerGlobalValue(supybot.protocols.http.cache, 'memory',
+    registry.NonNegativeInteger(0, """Determines how many bytes of HTTP
+    responses the bot will keep in memory, so pages that haven't changed
+    don't have to be downloaded again.  0, the default, disables the
+    in-memory cache; 1048576 (1MB) is a reasonable size for it."""))
+registerGlobalValue(supybot.protocols.http.cache, 'disk',
+    registry.NonNegativeInteger(0, """Determines how many bytes of
+    HTTP responses the bot will keep on disk, in
+    supybot.directories.data.web.  0, the default, disables the on-disk
+    cache."""))
+utils.web.cache.memorySize = supybot.protocols.http.cache.memory
+utils.web.cache.diskSize = supybot.protocols.http.cache.disk
+
 
 ###
 # Especially boring stuff.
@@ -31,8 +31,11 @@
 Module for some slight database-independence for simple databases.
 """
 
+import os
 import csv
 import math
+import bisect
+import threading
 
 import supybot.cdb as cdb
 import supybot.utils as utils
@@ -86,6 +89,11 @@ class MappingInterface(object):
         "Cleans up in the database, if possible.  Not required to do anything."
         pass
 
+    def ids(self):
+        """Returns a sorted list of the ids in the mapping, or None if the
+        mapping can't find them without reading every record."""
+        return None
+
 
 class DirMapping(MappingInterface):
     def __init__(self, filename, **kwargs):
@@ -271,6 +279,264 @@ class FlatfileMapping(MappingInterface):
         self.vacuum() # Should we do this?  It should be fine.
         
 
+class IndexedMapping(MappingInterface):
+    """A mapping whose records live in a data file and whose ids map to
+    (offset, length) pairs in a fixed-width index file, so that get, set and
+    remove never have to scan the database.
+
+    The data file is only ever appended to, except where space freed by
+    removed or replaced records is reused.  Record data is synced to disk
+    before the index entry pointing to it is written, and freed space isn't
+    reused until the index entries which stopped referring to it have been
+    synced (by flush or vacuum), so a crash can lose the last few changes but
+    can never leave an id pointing at the wrong data.
+    """
+    headerFormat = '%010d\n'
+    headerSize = 11
+    entryFormat = '%012d %010d\n'
+    entrySize = 24
+    def __init__(self, filename, flatFilename=None, **kwargs):
+        self.filename = filename
+        self.indexFilename = filename + '.index'
+        self.lock = threading.RLock()
+        self.index = {}
+        self.free = [] # Sorted (length, offset) pairs, for a best fit.
+        self.pending = [] # Freed, but not yet reusable; see above.
+        if not os.path.exists(self.indexFilename):
+            if os.path.exists(self.filename):
+                raise InvalidDBError, 'Missing index for IndexedMapping: %s' %\
+                                      self.filename
+            self._create(flatFilename)
+        else:
+            self._load()
+
+    def _flatFilename(self):
+        # plugins.DB names its files <plugin>.<type>.db, so this is where a
+        # flat database for the same plugin would be.
+        suffix = '.indexed.db'
+        if self.filename.endswith(suffix):
+            return self.filename[:-len(suffix)] + '.flat.db'
+        return None
+
+    def _create(self, flatFilename):
+        self.data = file(self.filename, 'w+b')
+        self.indexFile = file(self.indexFilename, 'w+b')
+        self.end = 0
+        self.nextId = 1
+        if flatFilename is None:
+            flatFilename = self._flatFilename()
+        if flatFilename is not None and os.path.exists(flatFilename):
+            self._importFlatfile(flatFilename)
+        self._writeHeader()
+        self._sync()
+
+    def _importFlatfile(self, flatFilename):
+        flat = FlatfileMapping(flatFilename)
+        entries = []
+        for (id, s) in flat:
+            self.data.write(s + '\n')
+            self.index[id] = (self.end, len(s))
+            self.end += len(s) + 1
+            entries.append(id)
+        self.nextId = max([flat.currentId] + [id+1 for id in entries])
+        self.data.flush()
+        os.fsync(self.data.fileno())
+        for id in entries:
+            self._writeEntry(id, self.index[id])
+
+    def _load(self):
+        self.data = file(self.filename, 'r+b')
+        self.indexFile = file(self.indexFilename, 'r+b')
+        self.data.seek(0, 2) # End.
+        size = self.data.tell()
+        contents = self.indexFile.read()
+        try:
+            self.nextId = int(contents[:self.headerSize])
+        except ValueError:
+            raise InvalidDBError, 'Invalid index for IndexedMapping: %s' % \
+                                  self.indexFilename
+        offsets = []
+        id = 1
+        start = self.headerSize
+        while start + self.entrySize <= len(contents):
+            entry = contents[start:start+self.entrySize]
+            try:
+                (offset, length) = map(int, entry.split())
+                if offset + length < size: # Otherwise it's a torn write.
+                    self.index[id] = (offset, length)
+                    offsets.append((offset, length+1))
+            except ValueError:
+                pass # Removed or never set.
+            id += 1
+            start += self.entrySize
+        if self.index:
+            self.nextId = max(self.nextId, max(self.index)+1)
+        # Whatever no index entry refers to is free for reuse.
+        offsets.sort()
+        self.end = 0
+        for (offset, length) in offsets:
+            if offset > self.end:
+                self.free.append((offset - self.end, self.end))
+            self.end = max(self.end, offset + length)
+        self.free.sort()
+        if self.end < size:
+            self.data.truncate(self.end)
+
+    def _writeHeader(self):
+        self.indexFile.seek(0)
+        self.indexFile.write(self.headerFormat % self.nextId)
+
+    def _writeEntry(self, id, slot):
+        self.indexFile.seek(self.headerSize + (id-1)*self.entrySize)
+        if slot is None:
+            self.indexFile.write('-'*(self.entrySize-1) + '\n')
+        else:
+            self.indexFile.write(self.entryFormat % slot)
+
+    def _allocate(self, size):
+        i = bisect.bisect_left(self.free, (size, 0))
+        if i < len(self.free):
+            (length, offset) = self.free.pop(i)
+            if length > size:
+                bisect.insort(self.free, (length - size, offset + size))
+            return offset
+        offset = self.end
+        self.end += size
+        return offset
+
+    def _write(self, s):
+        if '\n' in s:
+            raise Error, 'IndexedMapping records cannot contain newlines.'
+        offset = self._allocate(len(s) + 1)
+        self.data.seek(offset)
+        self.data.write(s + '\n')
+        self.data.flush()
+        os.fsync(self.data.fileno())
+        return (offset, len(s))
+
+    def _release(self, slot):
+        (offset, length) = slot
+        self.pending.append((length+1, offset))
+
+    def _sync(self):
+        self.indexFile.flush()
+        os.fsync(self.indexFile.fileno())
+        for slot in self.pending:
+            bisect.insort(self.free, slot)
+        self.pending = []
+
+    def get(self, id):
+        self.lock.acquire()
+        try:
+            try:
+                (offset, length) = self.index[id]
+            except KeyError:
+                raise NoRecordError, id
+            self.data.seek(offset)
+            return self.data.read(length)
+        finally:
+            self.lock.release()
+
+    def set(self, id, s):
+        self.lock.acquire()
+        try:
+            slot = self._write(s)
+            self._writeEntry(id, slot)
+            if id in self.index:
+                self._release(self.index[id])
+            self.index[id] = slot
+            if id >= self.nextId:
+                self.nextId = id + 1
+                self._writeHeader()
+            self.indexFile.flush()
+        finally:
+            self.lock.release()
+
+    def add(self, s):
+        self.lock.acquire()
+        try:
+            id = self.nextId
+            self.set(id, s)
+            return id
+        finally:
+            self.lock.release()
+
+    def remove(self, id):
+        self.lock.acquire()
+        try:
+            try:
+                slot = self.index.pop(id)
+            except KeyError:
+                raise NoRecordError, id
+            self._writeEntry(id, None)
+            self.indexFile.flush()
+            self._release(slot)
+        finally:
+            self.lock.release()
+
+    def __iter__(self):
+        ids = self.index.keys()
+        ids.sort()
+        for id in ids:
+            try:
+                yield (id, self.get(id))
+            except NoRecordError:
+                continue # Removed since we started.
+
+    def __len__(self):
+        return len(self.index)
+
+    def ids(self):
+        self.lock.acquire()
+        try:
+            return sorted(self.index)
+        finally:
+            self.lock.release()
+
+    def vacuum(self):
+        """Makes the space freed since the last flush available for reuse,
+        merging adjacent free space and giving any at the end of the data
+        file back to the filesystem."""
+        self.lock.acquire()
+        try:
+            self._sync()
+            holes = [(offset, length) for (length, offset) in self.free]
+            holes.sort()
+            merged = []
+            for (offset, length) in holes:
+                if merged and merged[-1][0] + merged[-1][1] == offset:
+                    merged[-1] = (merged[-1][0], merged[-1][1] + length)
+                else:
+                    merged.append((offset, length))
+            if merged and merged[-1][0] + merged[-1][1] == self.end:
+                self.end = merged.pop()[0]
+                self.data.truncate(self.end)
+            self.free = [(length, offset) for (offset, length) in merged]
+            self.free.sort()
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self._sync()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.vacuum()
+        self.data.close()
+        self.indexFile.close()
+
+
+def convertFlatfile(flatFilename, filename):
+    """Converts the FlatfileMapping database in flatFilename to an
+    IndexedMapping database in filename.  The flat file is left alone."""
+    if os.path.exists(filename + '.index'):
+        raise Error, '%s is already an IndexedMapping database.' % filename
+    IndexedMapping(filename, flatFilename=flatFilename).close()
+
+
 class CdbMapping(MappingInterface):
     def __init__(self, filename, **kwargs):
         self.filename = filename
@@ -316,9 +582,108 @@ class CdbMapping(MappingInterface):
         self.db.close()
 
 
+class Condition(object):
+    """A condition on records for DB.select.  Conditions only look at the
+    fields they name in self.fields, so DB.select needn't deserialize the rest
+    of a record to find out it doesn't match."""
+    fields = ()
+    def __call__(self, record):
+        raise NotImplementedError
+
+
+class Equals(Condition):
+    """The field's value, passed through normalize if it's given, is equal
+    to value (likewise normalized).  DB.select can answer this from a
+    secondary index when the DB indexes the field with the same normalize."""
+    def __init__(self, field, value, normalize=None):
+        self.field = field
+        self.fields = (field,)
+        self.normalize = normalize
+        self.value = self._normalize(value)
+
+    def _normalize(self, value):
+        if self.normalize is not None:
+            value = self.normalize(value)
+        return value
+
+    def __call__(self, record):
+        return self._normalize(getattr(record, self.field)) == self.value
+
+
+class Contains(Condition):
+    """The field's value contains the string s."""
+    def __init__(self, field, s, ignoreCase=True):
+        self.field = field
+        self.fields = (field,)
+        self.ignoreCase = ignoreCase
+        if ignoreCase:
+            s = s.lower()
+        self.s = s
+
+    def __call__(self, record):
+        value = getattr(record, self.field)
+        if self.ignoreCase:
+            value = value.lower()
+        return self.s in value
+
+
+class Matches(Condition):
+    """The regexp is found in the field's value."""
+    def __init__(self, field, regexp):
+        self.field = field
+        self.fields = (field,)
+        self.regexp = regexp
+
+    def __call__(self, record):
+        return self.regexp.search(getattr(record, self.field)) is not None
+
+
+class Satisfies(Condition):
+    """The function f returns True for the field's value."""
+    def __init__(self, field, f):
+        self.field = field
+        self.fields = (field,)
+        self.f = f
+
+    def __call__(self, record):
+        return bool(self.f(getattr(record, self.field)))
+
+
+class Range(Condition):
+    """The field's value is at least low and at most high; either can be
+    None for no bound."""
+    def __init__(self, field, low=None, high=None):
+        self.field = field
+        self.fields = (field,)
+        self.low = low
+        self.high = high
+
+    def __call__(self, record):
+        value = getattr(record, self.field)
+        if self.low is not None and value < self.low:
+            return False
+        if self.high is not None and value > self.high:
+            return False
+        return True
+
+
+class Not(Condition):
+    """The given condition doesn't hold."""
+    def __init__(self, condition):
+        self.condition = condition
+        self.fields = condition.fields
+
+    def __call__(self, record):
+        return not self.condition(record)
+
+
 class DB(object):
     Mapping = 'flat' # This is a good, sane default.
     Record = None
+    # Maps field names to the normalizing function (or None) of a secondary
+    # index on that field.  The indexes are built the first time select can
+    # use them and kept up to date by add, set and remove after that.
+    indexes = {}
     def __init__(self, filename, Mapping=None, Record=None):
         if Record is not None:
             self.Record = Record
@@ -327,6 +692,7 @@ class DB(object):
         if isinstance(self.Mapping, basestring):
             self.Mapping = Mappings[self.Mapping]
         self.map = self.Mapping(filename)
+        self.secondaryIndexes = None
 
     def _newRecord(self, id, s):
         record = self.Record(id=id)
@@ -339,26 +705,144 @@ class DB(object):
 
     def set(self, id, record):
         s = record.serialize()
+        if self.secondaryIndexes is not None:
+            self._unindex(id)
         self.map.set(id, s)
+        if self.secondaryIndexes is not None:
+            self._index(id, record)
 
     def add(self, record):
         s = record.serialize()
         id = self.map.add(s)
         record.id = id
+        if self.secondaryIndexes is not None:
+            self._index(id, record)
         return id
 
     def remove(self, id):
+        if self.secondaryIndexes is not None:
+            self._unindex(id)
         self.map.remove(id)
 
+    def _index(self, id, record):
+        for (field, normalize) in self.indexes.iteritems():
+            value = getattr(record, field)
+            if normalize is not None:
+                value = normalize(value)
+            self.secondaryIndexes[field].setdefault(value, set()).add(id)
+
+    def _unindex(self, id):
+        try:
+            record = self.get(id)
+        except NoRecordError:
+            return
+        for (field, normalize) in self.indexes.iteritems():
+            value = getattr(record, field)
+            if normalize is not None:
+                value = normalize(value)
+            ids = self.secondaryIndexes[field].get(value)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self.secondaryIndexes[field][value]
+
+    def _buildIndexes(self):
+        self.secondaryIndexes = {}
+        for field in self.indexes:
+            self.secondaryIndexes[field] = {}
+        fields = set(self.indexes)
+        for (id, s) in self.map:
+            record = self.Record(id=id)
+            record.deserialize(s, fields)
+            self._index(id, record)
+
+    def _candidates(self, where):
+        """Returns the set of ids a secondary index says could satisfy
+        where, or None if none of our indexes applies."""
+        for condition in where:
+            if isinstance(condition, Equals) and \
+               condition.field in self.indexes and \
+               condition.normalize is self.indexes[condition.field]:
+                if self.secondaryIndexes is None:
+                    self._buildIndexes()
+                index = self.secondaryIndexes[condition.field]
+                return index.get(condition.value, set())
+        return None
+
+    def _pairs(self, candidates, reverse):
+        """Yields (id, s) pairs in order of id, only reading the records
+        it yields if the mapping allows."""
+        ids = self.map.ids()
+        if ids is None:
+            pairs = list(self.map)
+            if candidates is not None:
+                pairs = [(id, s) for (id, s) in pairs if id in candidates]
+            pairs.sort()
+            if reverse:
+                pairs.reverse()
+            for pair in pairs:
+                yield pair
+            return
+        if candidates is not None:
+            ids = sorted(candidates)
+        if reverse:
+            ids.reverse()
+        for id in ids:
+            try:
+                yield (id, self.map.get(id))
+            except NoRecordError:
+                continue
+
+    def _matches(self, pairs, where, p):
+        fields = set()
+        for condition in where:
+            fields.update(condition.fields)
+        for (id, s) in pairs:
+            record = self.Record(id=id)
+            if fields:
+                record.deserialize(s, fields)
+                matched = True
+                for condition in where:
+                    if not condition(record):
+                        matched = False
+                        break
+                if not matched:
+                    continue
+            record.deserialize(s)
+            if p is None or p(record):
+                yield record
+
     def __iter__(self):
         for (id, s) in self.map:
             # We don't need to yield the id because it's in the record.
             yield self._newRecord(id, s)
 
-    def select(self, p):
-        for record in self:
-            if p(record):
-                yield record
+    def select(self, p=None, where=(), order=None, reverse=False,
+               limit=None):
+        """Yields the records satisfying the predicate p and every Condition
+        in where, in order of id or, if order is given, of the field named by
+        order.  reverse reverses that order, and at most limit records are
+        yielded.
+
+        Records are only deserialized in full once they've satisfied where,
+        and when where has an Equals on an indexed field, only the records
+        with the right value for that field are read at all.  Without order,
+        records are read lazily, so a limit saves reading the rest."""
+        candidates = self._candidates(where)
+        records = self._matches(self._pairs(candidates, reverse), where, p)
+        if order is not None:
+            L = [(getattr(record, order), record.id, record)
+                 for record in records]
+            L.sort()
+            if reverse:
+                L.reverse()
+            records = [record for (_, _, record) in L]
+        count = 0
+        for record in records:
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield record
 
     def random(self):
         try:
@@ -367,7 +851,10 @@ class DB(object):
             return None
 
     def size(self):
-        return ilen(self.map)
+        try:
+            return len(self.map)
+        except TypeError:
+            return ilen(self.map)
 
     def flush(self):
         self.map.flush()
@@ -381,6 +868,7 @@ class DB(object):
 Mappings = {
     'cdb': CdbMapping,
     'flat': FlatfileMapping,
+    'indexed': IndexedMapping,
     }
 
 
@@ -421,10 +909,13 @@ class Record(object):
     def serialize(self):
         return csv.join([repr(getattr(self, name)) for name in self.fields])
 
-    def deserialize(self, s):
+    def deserialize(self, s, fields=None):
+        """Sets our fields from the serialized record s.  If fields is given,
+        only those fields are converted."""
         unseenRecords = set(self.fields)
         for (name, strValue) in zip(self.fields, csv.split(s)):
-            setattr(self, name, self.converters[name](strValue))
+            if fields is None or name in fields:
+                setattr(self, name, self.converters[name](strValue))
             unseenRecords.remove(name)
         for name in unseenRecords:
             setattr(self, name, self.defaults[name])
@@ -0,0 +1,306 @@
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Contains a driver which multiplexes all the bot's connections in a single
+select (or epoll, where available) loop.  Rather than blocking in each
+connection's recv in turn, the loop only wakes up when a socket is ready or
+when the next scheduled event is due.
+"""
+
+from __future__ import division
+
+import time
+import errno
+import select
+import socket
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+import supybot.schedule as schedule
+import supybot.drivers.Socket as Socket
+
+ssl = Socket.ssl
+
+class SelectDriver(Socket.SocketDriver):
+    """A SocketDriver whose reading and writing is done by the poller
+    rather than by its own run method."""
+    def __init__(self, irc):
+        poller.register(self)
+        Socket.SocketDriver.__init__(self, irc)
+
+    def run(self):
+        # All the work is done by the poller, which knows when we're ready.
+        pass
+
+    def reconnect(self, reset=True):
+        Socket.SocketDriver.reconnect(self, reset=reset)
+        if self.connected:
+            # The poller tells us when to read, so we never need to block.
+            self.conn.settimeout(0)
+
+    def deadline(self):
+        """Returns the time by which the poller should wake up for us, or
+        None if we don't need to be woken up until our socket is ready."""
+        times = [t for t in (self.nextReconnectTime, self.writeCheckTime)
+                 if t is not None]
+        if self.connected and self.irc is not None:
+            if self.irc.fastqueue:
+                times.append(0)
+            elif self.irc.queue:
+                if conf.supybot.protocols.irc.queuing.penalty():
+                    times.append(self.irc.queue.nextSendTime())
+                else:
+                    throttle = conf.supybot.protocols.irc.throttleTime()
+                    times.append(self.irc.lastTake + throttle)
+        if times:
+            return min(times)
+        return None
+
+    def checkTimers(self):
+        now = time.time()
+        if self.nextReconnectTime is not None and now > self.nextReconnectTime:
+            self.reconnect()
+        elif self.writeCheckTime is not None and now > self.writeCheckTime:
+            self._checkAndWriteOrReconnect()
+            if self.connected:
+                self.conn.settimeout(0)
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def wantsWrite(self):
+        return bool(self.outbuffer)
+
+    def flush(self):
+        if self.connected:
+            self._sendIfMsgs()
+
+    def _recv(self):
+        try:
+            data = self.conn.recv(1024)
+            # SSL sockets may have already decrypted more than we asked for,
+            # and select won't tell us about that, so we take it all now.
+            while data and getattr(self.conn, 'pending', None) and \
+                  self.conn.pending():
+                data += self.conn.recv(self.conn.pending())
+            return data
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise
+
+    def read(self):
+        """Reads whatever is available on our socket and feeds the complete
+        messages to our Irc."""
+        try:
+            data = self._recv()
+            if data is None:
+                return
+            if not data:
+                self._handleSocketError(socket.error('Connection closed.'))
+                return
+        except socket.error, e:
+            if ssl and isinstance(e, ssl.SSLError) and \
+               e.args[0] in (ssl.SSL_ERROR_WANT_READ,
+                             ssl.SSL_ERROR_WANT_WRITE):
+                return
+            self._handleSocketError(e)
+            return
+        self.eagains = 0 # If we successfully recv'ed, we can reset this.
+        self.inbuffer += data
+        lines = self.inbuffer.split('\n')
+        self.inbuffer = lines.pop()
+        for line in lines:
+            msg = drivers.parseMsg(line)
+            if msg is not None:
+                self.irc.feedMsg(msg)
+
+    def _reallyDie(self):
+        poller.unregister(self)
+        Socket.SocketDriver._reallyDie(self)
+
+
+class SelectPoller(drivers.IrcDriver):
+    """The driver which actually waits on and services all the SelectDriver
+    sockets.  There is only ever one of these, the module-level poller.
+    It's only in the driver loop while it has drivers to service."""
+    def __init__(self):
+        # We don't call IrcDriver.__init__, since that would add us to the
+        # driver loop before we have anything to do; register does that.
+        self.drivers = []
+        self.epoll = None
+        self.registered = {}
+
+    def name(self):
+        return self.__class__.__name__
+
+    def inDriverLoop(self):
+        name = self.name()
+        if (name, self) in drivers._newDrivers:
+            return True
+        return drivers._drivers.get(name) is self and \
+               name not in drivers._deadDrivers
+
+    def register(self, driver):
+        self.drivers.append(driver)
+        # This also puts us back in the loop if an uncaught exception in
+        # our run method got us removed from it.
+        if not self.inDriverLoop():
+            if hasattr(select, 'epoll') and \
+               (self.epoll is None or self.epoll.closed):
+                self.epoll = select.epoll()
+                self.registered = {}
+            drivers.add(self.name(), self)
+
+    def unregister(self, driver):
+        if driver in self.drivers:
+            self.drivers.remove(driver)
+            if not self.drivers:
+                # Otherwise we'd sit in the loop sleeping for nothing.
+                name = self.name()
+                if (name, self) in drivers._newDrivers:
+                    drivers._newDrivers.remove((name, self))
+                if drivers._drivers.get(name) is self:
+                    drivers.remove(name)
+
+    def _liveDrivers(self):
+        return [driver for driver in self.drivers if driver.irc is not None]
+
+    def timeout(self, liveDrivers):
+        """Returns how long we can wait before something other than socket
+        readiness needs our attention."""
+        now = time.time()
+        deadlines = [now + conf.supybot.drivers.poll()]
+        deadline = schedule.nextDeadline()
+        if deadline is not None:
+            deadlines.append(deadline)
+        for driver in liveDrivers:
+            deadline = driver.deadline()
+            if deadline is not None:
+                deadlines.append(deadline)
+        return max(0, min(deadlines) - now)
+
+    def _select(self, readers, writers, timeout):
+        if not readers and not writers:
+            # Some platforms don't allow select with no descriptors at all.
+            time.sleep(timeout)
+            return ([], [])
+        try:
+            (r, w, _) = select.select(readers, writers, [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return ([], [])
+            raise
+        return (r, w)
+
+    def _epoll(self, readers, writers, timeout):
+        wanted = {}
+        for driver in readers:
+            wanted[driver.conn.fileno()] = (driver, select.EPOLLIN)
+        for driver in writers:
+            (_, mask) = wanted[driver.conn.fileno()]
+            wanted[driver.conn.fileno()] = (driver, mask | select.EPOLLOUT)
+        for fd in self.registered.keys():
+            if fd not in wanted:
+                try:
+                    self.epoll.unregister(fd)
+                except (IOError, OSError, ValueError):
+                    pass # Already closed, and thus already unregistered.
+                del self.registered[fd]
+        for (fd, (driver, mask)) in wanted.iteritems():
+            key = (driver.conn, mask)
+            if self.registered.get(fd) == key:
+                continue
+            try:
+                self.epoll.register(fd, mask)
+            except (IOError, OSError), e:
+                if e.errno != errno.EEXIST:
+                    raise
+                self.epoll.modify(fd, mask)
+            self.registered[fd] = key
+        try:
+            events = self.epoll.poll(timeout)
+        except (IOError, OSError), e:
+            if e.errno == errno.EINTR:
+                return ([], [])
+            raise
+        (r, w) = ([], [])
+        for (fd, event) in events:
+            driver = wanted[fd][0]
+            if event & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP):
+                r.append(driver)
+            if event & select.EPOLLOUT:
+                w.append(driver)
+        return (r, w)
+
+    def _service(self, driver, f):
+        try:
+            f()
+        except:
+            drivers.log.exception('Uncaught exception in %s:', driver.name())
+            drivers.remove(driver.name())
+            self.unregister(driver)
+
+    def run(self):
+        liveDrivers = self._liveDrivers()
+        for driver in liveDrivers:
+            self._service(driver, driver.checkTimers)
+            self._service(driver, driver.flush)
+        liveDrivers = self._liveDrivers()
+        connected = [driver for driver in liveDrivers if driver.connected]
+        writers = [driver for driver in connected if driver.wantsWrite()]
+        timeout = self.timeout(liveDrivers)
+        if self.epoll is not None:
+            (r, _) = self._epoll(connected, writers, timeout)
+        else:
+            (r, _) = self._select(connected, writers, timeout)
+        for driver in r:
+            if driver.connected and driver.irc is not None:
+                self._service(driver, driver.read)
+        # Anything we just read may have caused messages to be queued, on
+        # this network or any other (think Relay), so we flush everyone.
+        for driver in self._liveDrivers():
+            self._service(driver, driver.flush)
+
+    def die(self):
+        if self.epoll is not None:
+            self.epoll.close()
+        drivers.IrcDriver.die(self)
+
+
+Driver = SelectDriver
+
+try:
+    ignore(poller)
+except NameError:
+    poller = SelectPoller()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -120,6 +120,7 @@ def run():
             del _drivers[name]
         except KeyError:
             pass
+    del _deadDrivers[:]
     while _newDrivers:
         (name, driver) = _newDrivers.pop()
         log.debug('Adding new driver %s.', name)
@@ -33,6 +33,7 @@ from __future__ import division
 import os
 import time
 import operator
+from cStringIO import StringIO
 
 import supybot.log as log
 import supybot.conf as conf
@@ -43,6 +44,23 @@ import supybot.registry as registry
 import supybot.unpreserve as unpreserve
 from utils.iter import imap, ilen, ifilter
 
+# checkCapability caches its results, stamped with this version, which is
+# bumped whenever something those results depend on changes.
+_capabilityVersion = 0
+def invalidateCapabilities():
+    """Invalidates the cached results of checkCapability."""
+    global _capabilityVersion
+    _capabilityVersion += 1
+
+# Bumped whenever something written to the user, channel or ignore databases
+# changes, so their flush methods know when they've nothing new to write.
+_dataVersion = 0
+def dataChanged():
+    """Notes that the databases need to be written the next time they're
+    flushed."""
+    global _dataVersion
+    _dataVersion += 1
+
 def isCapability(capability):
     return len(capability.split(None, 1)) == 1
 
@@ -127,11 +145,15 @@ class CapabilitySet(set):
         if self.__parent.__contains__(inverted):
             self.__parent.remove(inverted)
         self.__parent.add(capability)
+        invalidateCapabilities()
+        dataChanged()
 
     def remove(self, capability):
         """Removes a capability from the set."""
         capability = ircutils.toLower(capability)
         self.__parent.remove(capability)
+        invalidateCapabilities()
+        dataChanged()
 
     def __contains__(self, capability):
         capability = ircutils.toLower(capability)
@@ -228,6 +250,16 @@ class IrcUser(object):
     def __hash__(self):
         return hash(self.id)
 
+    # Changing any of these can change the result of checkCapability.
+    _capabilityAttributes = frozenset(['ignore', 'secure', 'capabilities',
+                                       'hostmasks', 'auth'])
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._capabilityAttributes:
+            invalidateCapabilities()
+        if name != 'auth': # The only thing we don't write to disk.
+            dataChanged()
+
     def addCapability(self, capability):
         """Gives the user the given capability."""
         self.capabilities.add(capability)
@@ -293,15 +325,21 @@ class IrcUser(object):
             raise ValueError, \
                   'Hostmask must contain at least 8 non-wildcard characters.'
         self.hostmasks.add(hostmask)
+        invalidateCapabilities()
+        dataChanged()
 
     def removeHostmask(self, hostmask):
         """Removes a hostmask from the user's hostmasks."""
         self.hostmasks.remove(hostmask)
+        invalidateCapabilities()
+        dataChanged()
 
     def addAuth(self, hostmask):
         """Sets a user's authenticated hostmask.  This times out in 1 hour."""
         if self.checkHostmask(hostmask, useAuth=False) or not self.secure:
             self.auth.append((time.time(), hostmask))
+            users.indexAuth(self, hostmask)
+            invalidateCapabilities()
         else:
             raise ValueError, 'secure flag set, unmatched hostmask'
 
@@ -353,14 +391,24 @@ class IrcChannel(object):
                 self.capabilities, self.lobotomized,
                 self.defaultAllow, self.silences, self.exceptions)
 
+    _capabilityAttributes = frozenset(['defaultAllow', 'capabilities'])
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._capabilityAttributes:
+            invalidateCapabilities()
+        if name != 'expiredBans':
+            dataChanged()
+
     def addBan(self, hostmask, expiration=0):
         """Adds a ban to the channel banlist."""
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
         self.bans[hostmask] = int(expiration)
+        dataChanged()
 
     def removeBan(self, hostmask):
         """Removes a ban from the channel banlist."""
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
+        dataChanged()
         return self.bans.pop(hostmask)
 
     def checkBan(self, hostmask):
@@ -374,16 +422,19 @@ class IrcChannel(object):
             else:
                 self.expiredBans.append((pattern, expiration))
                 del self.bans[pattern]
+                dataChanged()
         return False
 
     def addIgnore(self, hostmask, expiration=0):
         """Adds an ignore to the channel ignore list."""
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
         self.ignores[hostmask] = int(expiration)
+        dataChanged()
 
     def removeIgnore(self, hostmask):
         """Removes an ignore from the channel ignore list."""
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
+        dataChanged()
         return self.ignores.pop(hostmask)
 
     def addCapability(self, capability):
@@ -427,6 +478,7 @@ class IrcChannel(object):
                     return True
             else:
                 del self.ignores[pattern]
+                dataChanged()
                 # Later we may wish to keep expiredIgnores, but not now.
         return False
 
@@ -559,15 +611,112 @@ class IrcChannelCreator(Creator):
 class DuplicateHostmask(ValueError):
     pass
 
+class HostmaskIndex(object):
+    """Indexes hostmasks by the ids of the users they belong to, so the users
+    whose hostmasks match a given hostmask can be found without checking
+    every hostmask in the database.
+
+    Hostmasks without wildcards are kept in a dictionary keyed on their
+    lowered form.  Hostmasks with wildcards are kept in a trie keyed on the
+    literal components of their host, last component first, so that looking
+    up a hostmask only has to check the patterns along the path of its host.
+    """
+    def __init__(self):
+        self.exact = {}
+        self.trie = ({}, set())
+        self.hostmasks = {}
+
+    def _split(self, hostmask):
+        """Returns the lowered hostmask and, if it has wildcards, the literal
+        components of its host, last component first."""
+        lowered = ircutils.toLower(hostmask)
+        i = max(lowered.rfind('*'), lowered.rfind('?'))
+        if i == -1:
+            return (lowered, None)
+        tail = lowered[i+1:]
+        if '@' in tail:
+            components = tail.rsplit('@', 1)[1].split('.')
+        else:
+            # The first component follows a wildcard, so it isn't literal.
+            components = tail.split('.')[1:]
+        components.reverse()
+        return (lowered, components)
+
+    def _node(self, components, create=False):
+        node = self.trie
+        for component in components:
+            if component not in node[0]:
+                if not create:
+                    return None
+                node[0][component] = ({}, set())
+            node = node[0][component]
+        return node
+
+    def add(self, id, hostmask):
+        """Indexes hostmask as belonging to the user with the given id."""
+        (lowered, components) = self._split(hostmask)
+        if components is None:
+            self.exact.setdefault(lowered, set()).add((id, hostmask))
+        else:
+            self._node(components, create=True)[1].add((id, hostmask))
+        self.hostmasks.setdefault(id, set()).add(hostmask)
+
+    def remove(self, id, hostmask):
+        """Removes hostmask from the index of the user with the given id."""
+        (lowered, components) = self._split(hostmask)
+        if components is None:
+            entries = self.exact.get(lowered, set())
+            entries.discard((id, hostmask))
+            if not entries:
+                self.exact.pop(lowered, None)
+        else:
+            node = self._node(components)
+            if node is not None:
+                node[1].discard((id, hostmask))
+        hostmasks = self.hostmasks.get(id, set())
+        hostmasks.discard(hostmask)
+        if not hostmasks:
+            self.hostmasks.pop(id, None)
+
+    def removeId(self, id):
+        """Removes all the hostmasks of the user with the given id."""
+        for hostmask in list(self.hostmasks.get(id, ())):
+            self.remove(id, hostmask)
+
+    def matches(self, hostmask):
+        """Returns the ids of the users with an indexed hostmask matching
+        hostmask."""
+        ids = set()
+        for (id, _) in self.exact.get(ircutils.toLower(hostmask), ()):
+            ids.add(id)
+        host = ircutils.toLower(hostmask.rsplit('@', 1)[-1])
+        components = host.split('.')
+        components.reverse()
+        nodes = [self.trie]
+        for component in components:
+            node = nodes[-1][0].get(component)
+            if node is None:
+                break
+            nodes.append(node)
+        for node in nodes:
+            for (id, pattern) in node[1]:
+                if id not in ids and \
+                   ircutils.hostmaskPatternEqual(pattern, hostmask):
+                    ids.add(id)
+        return ids
+
+
 class UsersDictionary(utils.IterableMap):
     """A simple serialized-to-file User Database."""
     def __init__(self):
         self.noFlush = False
         self.filename = None
+        self.flushedVersion = None
         self.users = {}
         self.nextId = 0
         self._nameCache = utils.structures.CacheDict(1000)
         self._hostmaskCache = utils.structures.CacheDict(1000)
+        self._hostmaskIndex = HostmaskIndex()
 
     # This is separate because the Creator has to access our instance.
     def open(self, filename):
@@ -593,6 +742,8 @@ class UsersDictionary(utils.IterableMap):
         self.users.clear()
         self._nameCache.clear()
         self._hostmaskCache.clear()
+        self._hostmaskIndex = HostmaskIndex()
+        invalidateCapabilities()
         if self.filename is not None:
             try:
                 self.open(self.filename)
@@ -601,18 +752,27 @@ class UsersDictionary(utils.IterableMap):
         else:
             log.error('UsersDictionary.reload called with no filename.')
 
+    def _unflushed(self):
+        # Our last flush never made it to our file.
+        self.flushedVersion = None
+
     def flush(self):
-        """Flushes the database to its file."""
+        """Flushes the database to its file, if it's changed since it was
+        last flushed."""
         if not self.noFlush:
             if self.filename is not None:
+                if self.flushedVersion == _dataVersion:
+                    return
+                self.flushedVersion = _dataVersion
                 L = self.users.items()
                 L.sort()
-                fd = utils.file.AtomicFile(self.filename)
+                fd = StringIO()
                 for (id, u) in L:
                     fd.write('user %s' % id)
                     fd.write(os.linesep)
                     u.preserve(fd, indent='  ')
-                fd.close()
+                world.writeFile(self.filename, fd.getvalue(),
+                            onError=self._unflushed)
             else:
                 log.error('UsersDictionary.flush called with no filename.')
         else:
@@ -634,8 +794,11 @@ class UsersDictionary(utils.IterableMap):
                 return self._hostmaskCache[s]
             except KeyError:
                 ids = {}
-                for (id, user) in self.users.iteritems():
-                    x = user.checkHostmask(s)
+                # The index may hold hostmasks which have since been removed
+                # or authentications which have timed out, so we still check
+                # each user it gives us.
+                for id in self._hostmaskIndex.matches(s):
+                    x = self.users[id].checkHostmask(s)
                     if x:
                         ids[id] = x
                 if len(ids) == 1:
@@ -692,6 +855,7 @@ class UsersDictionary(utils.IterableMap):
         return len(self.users)
 
     def invalidateCache(self, id=None, hostmask=None, name=None):
+        invalidateCapabilities()
         if hostmask is not None:
             if hostmask in self._hostmaskCache:
                 id = self._hostmaskCache.pop(hostmask)
@@ -710,6 +874,11 @@ class UsersDictionary(utils.IterableMap):
                     del self._hostmaskCache[hostmask]
                 del self._hostmaskCache[id]
 
+    def indexAuth(self, user, hostmask):
+        """Indexes a hostmask the given user has just authenticated as."""
+        if user.id is not None and self.users.get(user.id) is user:
+            self._hostmaskIndex.add(user.id, hostmask)
+
     def setUser(self, user, flush=True):
         """Sets a user (given its id) to the IrcUser given it."""
         self.nextId = max(self.nextId, user.id)
@@ -734,12 +903,21 @@ class UsersDictionary(utils.IterableMap):
                         raise DuplicateHostmask, hostmask
         self.invalidateCache(user.id)
         self.users[user.id] = user
+        self._hostmaskIndex.removeId(user.id)
+        for hostmask in user.hostmasks:
+            self._hostmaskIndex.add(user.id, hostmask)
+        for (_, hostmask) in user.auth:
+            self._hostmaskIndex.add(user.id, hostmask)
+        # The user may well have been changed in ways we wouldn't notice.
+        dataChanged()
         if flush:
             self.flush()
 
     def delUser(self, id):
         """Removes a user from the database."""
         del self.users[id]
+        self._hostmaskIndex.removeId(id)
+        invalidateCapabilities()
         if id in self._nameCache:
             del self._nameCache[self._nameCache[id]]
             del self._nameCache[id]
@@ -747,6 +925,7 @@ class UsersDictionary(utils.IterableMap):
             for hostmask in self._hostmaskCache[id]:
                 del self._hostmaskCache[hostmask]
             del self._hostmaskCache[id]
+        dataChanged()
         self.flush()
 
     def newUser(self):
@@ -764,6 +943,7 @@ class ChannelsDictionary(utils.IterableMap):
     def __init__(self):
         self.noFlush = False
         self.filename = None
+        self.flushedVersion = None
         self.channels = ircutils.IrcDict()
 
     def open(self, filename):
@@ -784,16 +964,24 @@ class ChannelsDictionary(utils.IterableMap):
         finally:
             self.noFlush = False
 
+    def _unflushed(self):
+        # Our last flush never made it to our file.
+        self.flushedVersion = None
+
     def flush(self):
         """Flushes the channel database to its file."""
         if not self.noFlush:
             if self.filename is not None:
-                fd = utils.file.AtomicFile(self.filename)
+                if self.flushedVersion == _dataVersion:
+                    return
+                self.flushedVersion = _dataVersion
+                fd = StringIO()
                 for (channel, c) in self.channels.iteritems():
                     fd.write('channel %s' % channel)
                     fd.write(os.linesep)
                     c.preserve(fd, indent='  ')
-                fd.close()
+                world.writeFile(self.filename, fd.getvalue(),
+                            onError=self._unflushed)
             else:
                 log.warning('ChannelsDictionary.flush without self.filename.')
         else:
@@ -809,6 +997,7 @@ class ChannelsDictionary(utils.IterableMap):
         """Reloads the channel database from its file."""
         if self.filename is not None:
             self.channels.clear()
+            invalidateCapabilities()
             try:
                 self.open(self.filename)
             except EnvironmentError, e:
@@ -830,6 +1019,9 @@ class ChannelsDictionary(utils.IterableMap):
         """Sets a given channel to the IrcChannel object given."""
         channel = channel.lower()
         self.channels[channel] = ircChannel
+        invalidateCapabilities()
+        # The channel may well have been changed in ways we wouldn't notice.
+        dataChanged()
         self.flush()
 
     def iteritems(self):
@@ -839,6 +1031,7 @@ class ChannelsDictionary(utils.IterableMap):
 class IgnoresDB(object):
     def __init__(self):
         self.filename = None
+        self.flushedVersion = None
         self.hostmasks = {}
 
     def open(self, filename):
@@ -858,15 +1051,23 @@ class IgnoresDB(object):
                 log.error('Invalid line in ignores database: %q', line)
         fd.close()
 
+    def _unflushed(self):
+        # Our last flush never made it to our file.
+        self.flushedVersion = None
+
     def flush(self):
         if self.filename is not None:
-            fd = utils.file.AtomicFile(self.filename)
+            if self.flushedVersion == _dataVersion:
+                return
+            self.flushedVersion = _dataVersion
+            fd = StringIO()
             now = time.time()
             for (hostmask, expiration) in self.hostmasks.items():
                 if now < expiration or not expiration:
                     fd.write('%s %s' % (hostmask, expiration))
                     fd.write(os.linesep)
-            fd.close()
+            world.writeFile(self.filename, fd.getvalue(),
+                            onError=self._unflushed)
         else:
             log.warning('IgnoresDB.flush called without self.filename.')
 
@@ -894,6 +1095,7 @@ class IgnoresDB(object):
         for (hostmask, expiration) in self.hostmasks.items():
             if expiration and now > expiration:
                 del self.hostmasks[hostmask]
+                dataChanged()
             else:
                 if ircutils.hostmaskPatternEqual(hostmask, prefix):
                     return True
@@ -902,9 +1104,11 @@ class IgnoresDB(object):
     def add(self, hostmask, expiration=0):
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
         self.hostmasks[hostmask] = expiration
+        dataChanged()
 
     def remove(self, hostmask):
         del self.hostmasks[hostmask]
+        dataChanged()
 
 
 confDir = conf.supybot.directories.conf()
@@ -993,11 +1197,47 @@ def _checkCapabilityForUnknownUser(capability, users=users, channels=channels):
     else:
         return _x(capability, conf.supybot.capabilities.default())
 
+_capabilityCache = utils.structures.CacheDict(10000)
 def checkCapability(hostmask, capability, users=users, channels=channels):
     """Checks that the user specified by name/hostmask has the capability given.
     """
     if world.testing:
         return _x(capability, True)
+    key = (hostmask, capability)
+    try:
+        (version, cachedUsers, cachedChannels, expires, ret) = \
+            _capabilityCache[key]
+        if version == _capabilityVersion and cachedUsers is users and \
+           cachedChannels is channels and \
+           (expires is None or expires > time.time()):
+            return ret
+    except KeyError:
+        pass
+    version = _capabilityVersion
+    ret = _uncachedCheckCapability(hostmask, capability, users, channels)
+    expires = _authExpiration(hostmask, users)
+    _capabilityCache[key] = (version, users, channels, expires, ret)
+    return ret
+
+def _authExpiration(hostmask, users):
+    """Returns when the authentication the user specified by hostmask is
+    recognized by expires, or None if it doesn't."""
+    timeout = conf.supybot.databases.users.timeoutIdentification()
+    if timeout <= 0:
+        return None
+    try:
+        u = users.getUser(hostmask)
+    except (KeyError, ValueError):
+        return None
+    if u.checkHostmask(hostmask, useAuth=False):
+        return None
+    L = [when + timeout for (when, authmask) in u.auth if authmask == hostmask]
+    if L:
+        return min(L)
+    else:
+        return None
+
+def _uncachedCheckCapability(hostmask, capability, users, channels):
     try:
         u = users.getUser(hostmask)
         if u.secure and not u.checkHostmask(hostmask, useAuth=False):
@@ -1065,6 +1305,12 @@ class DefaultCapabilities(registry.SpaceSeparatedListOfStrings):
             print '*** option in order to allow a default capability of owner.'
             print '*** Don\'t do that, it\'s dumb.'
             self.value.add('-owner')
+        invalidateCapabilities()
+
+class DefaultAllow(registry.Boolean):
+    def setValue(self, v):
+        registry.Boolean.setValue(self, v)
+        invalidateCapabilities()
 
 conf.registerGlobalValue(conf.supybot, 'capabilities',
     DefaultCapabilities(['-owner', '-admin', '-trusted'], """These are the
@@ -1076,7 +1322,7 @@ conf.registerGlobalValue(conf.supybot, 'capabilities',
     understand why these default to what they do."""))
 
 conf.registerGlobalValue(conf.supybot.capabilities, 'default',
-    registry.Boolean(True, """Determines whether the bot by default will allow
+    DefaultAllow(True, """Determines whether the bot by default will allow
     users to have a capability.  If this is disabled, a user must explicitly
     have the capability for whatever command he wishes to run."""))
 
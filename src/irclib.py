@@ -28,8 +28,10 @@
 ###
 
 import re
+import sys
 import copy
 import time
+import heapq
 import random
 
 import supybot.log as log
@@ -140,25 +142,31 @@ class IrcCallback(IrcCommandDispatcher):
         pass
 
 ###
-# Basic queue for IRC messages.  It doesn't presently (but should at some
-# later point) reorder messages based on priority or penalty calculations.
+# Priority queue for IRC messages.  Messages are scored by command and target,
+# and the queue keeps track of the flood penalty the server is charging us.
 ###
 _high = frozenset(['MODE', 'KICK', 'PONG', 'NICK', 'PASS', 'CAPAB'])
 _low = frozenset(['PRIVMSG', 'PING', 'WHO', 'NOTICE', 'JOIN'])
+# Commands the server charges more than the usual penalty for, in seconds.
+_penalties = {'JOIN': 1, 'PART': 1, 'KICK': 1, 'MODE': 1, 'TOPIC': 1,
+              'WHO': 1, 'WHOIS': 1, 'NICK': 2, 'LIST': 2}
 class IrcMsgQueue(object):
-    """Class for a queue of IrcMsgs.  Eventually, it should be smart.
-
-    Probably smarter than it is now, though it's gotten quite a bit smarter
-    than it originally was.  A method to "score" methods, and a heapq to
-    maintain a priority queue of the messages would be the ideal way to do
-    intelligent queuing.
-
-    As it stands, however, we simply keep track of 'high priority' messages,
-    'low priority' messages, and normal messages, and just make sure to return
-    the 'high priority' ones before the normal ones before the 'low priority'
-    ones.
+    """Class for a priority queue of IrcMsgs.
+
+    Messages are scored first by command -- 'high priority' messages are
+    returned before normal ones, which are returned before 'low priority'
+    ones -- and then by target, so that a long backlog of messages to one
+    channel or nick doesn't hold up the messages to others.  Messages with
+    the same score are returned in the order they were queued.
+
+    The queue also models the flood penalty the server charges us, the way an
+    ircd does: each message costs a second, plus a second per
+    supybot.protocols.irc.queuing.penalty.bytes bytes, plus an extra penalty
+    for some expensive commands, and the server only lets a client get
+    supybot.protocols.irc.queuing.penalty.window seconds ahead of real time.
     """
-    __slots__ = ('msgs', 'highpriority', 'normal', 'lowpriority', 'lastJoin')
+    __slots__ = ('heap', 'counts', 'counter', 'turn', 'turns', 'lastJoin',
+                 'penaltyClock', 'sent', 'totalWait', 'maxWait')
     def __init__(self, iterable=()):
         self.reset()
         for msg in iterable:
@@ -167,61 +175,138 @@ class IrcMsgQueue(object):
     def reset(self):
         """Clears the queue."""
         self.lastJoin = 0
-        self.highpriority = smallqueue()
-        self.normal = smallqueue()
-        self.lowpriority = smallqueue()
+        self.heap = []
+        self.counts = {}
+        self.counter = 0
+        self.turn = 0
+        self.turns = {}
+        self.penaltyClock = 0
+        self.sent = 0
+        self.totalWait = 0
+        self.maxWait = 0
+
+    def _push(self, msg, queuedAt):
+        if msg.command in _high:
+            priority = 0
+        elif msg.command in _low:
+            priority = 2
+        else:
+            priority = 1
+        if msg.args:
+            target = ircutils.toLower(msg.args[0])
+        else:
+            target = ''
+        # Each target's messages take the turn after its previous message,
+        # so targets with fewer messages queued get their turn sooner.
+        turn = max(self.turns.get(target, 0), self.turn) + 1
+        self.turns[target] = turn
+        self.counter += 1
+        entry = (priority, turn, self.counter, queuedAt, target, msg)
+        heapq.heappush(self.heap, entry)
 
     def enqueue(self, msg):
         """Enqueues a given message."""
-        if msg in self and \
-           conf.supybot.protocols.irc.queuing.duplicates():
+        if conf.supybot.protocols.irc.queuing.duplicates() and msg in self:
             s = str(msg).strip()
             log.info('Not adding message %q to queue, already added.', s)
             return False
         else:
-            if msg.command in _high:
-                self.highpriority.enqueue(msg)
-            elif msg.command in _low:
-                self.lowpriority.enqueue(msg)
-            else:
-                self.normal.enqueue(msg)
+            self.counts[msg] = self.counts.get(msg, 0) + 1
+            self._push(msg, time.time())
             return True
 
     def dequeue(self):
-        """Dequeues a given message."""
-        msg = None
-        if self.highpriority:
-            msg = self.highpriority.dequeue()
-        elif self.normal:
-            msg = self.normal.dequeue()
-        elif self.lowpriority:
-            msg = self.lowpriority.dequeue()
-            if msg.command == 'JOIN':
-                limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
-                now = time.time()
-                if self.lastJoin + limit <= now:
-                    self.lastJoin = now
-                else:
-                    self.lowpriority.enqueue(msg)
-                    msg = None
+        """Dequeues a given message.
+
+        Returns None if the queue is empty or, when
+        supybot.protocols.irc.queuing.penalty is on, if sending the next
+        message would put us over the server's flood penalty limit.
+        """
+        if not self.heap:
+            return None
+        now = time.time()
+        (_, turn, _, queuedAt, target, msg) = self.heap[0]
+        if conf.supybot.protocols.irc.queuing.penalty() and \
+           now < self.creditTime(msg):
+            return None
+        heapq.heappop(self.heap)
+        if self.turns.get(target) == turn:
+            # That was the last message queued for this target.
+            del self.turns[target]
+        self.turn = max(self.turn, turn)
+        if msg.command == 'JOIN':
+            limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
+            if self.lastJoin + limit <= now:
+                self.lastJoin = now
+            else:
+                self._push(msg, queuedAt)
+                return None
+        if self.counts[msg] == 1:
+            del self.counts[msg]
+        else:
+            self.counts[msg] -= 1
+        wait = now - queuedAt
+        self.sent += 1
+        self.totalWait += wait
+        self.maxWait = max(self.maxWait, wait)
+        self.charge(msg, now)
         return msg
 
+    def cost(self, msg):
+        """Returns the flood penalty, in seconds, the server will charge us for
+        sending msg."""
+        size = conf.supybot.protocols.irc.queuing.penalty.bytes()
+        return 1 + len(str(msg)) // size + _penalties.get(msg.command, 0)
+
+    def charge(self, msg, now=None):
+        """Records that msg was sent to the server."""
+        if now is None:
+            now = time.time()
+        self.penaltyClock = max(self.penaltyClock, now) + self.cost(msg)
+
+    def penalty(self, now=None):
+        """Returns how many seconds of flood penalty the server is currently
+        holding against us."""
+        if now is None:
+            now = time.time()
+        return max(0, self.penaltyClock - now)
+
+    def creditTime(self, msg):
+        """Returns the time at which msg can be sent without going over the
+        server's flood penalty limit."""
+        window = conf.supybot.protocols.irc.queuing.penalty.window()
+        return self.penaltyClock + self.cost(msg) - window
+
+    def nextSendTime(self):
+        """Returns the time at which the next message in the queue can be sent,
+        according to the flood penalty, or None if the queue is empty."""
+        if not self.heap:
+            return None
+        return self.creditTime(self.heap[0][-1])
+
+    def oldestWait(self, now=None):
+        """Returns how long the oldest message in the queue has been
+        waiting."""
+        if not self.heap:
+            return 0
+        if now is None:
+            now = time.time()
+        return now - min([entry[3] for entry in self.heap])
+
     def __contains__(self, msg):
-        return msg in self.normal or \
-               msg in self.lowpriority or \
-               msg in self.highpriority
+        return msg in self.counts
 
     def __nonzero__(self):
-        return bool(self.highpriority or self.normal or self.lowpriority)
+        return bool(self.heap)
 
     def __len__(self):
-        return len(self.highpriority)+len(self.lowpriority)+len(self.normal)
+        return len(self.heap)
 
     def __repr__(self):
         name = self.__class__.__name__
-        return '%s(%r)' % (name, list(chain(self.highpriority,
-                                            self.normal,
-                                            self.lowpriority)))
+        L = self.heap[:]
+        L.sort()
+        return '%s(%r)' % (name, [entry[-1] for entry in L])
     __str__ = __repr__
 
 
@@ -229,31 +314,119 @@ class IrcMsgQueue(object):
 # Maintains the state of IRC connection -- the most recent messages, the
 # status of various modes (especially ops/halfops/voices) in channels, etc.
 ###
+class MemberSet(object):
+    """A set-like view of the nicks in a ChannelState that have a given
+    flag: ChannelState.USER for all the users in the channel, or
+    ChannelState.OP, HALFOP, or VOICE for those with that status."""
+    __slots__ = ('chan', 'flag')
+    def __init__(self, chan, flag):
+        self.chan = chan
+        self.flag = flag
+
+    def __contains__(self, nick):
+        return bool(self.chan.flags.get(ircutils.toLower(nick), 0) & self.flag)
+
+    def __iter__(self):
+        nicks = self.chan.nicks
+        for (key, flags) in self.chan.flags.items():
+            if flags & self.flag:
+                yield nicks[key]
+
+    def __len__(self):
+        return self.chan.counts[self.flag]
+
+    def __nonzero__(self):
+        return bool(len(self))
+
+    def __eq__(self, other):
+        return ircutils.IrcSet(self) == ircutils.IrcSet(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+    def add(self, nick):
+        self.chan.setFlags(nick, add=self.flag)
+
+    def discard(self, nick):
+        self.chan.setFlags(nick, remove=self.flag)
+
+    def remove(self, nick):
+        if nick not in self:
+            raise KeyError, nick
+        self.discard(nick)
+
+
 class ChannelState(utils.python.Object):
-    __slots__ = ('users', 'ops', 'halfops', 'bans',
-                 'voices', 'topic', 'modes', 'created')
+    # Rather than keeping a set of nicks for each of users, ops, halfops, and
+    # voices, we keep one dict of each nick's flags (and another of how it's
+    # actually capitalized), both keyed by the nick lowered and interned.
+    (USER, OP, HALFOP, VOICE) = (1, 2, 4, 8)
+    __slots__ = ('nicks', 'flags', 'bans', 'topic', 'modes', 'created')
+    # These aren't part of the channel's state proper.  counts is how many
+    # nicks have each flag, and name and index are set by the ChannelStates
+    # the channel is kept in, so it can keep its index of which nicks are in
+    # which channels up to date.
+    __slots__ += ('counts', 'name', 'index')
+    _stateSlots = __slots__[:-3]
     def __init__(self):
+        self.name = None
+        self.index = None
         self.topic = ''
         self.created = 0
-        self.ops = ircutils.IrcSet()
+        self.nicks = {}
+        self.flags = {}
+        self.counts = dict.fromkeys((self.USER, self.OP,
+                                     self.HALFOP, self.VOICE), 0)
         self.bans = ircutils.IrcSet()
-        self.users = ircutils.IrcSet()
-        self.voices = ircutils.IrcSet()
-        self.halfops = ircutils.IrcSet()
         self.modes = ircutils.IrcDict()
 
+    users = property(lambda self: MemberSet(self, self.USER))
+    ops = property(lambda self: MemberSet(self, self.OP))
+    halfops = property(lambda self: MemberSet(self, self.HALFOP))
+    voices = property(lambda self: MemberSet(self, self.VOICE))
+
     def isOp(self, nick):
-        return nick in self.ops
+        return bool(self.flags.get(ircutils.toLower(nick), 0) & self.OP)
     def isVoice(self, nick):
-        return nick in self.voices
+        return bool(self.flags.get(ircutils.toLower(nick), 0) & self.VOICE)
     def isHalfop(self, nick):
-        return nick in self.halfops
+        return bool(self.flags.get(ircutils.toLower(nick), 0) & self.HALFOP)
+
+    def setFlags(self, nick, add=0, remove=0):
+        """Gives nick the flags in add and takes away those in remove."""
+        key = intern(ircutils.toLower(nick))
+        old = self.flags.get(key, 0)
+        new = (old | add) & ~remove
+        if new == old:
+            return
+        for flag in self.counts:
+            if (old ^ new) & flag:
+                if new & flag:
+                    self.counts[flag] += 1
+                else:
+                    self.counts[flag] -= 1
+        if new:
+            self.flags[key] = new
+            if key not in self.nicks:
+                self.nicks[key] = intern(str(nick))
+        else:
+            del self.flags[key]
+            del self.nicks[key]
+        if self.index is not None and (old ^ new) & self.USER:
+            if new & self.USER:
+                self.index.add(nick, self.name)
+            else:
+                self.index.discard(nick, self.name)
 
     def addUser(self, user):
         "Adds a given user to the ChannelState.  Power prefixes are handled."
         nick = user.lstrip('@%+&~!')
         if not nick:
             return
+        flags = self.USER
         # & is used to denote protected users in UnrealIRCd
         # ~ is used to denote channel owner in UnrealIRCd
         # ! is used to denote protected users in UltimateIRCd
@@ -261,29 +434,26 @@ class ChannelState(utils.python.Object):
             (marker, user) = (user[0], user[1:])
             assert user, 'Looks like my caller is passing chars, not nicks.'
             if marker in '@&~!':
-                self.ops.add(nick)
+                flags |= self.OP
             elif marker == '%':
-                self.halfops.add(nick)
+                flags |= self.HALFOP
             elif marker == '+':
-                self.voices.add(nick)
-        self.users.add(nick)
+                flags |= self.VOICE
+        self.setFlags(nick, add=flags)
 
     def replaceUser(self, oldNick, newNick):
         """Changes the user oldNick to newNick; used for NICK changes."""
         # Note that this doesn't have to have the sigil (@%+) that users
         # have to have for addUser; it just changes the name of the user
         # without changing any of his categories.
-        for s in (self.users, self.ops, self.halfops, self.voices):
-            if oldNick in s:
-                s.remove(oldNick)
-                s.add(newNick)
+        flags = self.flags.get(ircutils.toLower(oldNick), 0)
+        if flags:
+            self.setFlags(oldNick, remove=flags)
+            self.setFlags(newNick, add=flags)
 
     def removeUser(self, user):
         """Removes a given user from the channel."""
-        self.users.discard(user)
-        self.ops.discard(user)
-        self.halfops.discard(user)
-        self.voices.discard(user)
+        self.setFlags(user, remove=self.USER|self.OP|self.HALFOP|self.VOICE)
 
     def setMode(self, mode, value=None):
         assert mode not in 'ovhbeq'
@@ -323,19 +493,147 @@ class ChannelState(utils.python.Object):
                     self.unsetMode(modeChar)
 
     def __getstate__(self):
-        return [getattr(self, name) for name in self.__slots__]
+        return [getattr(self, name) for name in self._stateSlots]
 
     def __setstate__(self, t):
-        for (name, value) in zip(self.__slots__, t):
+        self.name = None
+        self.index = None
+        for (name, value) in zip(self._stateSlots, t):
             setattr(self, name, value)
+        self.counts = dict.fromkeys((self.USER, self.OP,
+                                     self.HALFOP, self.VOICE), 0)
+        for flags in self.flags.itervalues():
+            for flag in self.counts:
+                if flags & flag:
+                    self.counts[flag] += 1
 
     def __eq__(self, other):
         ret = True
-        for name in self.__slots__:
+        for name in self._stateSlots:
             ret = ret and getattr(self, name) == getattr(other, name)
         return ret
 
 
+class NicksToChannels(ircutils.IrcDict):
+    """Maps each nick to the IrcSet of channels it's in."""
+    def add(self, nick, channel):
+        try:
+            self[nick].add(channel)
+        except KeyError:
+            self[nick] = ircutils.IrcSet([channel])
+
+    def discard(self, nick, channel):
+        try:
+            channels = self[nick]
+        except KeyError:
+            return
+        channels.discard(channel)
+        if not channels:
+            del self[nick]
+
+
+class NicksToHostmasks(ircutils.IrcDict):
+    """Maps nicks to their hostmasks.  The hostmasks of nicks that are in
+    nicksToChannels are kept as long as they are; the rest are forgotten once
+    they haven't been looked up or set for supybot.protocols.irc.hostmaskTimeout
+    seconds, or, least recently used first, when there are more than
+    supybot.protocols.irc.maxHostmasks of them."""
+    def __init__(self, *args, **kwargs):
+        self.times = {}
+        (self.hits, self.misses, self.expired) = (0, 0, 0)
+        self.nicksToChannels = NicksToChannels()
+        # We don't know which nicks to keep until IrcState tells us, so we
+        # don't forget any until then.
+        (self.sweepSize, self.sweepTime) = (sys.maxint, sys.maxint)
+        super(NicksToHostmasks, self).__init__(*args, **kwargs)
+        (self.sweepSize, self.sweepTime) = (0, 0)
+
+    def __getitem__(self, nick):
+        key = self.key(nick)
+        try:
+            (_, hostmask) = self.data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self.times[key] = time.time()
+        return hostmask
+
+    def __setitem__(self, nick, hostmask):
+        super(NicksToHostmasks, self).__setitem__(nick, hostmask)
+        now = time.time()
+        self.times[self.key(nick)] = now
+        if len(self.data) > self.sweepSize or now > self.sweepTime:
+            self.expire(now)
+
+    def __delitem__(self, nick):
+        super(NicksToHostmasks, self).__delitem__(nick)
+        del self.times[self.key(nick)]
+
+    def expire(self, now=None):
+        """Forgets the hostmasks of nicks we don't share a channel with that
+        have timed out, and as many more as it takes to get down to
+        supybot.protocols.irc.maxHostmasks."""
+        if now is None:
+            now = time.time()
+        maximum = conf.supybot.protocols.irc.maxHostmasks()
+        timeout = conf.supybot.protocols.irc.hostmaskTimeout()
+        L = [(t, key) for (key, t) in self.times.iteritems()
+             if key not in self.nicksToChannels]
+        L.sort()
+        n = max(len(self.data) - maximum, 0)
+        while n < len(L) and L[n][0] < now - timeout:
+            n += 1
+        for (_, key) in L[:n]:
+            del self.data[key]
+            del self.times[key]
+        self.expired += len(L[:n])
+        # Sweeping takes time linear in our size, so we put off the next one
+        # until there's been a good deal of growth, or a timeout has passed.
+        self.sweepSize = max(len(self.data), maximum) + maximum // 4
+        self.sweepTime = now + timeout
+
+    def stats(self):
+        """Returns a (size, pinned, hits, misses, expired, bytes) tuple, where
+        pinned is how many of the size nicks share a channel with us and bytes
+        is roughly how much memory we take up."""
+        size = len(self.data)
+        pinned = len([key for key in self.data if key in self.nicksToChannels])
+        bytes = sys.getsizeof(self.data) + sys.getsizeof(self.times)
+        for (key, (nick, hostmask)) in self.data.iteritems():
+            bytes += sys.getsizeof(key) + sys.getsizeof(nick) + \
+                     sys.getsizeof(hostmask) + 2 * sys.getsizeof(0.0)
+        return (size, pinned, self.hits, self.misses, self.expired, bytes)
+
+
+class ChannelStates(ircutils.IrcDict):
+    """The IrcDict of ChannelState objects kept by IrcState.  It keeps
+    nicksToChannels, its reverse index of the channels' users, up to date as
+    channels are added and removed."""
+    def __init__(self, *args, **kwargs):
+        self.nicksToChannels = NicksToChannels()
+        super(ChannelStates, self).__init__(*args, **kwargs)
+
+    def __setitem__(self, channel, chan):
+        if channel in self:
+            del self[channel]
+        super(ChannelStates, self).__setitem__(channel, chan)
+        if isinstance(chan, ChannelState):
+            chan.name = channel
+            chan.index = self.nicksToChannels
+            for nick in chan.users:
+                self.nicksToChannels.add(nick, channel)
+
+    def __delitem__(self, channel):
+        chan = self[channel]
+        super(ChannelStates, self).__delitem__(channel)
+        if isinstance(chan, ChannelState):
+            for nick in chan.users:
+                self.nicksToChannels.discard(nick, chan.name)
+            chan.name = None
+            chan.index = None
+
+
 class IrcState(IrcCommandDispatcher):
     """Maintains state of the Irc connection.  Should also become smarter.
     """
@@ -347,10 +645,12 @@ class IrcState(IrcCommandDispatcher):
             history = RingBuffer(conf.supybot.protocols.irc.maxHistoryLength())
         if supported is None:
             supported = utils.InsensitivePreservingDict()
-        if nicksToHostmasks is None:
-            nicksToHostmasks = ircutils.IrcDict()
-        if channels is None:
-            channels = ircutils.IrcDict()
+        if not isinstance(nicksToHostmasks, NicksToHostmasks):
+            nicksToHostmasks = NicksToHostmasks(nicksToHostmasks)
+        if not isinstance(channels, ChannelStates):
+            channels = ChannelStates(channels)
+        # We never forget the hostmasks of nicks we share a channel with.
+        nicksToHostmasks.nicksToChannels = channels.nicksToChannels
         self.supported = supported
         self.history = history
         self.channels = channels
@@ -378,14 +678,17 @@ class IrcState(IrcCommandDispatcher):
         return not self == other
 
     def copy(self):
-        ret = self.__class__()
+        ret = self.__class__(channels=copy.deepcopy(self.channels),
+                nicksToHostmasks=copy.deepcopy(self.nicksToHostmasks))
         ret.history = copy.deepcopy(self.history)
-        ret.nicksToHostmasks = copy.deepcopy(self.nicksToHostmasks)
-        ret.channels = copy.deepcopy(self.channels)
         return ret
 
     def addMsg(self, irc, msg):
-        """Updates the state based on the irc object and the message."""
+        """Updates the state based on the irc object and the message.
+
+        QUIT and NICK messages are tagged with 'channels', the list of
+        channels the nick was in before the message was handled.
+        """
         self.history.append(msg)
         if ircutils.isUserHostmask(msg.prefix) and not msg.command == 'NICK':
             self.nicksToHostmasks[msg.nick] = msg.prefix
@@ -401,6 +704,13 @@ class IrcState(IrcCommandDispatcher):
         """Returns the hostmask for a given nick."""
         return self.nicksToHostmasks[nick]
 
+    def channelsOf(self, nick):
+        """Returns a list of the channels nick is in."""
+        try:
+            return map(str, self.channels.nicksToChannels[nick])
+        except KeyError:
+            return []
+
     def do004(self, irc, msg):
         """Handles parsing the 004 reply
 
@@ -554,8 +864,12 @@ class IrcState(IrcCommandDispatcher):
                 chan.removeUser(user)
 
     def doQuit(self, irc, msg):
-        for channel in self.channels.itervalues():
-            channel.removeUser(msg.nick)
+        # Callbacks see the message after we've updated the state, so we leave
+        # them a note of the channels the nick was in before it.
+        channels = self.channelsOf(msg.nick)
+        msg.tag('channels', channels)
+        for channel in channels:
+            self.channels[channel].removeUser(msg.nick)
         if msg.nick in self.nicksToHostmasks:
             # If we're quitting, it may not be.
             del self.nicksToHostmasks[msg.nick]
@@ -585,8 +899,10 @@ class IrcState(IrcCommandDispatcher):
             del self.nicksToHostmasks[oldNick]
         except KeyError:
             pass
-        for channel in self.channels.itervalues():
-            channel.replaceUser(oldNick, newNick)
+        channels = self.channelsOf(oldNick)
+        msg.tag('channels', channels)
+        for channel in channels:
+            self.channels[channel].replaceUser(oldNick, newNick)
 
 
 
@@ -719,8 +1035,14 @@ class Irc(IrcCommandDispatcher):
         msg = None
         if self.fastqueue:
             msg = self.fastqueue.dequeue()
+            self.queue.charge(msg, now)
         elif self.queue:
-            if now-self.lastTake <= conf.supybot.protocols.irc.throttleTime():
+            if conf.supybot.protocols.irc.queuing.penalty():
+                # The queue itself won't give us a message until the server
+                # would accept it without penalizing us.
+                msg = self.queue.dequeue()
+            elif now - self.lastTake <= \
+                 conf.supybot.protocols.irc.throttleTime():
                 log.debug('Irc.takeMsg throttling.')
             else:
                 self.lastTake = now
@@ -783,8 +1105,10 @@ class Irc(IrcCommandDispatcher):
             channel = msg.args[0]
         else:
             channel = None
-        preInFilter = str(msg).rstrip('\r\n')
-        log.debug('Incoming message (%s): %s', self.network, preInFilter)
+        debugging = log.isDebugging()
+        if debugging:
+            preInFilter = str(msg).rstrip('\r\n')
+            log.debug('Incoming message (%s): %s', self.network, preInFilter)
 
         # Yeah, so this is odd.  Some networks (oftc) seem to give us certain
         # messages with our nick instead of our prefix.  We'll fix that here.
@@ -831,9 +1155,10 @@ class Irc(IrcCommandDispatcher):
             except:
                 log.exception('Uncaught exception in inFilter:')
             world.debugFlush()
-        postInFilter = str(msg).rstrip('\r\n')
-        if postInFilter != preInFilter:
-            log.debug('Incoming message (post-inFilter): %s', postInFilter)
+        if debugging:
+            postInFilter = str(msg).rstrip('\r\n')
+            if postInFilter != preInFilter:
+                log.debug('Incoming message (post-inFilter): %s', postInFilter)
         for callback in self.callbacks:
             try:
                 if callback is not None:
@@ -50,13 +50,39 @@ import supybot.ircutils as ircutils
 class MalformedIrcMsg(ValueError):
     pass
 
+_tagUnescapes = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+def unescapeTagValue(value):
+    """Returns the IRCv3 message tag value with its escapes undone."""
+    if '\\' not in value:
+        return value
+    L = []
+    chars = iter(value)
+    for c in chars:
+        if c == '\\':
+            c = next(chars, '')
+            c = _tagUnescapes.get(c, c)
+        L.append(c)
+    return ''.join(L)
+
+def parseServerTags(s):
+    """Returns a dictionary of the IRCv3 message tags in s, the part of a
+    message between its leading '@' and the first space.  Tags without a
+    value map to None."""
+    tags = {}
+    for tag in s.split(';'):
+        if tag:
+            (key, _, value) = tag.partition('=')
+            tags[key] = unescapeTagValue(value) or None
+    return tags
+
 class IrcMsg(object):
     """Class to represent an IRC message.
 
     As usual, ignore attributes that begin with an underscore.  They simply
     don't exist.  Instances of this class are *not* to be modified, since they
     are hashable.  Public attributes of this class are .prefix, .command,
-    .args, .nick, .user, and .host.
+    .args, .nick, .user, .host, and .serverTags, the IRCv3 message tags the
+    server sent with the message.
 
     The constructor for this class is pretty intricate.  It's designed to take
     any of three major (sets of) arguments.
@@ -80,8 +106,8 @@ class IrcMsg(object):
     # It's too useful to be able to tag IrcMsg objects with extra, unforeseen
     # data.  Goodbye, __slots__.
     # On second thought, let's use methods for tagging.
-    __slots__ = ('args', 'command', 'host', 'nick', 'prefix', 'user',
-                 '_hash', '_str', '_repr', '_len', 'tags')
+    __slots__ = ('args', 'command', 'prefix', 'serverTags',
+                 '_split', '_hash', '_str', '_repr', '_len', 'tags')
     def __init__(self, s='', command='', args=(), prefix='', msg=None):
         assert not (msg and s), 'IrcMsg.__init__ cannot accept both s and msg'
         if not s and not command and not msg:
@@ -90,13 +116,18 @@ class IrcMsg(object):
         self._repr = None
         self._hash = None
         self._len = None
+        self._split = None
         self.tags = {}
+        self.serverTags = {}
         if s:
             originalString = s
             try:
                 if not s.endswith('\n'):
                     s += '\n'
                 self._str = s
+                if s[0] == '@':
+                    (tags, s) = s[1:].split(None, 1)
+                    self.serverTags = parseServerTags(tags)
                 if s[0] == ':':
                     self.prefix, s = s[1:].split(None, 1)
                 else:
@@ -125,16 +156,36 @@ class IrcMsg(object):
                 else:
                     self.args = msg.args
                 self.tags = msg.tags.copy()
+                self.serverTags = msg.serverTags.copy()
             else:
                 self.prefix = prefix
                 self.command = command
                 assert all(ircutils.isValidArgument, args)
                 self.args = args
         self.args = tuple(self.args)
-        if isUserHostmask(self.prefix):
-            (self.nick,self.user,self.host)=ircutils.splitHostmask(self.prefix)
+
+    def _splitPrefix(self):
+        # The prefix is only split when .nick, .user, or .host is first asked
+        # for; plenty of messages are never asked.  This is the same test as
+        # isUserHostmask, without the regexp.
+        prefix = self.prefix
+        i = prefix.find('!', 1)
+        j = prefix.rfind('@')
+        if i != -1 and i + 1 < j < len(prefix) - 1 and \
+           prefix.split() == [prefix]:
+            # Split where splitHostmask does: at the first '!' and the first
+            # '@' after it.
+            i = prefix.find('!')
+            j = prefix.find('@', i + 1)
+            self._split = (intern(prefix[:i]), intern(prefix[i+1:j]),
+                           intern(prefix[j+1:]))
         else:
-            (self.nick, self.user, self.host) = (self.prefix,)*3
+            self._split = (prefix,)*3
+        return self._split
+
+    nick = property(lambda self: (self._split or self._splitPrefix())[0])
+    user = property(lambda self: (self._split or self._splitPrefix())[1])
+    host = property(lambda self: (self._split or self._splitPrefix())[2])
 
     def __str__(self):
         if self._str is not None:
@@ -309,6 +309,15 @@ registry.exception = exception
 
 setLevel = _logger.setLevel
 
+def isDebugging():
+    """Returns whether debug messages are logged anywhere, so callers can
+    skip building them when they aren't."""
+    for logger in (_logger, logging.getLogger()):
+        for handler in logger.handlers:
+            if handler.level <= logging.DEBUG:
+                return True
+    return False
+
 atexit.register(logging.shutdown)
 
 # ircutils will work without this, but it's useful.
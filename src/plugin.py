@@ -36,6 +36,7 @@ import re
 
 import supybot.log as log
 import supybot.conf as conf
+import supybot.world as world
 import supybot.registry as registry
 import supybot.callbacks as callbacks
 
@@ -56,6 +57,7 @@ def loadPluginModule(name, ignoreDeprecation=False):
         except EnvironmentError: # OSError, IOError superclass.
             log.warning('Invalid plugin directory: %s; removing.', dir)
             conf.supybot.directories.plugins().remove(dir)
+            registry.changed()
     if name not in files:
         matched_names = filter(lambda x: re.search(r'(?i)^%s$' % (name,), x),
                                 files)
@@ -69,6 +71,7 @@ def loadPluginModule(name, ignoreDeprecation=False):
     except:
         sys.modules.pop(name, None)
         raise
+    world.pluginsLoaded += 1
     if 'deprecated' in module.__dict__ and module.deprecated:
         if ignoreDeprecation:
             log.warning('Deprecated plugin loaded: %s', name)
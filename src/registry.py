@@ -61,6 +61,15 @@ class NonExistentRegistryEntry(RegistryException):
 
 _cache = utils.InsensitivePreservingDict()
 _lastModified = 0
+# Bumped whenever a value is set or the shape of the tree changes, so those
+# caching what they've looked up in the registry know when to forget it, and
+# the registry's only written out again when something's changed.  Those
+# changing a list or set value in place should call changed() themselves.
+version = 0
+def changed():
+    global version
+    version += 1
+
 def open(filename, clear=False):
     """Initializes the module by loading the registry file into memory."""
     global _lastModified
@@ -94,11 +103,22 @@ def open(filename, clear=False):
             raise InvalidRegistryFile, 'Error unpacking line %r' % acc
         _cache[key] = value
     _lastModified = time.time()
+    changed()
     _fd.close()
 
-def close(registry, filename, private=True):
+# Maps the files the registry has been written to to the version it was at,
+# and to a digest of what was written.
+_versionsWritten = {}
+_digestsWritten = {}
+def snapshot(registry, filename, private=True):
+    """Returns what close would write to filename for registry, or None if
+    nothing has changed since the last snapshot of it was taken."""
+    if _versionsWritten.get(filename) == version and \
+       os.path.exists(filename):
+        return None
+    start = version
+    L = []
     first = True
-    fd = utils.file.AtomicFile(filename)
     for (name, value) in registry.getValues(getChildren=True):
         help = value.help()
         if help:
@@ -124,17 +144,50 @@ def close(registry, filename, private=True):
                         exception('Exception printing default value of %s:',
                                   value._name)
             lines.append('###\n')
-            fd.writelines(lines)
+            L.extend(lines)
         if hasattr(value, 'value'): # This lets us print help for non-values.
             try:
                 if private or not value._private:
                     s = value.serialize()
                 else:
                     s = 'CENSORED'
-                fd.write('%s: %s\n' % (name, s))
+                L.append('%s: %s\n' % (name, s))
             except Exception, e:
                 exception('Exception printing value:')
-    fd.close()
+    # Values read from a newly opened file are only set when they're asked
+    # for, as they just were.  If that (or anything else) changed the registry
+    # while we were at it, we'll just take another snapshot next time.
+    if version == start:
+        _versionsWritten[filename] = start
+    else:
+        _versionsWritten.pop(filename, None)
+    s = ''.join(L)
+    # Setting a value to what it already was still counts as a change, so
+    # we don't write what's already there.
+    digest = utils.crypt.md5(s).hexdigest()
+    if _digestsWritten.get(filename) == digest and os.path.exists(filename):
+        return None
+    _digestsWritten[filename] = digest
+    return s
+
+def unwritten(filename):
+    """Tells us that the last snapshot for filename never made it there, so
+    the next one shouldn't be skipped."""
+    _versionsWritten.pop(filename, None)
+    _digestsWritten.pop(filename, None)
+
+def close(registry, filename, private=True):
+    """Writes registry to filename, unless it hasn't changed since it was last
+    written there."""
+    s = snapshot(registry, filename, private=private)
+    if s is not None:
+        try:
+            fd = utils.file.AtomicFile(filename)
+            fd.write(s)
+            fd.close()
+        except:
+            unwritten(filename)
+            raise
 
 def isValidRegistryName(name):
     # Now we can have . and : in names.  I'm still gonna call shenanigans on
@@ -246,6 +299,7 @@ class Group(object):
         # For the longest time, we had an "Is this right?" comment here, but
         # from experience, we now know that it most definitely *is* right.
         if name not in self._children:
+            changed()
             self._children[name] = node
             self._added.append(name)
             names = split(self._name)
@@ -270,6 +324,7 @@ class Group(object):
                     self._added.remove(elt)
             if node._name in _cache:
                 del _cache[node._name]
+            changed()
             return node
         except KeyError:
             self.__nonExistentEntry(name)
@@ -337,6 +392,9 @@ class Value(Group):
         own setValue."""
         self._lastModified = time.time()
         self.value = v
+        if self._name != 'unset':
+            # Values not yet in the registry can't have been looked up.
+            changed()
         if self._supplyDefault:
             for (name, v) in self._children.items():
                 if v.__class__ is self.X:
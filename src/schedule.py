@@ -39,18 +39,6 @@ import supybot.log as log
 import supybot.world as world
 import supybot.drivers as drivers
 
-class mytuple(tuple):
-    def __cmp__(self, other):
-        return cmp(self[0], other[0])
-    def __le__(self, other):
-        return self[0] <= other[0]
-    def __lt__(self, other):
-        return self[0] < other[0]
-    def __gt__(self, other):
-        return self[0] > other[0]
-    def __ge__(self, other):
-        return self[0] >= other[0]
-
 class Schedule(drivers.IrcDriver):
     """An IrcDriver to handling scheduling of events.
 
@@ -60,11 +48,16 @@ class Schedule(drivers.IrcDriver):
         drivers.IrcDriver.__init__(self)
         self.schedule = []
         self.events = {}
+        self.entries = {}
+        self.removed = 0
         self.counter = 0
+        self.sequence = 0
 
     def reset(self):
         self.events.clear()
+        self.entries.clear()
         self.schedule[:] = []
+        self.removed = 0
         # We don't reset the counter here because if someone has held an id of
         # one of the nuked events, we don't want him removing new events with
         # his old id.
@@ -83,21 +76,47 @@ class Schedule(drivers.IrcDriver):
         assert name not in self.events, \
                'An event with the same name has already been scheduled.'
         self.events[name] = f
-        heapq.heappush(self.schedule, mytuple((t, name)))
+        # The sequence number keeps events scheduled for the same time in the
+        # order they were added, and keeps heapq from ever comparing names.
+        self.sequence += 1
+        entry = [t, self.sequence, name]
+        self.entries[name] = entry
+        heapq.heappush(self.schedule, entry)
         return name
 
     def removeEvent(self, name):
         """Removes the event with the given name from the schedule."""
         f = self.events.pop(name)
-        self.schedule = [(t, n) for (t, n) in self.schedule if n != name]
-        # We must heapify here because the heap property may not be preserved
-        # by the above list comprehension.  We could, conceivably, just mark
-        # the elements of the heap as removed and ignore them when we heappop,
-        # but that would only save a constant factor (we're already linear for
-        # the listcomp) so I'm not worried about it right now.
-        heapq.heapify(self.schedule)
+        # Rather than rebuilding the heap, we just mark the entry as removed
+        # and skip it when it reaches the top of the heap.  None can't be the
+        # name of an event, since addEvent would have given it a number.
+        entry = self.entries.pop(name)
+        entry[-1] = None
+        self.removed += 1
+        if self.removed > len(self.schedule) // 2:
+            self._compact()
         return f
 
+    def _compact(self):
+        self.schedule[:] = [entry for entry in self.schedule
+                            if entry[-1] is not None]
+        heapq.heapify(self.schedule)
+        self.removed = 0
+
+    def _pruneRemoved(self):
+        while self.schedule and self.schedule[0][-1] is None:
+            heapq.heappop(self.schedule)
+            self.removed -= 1
+
+    def nextDeadline(self):
+        """Returns the time at which the next event is scheduled to run, or
+        None if there are no events scheduled."""
+        self._pruneRemoved()
+        if self.schedule:
+            return self.schedule[0][0]
+        else:
+            return None
+
     def rescheduleEvent(self, name, t):
         f = self.removeEvent(name)
         self.addEvent(f, t, name=name)
@@ -123,9 +142,12 @@ class Schedule(drivers.IrcDriver):
                       'why do we continue to live?')
             time.sleep(1) # We're the only driver; let's pause to think.
         while self.schedule and self.schedule[0][0] < time.time():
-            (t, name) = heapq.heappop(self.schedule)
-            f = self.events[name]
-            del self.events[name]
+            (t, _, name) = heapq.heappop(self.schedule)
+            if name is None:
+                self.removed -= 1
+                continue
+            f = self.events.pop(name)
+            del self.entries[name]
             try:
                 f()
             except Exception, e:
@@ -141,6 +163,7 @@ removeEvent = schedule.removeEvent
 rescheduleEvent = schedule.rescheduleEvent
 addPeriodicEvent = schedule.addPeriodicEvent
 removePeriodicEvent = removeEvent
+nextDeadline = schedule.nextDeadline
 run = schedule.run
 
 
@@ -28,14 +28,22 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
 import re
+import copy
+import time
 import socket
 import urllib
+import cPickle
+import hashlib
 import urllib2
 import httplib
 import sgmllib
 import urlparse
+import threading
+import email.utils
 import htmlentitydefs
+import cStringIO as StringIO
 
 sockerrors = (socket.error,)
 try:
@@ -96,25 +104,487 @@ defaultHeaders = {
 # application-specific function.  Feel free to use a callable here.
 proxy = None
 
+class ConnectionPool(object):
+    """Keeps idle HTTP connections around so later requests to the same host
+    can reuse them rather than setting up a new TCP (and TLS) connection."""
+    maxIdle = 4 # Idle connections kept per host.
+    idleTimeout = 60 # Seconds an idle connection is kept.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.created = 0
+        self.reused = 0
+
+    def get(self, key):
+        """Returns an idle connection for key, or None if there isn't one."""
+        now = time.time()
+        self.lock.acquire()
+        try:
+            conns = self.idle.get(key, [])
+            while conns:
+                (conn, when) = conns.pop()
+                if now - when < self.idleTimeout:
+                    self.reused += 1
+                    return conn
+                conn.close()
+            return None
+        finally:
+            self.lock.release()
+
+    def put(self, key, conn):
+        self.lock.acquire()
+        try:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.maxIdle:
+                conns.append((conn, time.time()))
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            for conns in self.idle.itervalues():
+                for (conn, _) in conns:
+                    conn.close()
+            self.idle.clear()
+        finally:
+            self.lock.release()
+
+pool = ConnectionPool()
+
+class _PooledResponse(object):
+    """What our handlers' responses read from.  Once the body has been read
+    to the end, the connection goes back to the pool (and the body to the
+    cache, if it's wanted there); a response closed before that takes its
+    connection with it."""
+    def __init__(self, key, conn, response, store=None, limit=0):
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.store = store
+        self.limit = limit
+        self.body = []
+        self.size = 0
+        self.done = False
+
+    def fileno(self):
+        return self.response.fileno()
+
+    def recv(self, n):
+        data = self.response.read(n)
+        if self.store is not None:
+            self.size += len(data)
+            if self.size > self.limit:
+                self.store = None
+            else:
+                self.body.append(data)
+        if not data or self.response.isclosed():
+            self._finish()
+        return data
+
+    def _finish(self):
+        if self.done:
+            return
+        self.done = True
+        if self.store is not None:
+            self.store(''.join(self.body))
+            self.store = None
+        self.body = None
+        if self.response.will_close or self.conn.sock is None:
+            self.conn.close()
+        else:
+            self.response.close()
+            pool.put(self.key, self.conn)
+
+    def close(self):
+        if self.done:
+            return
+        if self.response.isclosed() or self.response.length == 0:
+            self._finish()
+        else:
+            self.done = True
+            self.response.close()
+            self.conn.close()
+
+class _PooledHandlerMixin:
+    def _request(self, conn, req, headers):
+        conn.request(req.get_method(), req.get_selector(), req.data, headers)
+        return conn.getresponse(buffering=True)
+
+    def _pooledOpen(self, connectionClass, req, **kwargs):
+        if getattr(req, '_tunnel_host', None):
+            return self.do_open(connectionClass, req, **kwargs)
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        key = (connectionClass.__name__, host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update([(k, v) for (k, v) in req.headers.iteritems()
+                        if k not in headers])
+        headers['Connection'] = 'keep-alive'
+        headers = dict([(k.title(), v) for (k, v) in headers.iteritems()])
+        r = None
+        conn = pool.get(key)
+        if conn is not None:
+            timeout = req.timeout
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                r = self._request(conn, req, headers)
+            except (httplib.HTTPException, socket.error), e:
+                # The server has most likely closed the connection while it
+                # was idle.  Only requests that are safe to repeat get a
+                # fresh connection.
+                conn.close()
+                if req.get_method() not in ('GET', 'HEAD'):
+                    raise urllib2.URLError(e)
+        if r is None:
+            conn = connectionClass(host, timeout=req.timeout, **kwargs)
+            pool.created += 1
+            try:
+                r = self._request(conn, req, headers)
+            except socket.error, e:
+                conn.close()
+                raise urllib2.URLError(e)
+        (store, limit) = (None, 0)
+        cache = getattr(req, 'cache', None)
+        if cache is not None and r.status == 200 and \
+           cache.storable(req, r.msg):
+            store = lambda body: cache.store(req, r.msg, body)
+            limit = cache.entryLimit()
+        fp = socket._fileobject(_PooledResponse(key, conn, r, store, limit),
+                                close=True)
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+class HTTPHandler(_PooledHandlerMixin, urllib2.HTTPHandler):
+    """An HTTPHandler whose connections are kept alive in the pool."""
+    def http_open(self, req):
+        return self._pooledOpen(httplib.HTTPConnection, req)
+
+handlers = [HTTPHandler]
+
+if hasattr(httplib, 'HTTPSConnection'):
+    class HTTPSHandler(_PooledHandlerMixin, urllib2.HTTPSHandler):
+        """An HTTPSHandler whose connections are kept alive in the pool."""
+        def https_open(self, req):
+            kwargs = {}
+            if getattr(self, '_context', None) is not None:
+                kwargs['context'] = self._context
+            return self._pooledOpen(httplib.HTTPSConnection, req, **kwargs)
+
+    handlers.append(HTTPSHandler)
+
+def _parseCacheControl(value):
+    d = {}
+    for directive in value.split(','):
+        (name, _, arg) = directive.strip().partition('=')
+        if name:
+            d[name.lower()] = arg.strip('"')
+    return d
+
+def _parseDate(value):
+    if value:
+        t = email.utils.parsedate_tz(value)
+        if t is not None:
+            try:
+                return email.utils.mktime_tz(t)
+            except (ValueError, OverflowError):
+                pass
+    return None
+
+class ResponseCache(object):
+    """A cache of HTTP responses, kept in memory up to memorySize bytes and
+    on disk (in directory) up to diskSize bytes, least recently used first
+    out.  It's only used for plain GETs, honors Cache-Control, Expires and
+    Vary, and revalidates stale responses that have an ETag or Last-Modified
+    rather than fetching them again.  Any of its sizes or its directory may
+    be callables."""
+    maximumEntry = 1048576 # Responses bigger than this aren't cached.
+    # Responses without an explicit lifetime are considered fresh for this
+    # fraction of the time since they were last modified, up to maximumAge.
+    heuristicFraction = 0.1
+    maximumAge = 86400
+    def __init__(self, memorySize=0, diskSize=0, directory=None):
+        self.memorySize = memorySize
+        self.diskSize = diskSize
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.memory = {}
+        self.recent = [] # Keys in memory, least recently used first.
+        self.memoryUsed = 0
+        self.disk = None # Filename -> (size, mtime), loaded lazily.
+        self.diskUsed = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def enabled(self):
+        return bool(force(self.memorySize) or force(self.diskSize))
+
+    def entryLimit(self):
+        return min(self.maximumEntry,
+                   max(force(self.memorySize), force(self.diskSize)))
+
+    def cacheable(self, req):
+        """Returns whether req is a request we can answer from the cache."""
+        if req.get_method() != 'GET' or req.get_type() not in ('http','https'):
+            return False
+        for header in ('Authorization', 'Range', 'If-none-match',
+                       'If-modified-since'):
+            if req.has_header(header):
+                return False
+        cc = _parseCacheControl(req.get_header('Cache-control', ''))
+        return 'no-store' not in cc
+
+    def freshFor(self, msg, now=None):
+        """Returns how many more seconds a response with the headers msg is
+        fresh for."""
+        if now is None:
+            now = time.time()
+        cc = _parseCacheControl(msg.getheader('cache-control', ''))
+        if 'no-cache' in cc:
+            return 0
+        date = _parseDate(msg.getheader('date')) or now
+        lastModified = _parseDate(msg.getheader('last-modified'))
+        if 'max-age' in cc:
+            try:
+                lifetime = int(cc['max-age'])
+            except ValueError:
+                lifetime = 0
+        elif msg.getheader('expires'):
+            lifetime = (_parseDate(msg.getheader('expires')) or date) - date
+        elif lastModified is not None:
+            lifetime = min(self.maximumAge,
+                           (date - lastModified) * self.heuristicFraction)
+        else:
+            lifetime = 0
+        try:
+            age = int(msg.getheader('age', 0))
+        except ValueError:
+            age = 0
+        return max(0, lifetime - max(0, age, now - date))
+
+    def storable(self, req, msg):
+        cc = _parseCacheControl(msg.getheader('cache-control', ''))
+        if 'no-store' in cc or msg.getheader('vary', '').strip() == '*':
+            return False
+        return bool(self.freshFor(msg) or msg.getheader('etag') or
+                    msg.getheader('last-modified'))
+
+    def _key(self, req):
+        return req.get_full_url()
+
+    def _filename(self, key):
+        return os.path.join(force(self.directory), hashlib.sha1(key).hexdigest())
+
+    def _loadDisk(self):
+        if self.disk is None:
+            self.disk = {}
+            if force(self.directory) and force(self.diskSize):
+                directory = force(self.directory)
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                for name in os.listdir(directory):
+                    stat = os.stat(os.path.join(directory, name))
+                    self.disk[name] = (stat.st_size, stat.st_mtime)
+                    self.diskUsed += stat.st_size
+
+    def _remember(self, key, entry):
+        size = len(entry['body']) + len(entry['headers'])
+        if key in self.memory:
+            self._forget(key)
+        if size > force(self.memorySize):
+            return
+        self.memory[key] = (entry, size)
+        self.recent.append(key)
+        self.memoryUsed += size
+        while self.memoryUsed > force(self.memorySize):
+            self._forget(self.recent[0])
+
+    def _forget(self, key):
+        (_, size) = self.memory.pop(key)
+        self.recent.remove(key)
+        self.memoryUsed -= size
+
+    def _write(self, key, entry):
+        if not (force(self.directory) and force(self.diskSize)):
+            return
+        self._loadDisk()
+        filename = self._filename(key)
+        name = os.path.basename(filename)
+        tmp = filename + '.tmp'
+        fd = open(tmp, 'wb')
+        try:
+            cPickle.dump(entry, fd, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fd.close()
+        os.rename(tmp, filename)
+        if name in self.disk:
+            self.diskUsed -= self.disk[name][0]
+        size = os.path.getsize(filename)
+        self.disk[name] = (size, time.time())
+        self.diskUsed += size
+        if self.diskUsed > force(self.diskSize):
+            oldest = sorted(self.disk.items(), key=lambda t: t[1][1])
+            for (name, (size, _)) in oldest:
+                if self.diskUsed <= force(self.diskSize):
+                    break
+                try:
+                    os.remove(os.path.join(force(self.directory), name))
+                except EnvironmentError:
+                    pass
+                del self.disk[name]
+                self.diskUsed -= size
+
+    def _read(self, key):
+        if not (force(self.directory) and force(self.diskSize)):
+            return None
+        self._loadDisk()
+        filename = self._filename(key)
+        name = os.path.basename(filename)
+        if name not in self.disk:
+            return None
+        try:
+            fd = open(filename, 'rb')
+            try:
+                entry = cPickle.load(fd)
+            finally:
+                fd.close()
+            os.utime(filename, None)
+        except Exception:
+            self.diskUsed -= self.disk.pop(name)[0]
+            return None
+        if entry['key'] != key:
+            return None
+        self.disk[name] = (self.disk[name][0], time.time())
+        return entry
+
+    def lookup(self, req):
+        """Returns the cached entry for req, fresh or not, or None."""
+        key = self._key(req)
+        self.lock.acquire()
+        try:
+            if key in self.memory:
+                entry = self.memory[key][0]
+                self.recent.remove(key)
+                self.recent.append(key)
+            else:
+                entry = self._read(key)
+                if entry is not None:
+                    self._remember(key, entry)
+        finally:
+            self.lock.release()
+        if entry is not None:
+            for (header, value) in entry['vary'].iteritems():
+                if req.get_header(header.capitalize()) != value:
+                    entry = None
+                    break
+        if entry is None:
+            self.misses += 1
+        return entry
+
+    def isFresh(self, entry):
+        return time.time() < entry['expires']
+
+    def store(self, req, msg, body):
+        key = self._key(req)
+        vary = {}
+        for header in msg.getheader('vary', '').split(','):
+            header = header.strip()
+            if header:
+                vary[header] = req.get_header(header.capitalize())
+        entry = {'key': key, 'headers': ''.join(msg.headers), 'body': body,
+                 'expires': time.time() + self.freshFor(msg), 'vary': vary}
+        self.lock.acquire()
+        try:
+            self._remember(key, entry)
+            self._write(key, entry)
+        finally:
+            self.lock.release()
+
+    def response(self, entry):
+        """Returns a file object for the cached entry."""
+        self.hits += 1
+        return self._response(entry)
+
+    def _response(self, entry):
+        msg = httplib.HTTPMessage(StringIO.StringIO(entry['headers']))
+        fd = urllib2.addinfourl(StringIO.StringIO(entry['body']), msg,
+                                entry['key'])
+        fd.code = 200
+        fd.msg = 'OK'
+        return fd
+
+    def revalidate(self, req, entry, msg):
+        """Updates entry with the headers of the 304 response to req whose
+        headers are msg, and returns a file object for it."""
+        self.revalidated += 1
+        headers = httplib.HTTPMessage(StringIO.StringIO(entry['headers']))
+        for header in msg.keys():
+            if header not in ('content-length', 'transfer-encoding'):
+                headers[header] = msg[header]
+        entry = entry.copy()
+        entry['headers'] = ''.join(headers.headers)
+        entry['expires'] = time.time() + self.freshFor(headers)
+        self.lock.acquire()
+        try:
+            self._remember(entry['key'], entry)
+            self._write(entry['key'], entry)
+        finally:
+            self.lock.release()
+        return self._response(entry)
+
+# Other modules should set the sizes and directory of this as appropriate;
+# until they do, nothing is cached.
+cache = ResponseCache()
+
+opener = urllib2.build_opener(*handlers)
+
 def getUrlFd(url, headers=None, data=None, timeout=None):
     """getUrlFd(url, headers=None, data=None)
 
     Opens the given url and returns a file object.  Headers and data are
-    a dict and string, respectively, as per urllib2.Request's arguments."""
+    a dict and string, respectively, as per urllib2.Request's arguments.
+    HTTP connections are kept alive and reused, and responses to GETs are
+    answered from the cache when they're still fresh."""
     if headers is None:
         headers = defaultHeaders
+    entry = None
     try:
         if not isinstance(url, urllib2.Request):
             if '#' in url:
                 url = url[:url.index('#')]
             request = urllib2.Request(url, headers=headers, data=data)
         else:
-            request = url
+            # The conditional headers we might add below are only for this
+            # request, so we don't leave them on the caller's.
+            request = copy.copy(url)
+            request.headers = url.headers.copy()
+            request.unredirected_hdrs = url.unredirected_hdrs.copy()
             request.add_data(data)
+        if cache.enabled() and cache.cacheable(request):
+            entry = cache.lookup(request)
+            if entry is not None:
+                if cache.isFresh(entry):
+                    return cache.response(entry)
+                msg = httplib.HTTPMessage(StringIO.StringIO(entry['headers']))
+                if msg.getheader('etag'):
+                    request.add_header('If-none-match', msg['etag'])
+                if msg.getheader('last-modified'):
+                    request.add_header('If-modified-since',
+                                       msg['last-modified'])
+            request.cache = cache
         httpProxy = force(proxy)
         if httpProxy:
             request.set_proxy(httpProxy, 'http')
-        fd = urllib2.urlopen(request, timeout=timeout)
+        fd = opener.open(request, timeout=timeout)
         return fd
     except socket.timeout, e:
         raise Error, TIMED_OUT
@@ -123,6 +593,9 @@ def getUrlFd(url, headers=None, data=None, timeout=None):
     except httplib.InvalidURL, e:
         raise Error, 'Invalid URL: %s' % e
     except urllib2.HTTPError, e:
+        if e.code == 304 and entry is not None:
+            e.close()
+            return cache.revalidate(request, entry, e.info())
         raise Error, strError(e)
     except urllib2.URLError, e:
         raise Error, strError(e.reason)
@@ -147,6 +620,41 @@ def getUrl(url, size=None, headers=None, data=None):
     fd.close()
     return text
 
+def iterUrl(url, size=None, headers=None, data=None, timeout=None,
+            chunkSize=1024):
+    """iterUrl(url, size=None, headers=None, data=None, timeout=None,
+            chunkSize=1024)
+
+    Iterates over the page at url in chunks of at most chunkSize bytes, for
+    callers that can stop as soon as they've found what they're looking for.
+    At most size bytes are read.  The connection is closed when iteration
+    stops, early or not."""
+    fd = getUrlFd(url, headers=headers, data=data, timeout=timeout)
+    return iterFd(fd, size=size, chunkSize=chunkSize)
+
+def iterFd(fd, size=None, chunkSize=1024):
+    """iterFd(fd, size=None, chunkSize=1024)
+
+    Like iterUrl, but for a file object already returned by getUrlFd, so its
+    headers can be looked at first."""
+    try:
+        left = size
+        while left is None or left > 0:
+            n = chunkSize
+            if left is not None:
+                n = min(n, left)
+            try:
+                chunk = fd.read(n)
+            except socket.timeout, e:
+                raise Error, TIMED_OUT
+            if not chunk:
+                break
+            if left is not None:
+                left -= len(chunk)
+            yield chunk
+    finally:
+        fd.close()
+
 def getDomain(url):
     return urlparse.urlparse(url)[1]
 
@@ -35,6 +35,7 @@ import gc
 import os
 import sys
 import time
+import Queue
 import atexit
 import threading
 import multiprocessing # python 2.6 and later!
@@ -46,6 +47,7 @@ else:
 
 import supybot.log as log
 import supybot.conf as conf
+import supybot.utils as utils
 import supybot.drivers as drivers
 import supybot.ircutils as ircutils
 import supybot.registry as registry
@@ -68,7 +70,60 @@ class SupyThread(threading.Thread):
         super(SupyThread, self).__init__(*args, **kwargs)
         log.debug('Spawning thread %q.', self.getName())
 
+class ThreadPool(object):
+    """A fixed number of daemon threads running the functions given to
+    submit, in order.  If maxQueued is given, submit refuses (returning
+    False) to queue more than that many functions at once."""
+    def __init__(self, size, name='Pool', maxQueued=0):
+        self.name = name
+        self.queue = Queue.Queue(maxQueued)
+        self.threads = []
+        for i in range(size):
+            t = SupyThread(target=self._run,
+                           name='%s thread #%s' % (name, i+1))
+            t.setDaemon(True)
+            t.start()
+            self.threads.append(t)
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                (f, args, kwargs) = task
+                try:
+                    f(*args, **kwargs)
+                except Exception:
+                    log.exception('Uncaught exception in %s:', self.name)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, f, *args, **kwargs):
+        try:
+            self.queue.put((f, args, kwargs), block=False)
+            return True
+        except Queue.Full:
+            return False
+
+    def __len__(self):
+        """Returns the number of functions waiting for a thread."""
+        return self.queue.qsize()
+
+    def join(self):
+        """Waits until everything already submitted has been run."""
+        self.queue.join()
+
+    def stop(self):
+        """Makes the threads exit once they've run everything already
+        submitted."""
+        for t in self.threads:
+            self.queue.put(None)
+        self.threads = []
+
+
 processesSpawned = 1 # Starts at one for the initial process.
+pluginsLoaded = 0 # How many times a plugin module has been (re)loaded.
 class SupyProcess(multiprocessing.Process):
     def __init__(self, *args, **kwargs):
         global processesSpawned
@@ -88,22 +143,121 @@ def getIrc(network):
             return irc
     return None
 
+_writer = None
+_writerLock = threading.Lock()
+def _guardedWrite(f, filename, args, onError):
+    # No one is waiting on the writer to hear that a write failed, so we log
+    # it and let whoever asked for the write know it has to be done again.
+    try:
+        f(filename, *args)
+    except Exception, e:
+        log.exception('Couldn\'t write %s:', filename)
+        if onError is not None:
+            try:
+                onError()
+            except Exception, e:
+                log.exception('Uncaught exception in %s:', onError)
+
+def _write(f, filename, args, onError=None):
+    global _writer
+    _writerLock.acquire()
+    try:
+        if testing or dying:
+            if _writer is not None:
+                _writer.join()
+            _guardedWrite(f, filename, args, onError)
+        else:
+            if _writer is None:
+                _writer = ThreadPool(1, 'Writer')
+            _writer.submit(_guardedWrite, f, filename, args, onError)
+    finally:
+        _writerLock.release()
+
+def finishWriting():
+    """Waits for the background thread to finish the writes it's been given.
+    Its thread is a daemon, so anything still queued when the interpreter
+    exits would otherwise never be written."""
+    _writerLock.acquire()
+    try:
+        if _writer is not None:
+            _writer.join()
+    finally:
+        _writerLock.release()
+
+def _writeFile(filename, data, kwargs):
+    fd = utils.file.AtomicFile(filename, **kwargs)
+    fd.write(data)
+    fd.close()
+
+def writeFile(filename, data, onError=None, **kwargs):
+    """Writes data to filename through a utils.file.AtomicFile, which is
+    given kwargs.  Flushers use this so that only taking a snapshot of what
+    they write happens in their thread; the writing itself is done by a
+    background thread, in the order the writes were asked for.  While testing
+    or dying, the write is done right away, once the background thread has
+    finished the writes it was already given.  If the write fails, it's
+    logged and onError, if given, is called (from the writing thread)."""
+    _write(_writeFile, filename, (data, kwargs), onError)
+
+def _writeFiles(filenames, files, kwargs):
+    for (filename, data) in files:
+        _writeFile(filename, data, kwargs)
+
+def writeFiles(files, onError=None, **kwargs):
+    """Writes each (filename, data) pair in files as writeFile does, in order
+    and as a single write, so no file is written unless all those before it
+    were.  If one can't be written, onError is called and the rest aren't
+    written at all."""
+    filenames = ', '.join([filename for (filename, _) in files])
+    _write(_writeFiles, filenames, (files, kwargs), onError)
+
+def _appendFile(filename, data):
+    fd = file(filename, 'a')
+    fd.write(data)
+    fd.close()
+
+def appendFile(filename, data, onError=None):
+    """Appends data to filename, in the same way writeFile writes it."""
+    _write(_appendFile, filename, (data,), onError)
+
 def _flushUserData():
     userdataFilename = os.path.join(conf.supybot.directories.conf(),
                                     'userdata.conf')
-    registry.close(conf.users, userdataFilename)
+    s = registry.snapshot(conf.users, userdataFilename)
+    if s is not None:
+        writeFile(userdataFilename, s,
+                  onError=lambda: registry.unwritten(userdataFilename))
 
 flushers = [_flushUserData] # A periodic function will flush all these.
 
 registryFilename = None
 
+def flusherName(f):
+    if hasattr(f, 'im_self'):
+        return '%s.%s' % (f.im_self.__class__.__name__, f.__name__)
+    return f.__name__
+
+# The (name, seconds) each flusher took, the last time flush was called.
+flusherTimes = []
+
 def flush():
     """Flushes all the registered flushers."""
+    if dying:
+        # Flushers don't write what they've already given the writing thread,
+        # so that has to be finished first; and if any of it fails, they'll
+        # know to write it again now.
+        finishWriting()
+    times = []
     for (i, f) in enumerate(flushers):
+        start = time.time()
         try:
             f()
         except Exception, e:
             log.exception('Uncaught exception in flusher #%s (%s):', i, f)
+        elapsed = time.time() - start
+        log.debug('Flusher #%s (%s) took %.3f seconds.', i, f, elapsed)
+        times.append((flusherName(f), elapsed))
+    flusherTimes[:] = times
 
 def debugFlush(s=''):
     if conf.supybot.debug.flushVeryOften():
@@ -195,6 +349,7 @@ def finished():
 # These are in order; don't reorder them for cosmetic purposes.  The order
 # in which they're registered is the reverse order in which they will run.
 atexit.register(finished)
+atexit.register(finishWriting)
 atexit.register(upkeep)
 atexit.register(makeIrcsDie)
 atexit.register(makeDriversDie)
@@ -32,6 +32,8 @@ from supybot.test import *
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.ircmsgs as ircmsgs
+import supybot.irclib as irclib
+import supybot.registry as registry
 import supybot.callbacks as callbacks
 
 tokenize = callbacks.tokenize
@@ -92,6 +94,19 @@ class TokenizerTestCase(SupyTestCase):
     def testError(self):
         self.assertRaises(SyntaxError, tokenize, '[foo') #]
         self.assertRaises(SyntaxError, tokenize, '"foo') #"
+        self.assertRaises(SyntaxError, tokenize, '"foo\\"') #"
+        self.assertRaises(SyntaxError, tokenize, 'foo"bar "baz')
+
+    def testQuotesInWords(self):
+        self.assertEqual(tokenize('foo"bar baz"'), ['foo"bar', 'baz"'])
+        self.assertEqual(tokenize('"foo"bar'), ['foo', 'bar'])
+        self.assertEqual(tokenize('"foo [bar]"[baz]'), ['foo [bar]', ['baz']])
+
+    def testTokenizersAreCached(self):
+        tokenize('foo')
+        n = len(callbacks._tokenizers)
+        tokenize('bar')
+        self.assertEqual(len(callbacks._tokenizers), n)
 
     def testPipe(self):
         try:
@@ -276,6 +291,17 @@ class AmbiguityTestCase(PluginTestCase):
         self.irc.addCallback(self.Bar(self.irc))
         self.assertResponse('bar', 'bar.bar')
 
+    def testDisabledCommandIsReindexed(self):
+        self.irc.addCallback(self.Foo(self.irc))
+        self.irc.addCallback(self.Bar(self.irc))
+        self.assertResponse('foo bar', 'foo.bar')
+        callbacks.Plugin._disabled.add('bar', 'Bar')
+        try:
+            self.assertResponse('bar', 'foo.bar')
+        finally:
+            callbacks.Plugin._disabled.remove('bar', 'Bar')
+        self.assertResponse('bar', 'bar.bar')
+
 class ProperStringificationOfReplyArgs(PluginTestCase):
     plugins = ('Misc',) # Same as above.
     class NonString(callbacks.Plugin):
@@ -600,6 +626,20 @@ class SourceNestedPluginTestCase(PluginTestCase):
         self.assertEqual(cb.getCommand(['e', 'same']), ['e', 'same'])
         self.assertResponse('e same', 'same')
 
+    def testCommandIndex(self):
+        cb = self.E(self.irc)
+        index = callbacks.CommandIndex([cb])
+        for args in (['f'], ['f', 'x'], ['e', 'f'], ['g', 'i', 'j', 'x'],
+                     ['e', 'g', 'i', 'j'], ['e', 'g', 'x'], ['x']):
+            L = cb.getCommand(args)
+            if L:
+                self.assertEqual(index.find(args), (L, [cb]))
+            else:
+                self.assertEqual(index.find(args), ([], []))
+        self.failUnless(index.valid([cb]))
+        callbacks.invalidateCommandIndex()
+        self.failIf(index.valid([cb]))
+
 
 class WithPrivateNoticeTestCase(ChannelPluginTestCase):
     plugins = ('Utilities',)
@@ -689,6 +729,44 @@ class ProxyTestCase(SupyTestCase):
         self.failUnless(d[irc] == 'foo')
         self.failUnless(d[proxy] == 'foo')
 
+class RegistryValueTestCase(SupyTestCase):
+    class RegistryValueTest(callbacks.Plugin):
+        pass
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.group = conf.registerPlugin('RegistryValueTest')
+        conf.registerChannelValue(self.group, 'number',
+            registry.Integer(1, 'Some number.'))
+        self.cb = self.RegistryValueTest(irclib.Irc('test'))
+
+    def tearDown(self):
+        conf.supybot.plugins.unregister('RegistryValueTest')
+        SupyTestCase.tearDown(self)
+
+    def testChangesAreSeen(self):
+        cb = self.cb
+        self.assertEqual(cb.registryValue('number'), 1)
+        self.assertEqual(cb.registryValue('number', '#foo'), 1)
+        self.group.number.setValue(2)
+        self.assertEqual(cb.registryValue('number'), 2)
+        self.assertEqual(cb.registryValue('number', '#foo'), 2)
+        self.group.number.get('#foo').setValue(3)
+        self.assertEqual(cb.registryValue('number'), 2)
+        self.assertEqual(cb.registryValue('number', '#foo'), 3)
+        self.assertEqual(cb.registryValue('number', '#bar'), 2)
+        cb.setRegistryValue('number', 4, '#bar')
+        self.assertEqual(cb.registryValue('number', '#bar'), 4)
+        self.failUnless(cb.registryValue('number', '#foo', value=False) is
+                        self.group.number.get('#foo'))
+
+    def testRepeatedLookupsAreCached(self):
+        self.cb.registryValue('number', '#foo')
+        self.cb.registryValue('number', '#foo')
+        key = ('RegistryValueTest', 'number', '#foo', True)
+        self.assertEqual(callbacks._registryValues[key],
+                         (registry.version, 1))
+
 
 
 
@@ -29,7 +29,16 @@
 
 from supybot.test import *
 
+import re
+import sys
+import time
+import types
+import socket
+import operator
+import threading
+
 from supybot.commands import *
+import supybot.commands as commands
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.callbacks as callbacks
@@ -169,5 +178,148 @@ class FirstTestCase(CommandsTestCase):
         self.assertStateErrored([first('int', 'something')], ['words'],
                                 errored=False)
 
+class ProcessPoolTestCase(SupyTestCase):
+    def testProcess(self):
+        self.assertEqual(commands.process(operator.add, 1, 2), 3)
+        self.assertEqual(commands.process(operator.div, 1, 0)[:6], 'Error:')
+        # Lambdas can't be pickled, so they get a process of their own.
+        self.assertEqual(commands.process(lambda: 'foo'), 'foo')
+
+    def testRegexpBatch(self):
+        hang = re.compile('(a+)+$')
+        regexps = [re.compile('foo'), hang, re.compile('a{5}'),
+                   re.compile('bar')]
+        s = 'foo ' + 'a'*40 + 'b'
+        start = time.time()
+        self.assertEqual(commands.regexp_batch_wrapper(s, regexps, 0.5,
+                                                       'Test', 'test'),
+                         [True, False, True, False])
+        self.failUnless(time.time() - start < 5)
+        self.failIf(commands.regexp_wrapper(s, hang, 0.5, 'Test', 'test'))
+        self.failUnless(commands.regexp_wrapper(s, regexps[0], 0.5,
+                                                'Test', 'test'))
+        self.failUnless(len(commands.pool.workers) <=
+                        conf.supybot.commands.processes())
+
+    def testStaleWorkersReplaced(self):
+        commands.process(operator.add, 1, 2)
+        pids = [worker.process.pid for worker in commands.pool.workers]
+        world.pluginsLoaded += 1
+        self.assertEqual(commands.process(operator.add, 1, 2), 3)
+        for worker in commands.pool.workers:
+            self.failIf(worker.process.pid in pids)
+
+    def testTaskLoadError(self):
+        commands.process(operator.add, 1, 2)
+        # This module doesn't exist in the workers already forked.
+        module = types.ModuleType('processPoolTestModule')
+        exec 'def f(x):\n    return x * 2\n' in module.__dict__
+        module.f.__module__ = module.__name__
+        sys.modules[module.__name__] = module
+        try:
+            self.assertEqual(commands.process(module.f, 21), 42)
+        finally:
+            del sys.modules[module.__name__]
+
+    def testDeadWorkersReplaced(self):
+        commands.process(operator.add, 1, 2)
+        for worker in commands.pool.workers:
+            worker.process.terminate()
+            worker.process.join()
+        self.assertEqual(commands.process(operator.add, 1, 2), 3)
+
+    def testWorkersCloseInheritedFds(self):
+        (a, b) = socket.socketpair()
+        try:
+            world.pluginsLoaded += 1 # So we get workers forked after this.
+            self.assertEqual(commands.process(operator.add, 1, 2), 3)
+            b.close()
+            a.settimeout(5)
+            self.assertEqual(a.recv(1), '')
+        finally:
+            a.close()
+
+    def testRegexpFilter(self):
+        strings = ['foo', 'bar', 'foobar', 'baz', 'barfoo']
+        regexps = [re.compile('foo'), re.compile('bar')]
+        self.assertEqual(commands.regexp_filter_wrapper(strings, regexps, 0.5,
+                                                        'Test', 'test'),
+                         [2, 4])
+        self.assertEqual(commands.regexp_filter_wrapper(strings, regexps[:1],
+                                                        0.5, 'Test', 'test',
+                                                        limit=2),
+                         [0, 2])
+        strings.append('a'*40 + 'b')
+        start = time.time()
+        self.assertRaises(commands.ProcessTimeoutError,
+                          commands.regexp_filter_wrapper, strings,
+                          [re.compile('(a+)+$')], 0.5, 'Test', 'test')
+        self.failUnless(time.time() - start < 5)
+        # The worker that hung has been replaced.
+        self.assertEqual(commands.regexp_filter_wrapper(strings, regexps, 0.5,
+                                                        'Test', 'test'),
+                         [2, 4])
+
+class SnarfExecutorTestCase(SupyTestCase):
+    def _wait(self, executor):
+        start = time.time()
+        while executor.depths() and time.time() - start < 5:
+            time.sleep(0.01)
+        self.failIf(executor.depths())
+
+    def testOrderedPerChannel(self):
+        executor = commands.SnarfExecutor()
+        L = []
+        lock = threading.Semaphore(0)
+        executor.submit(('net', '#a'), 'http://a.com/', lock.acquire)
+        for i in range(5):
+            executor.submit(('net', '#a'), 'http://b.com/%s' % i,
+                            lambda i=i: L.append(i))
+        executor.submit(('net', '#b'), 'http://b.com/', lambda: L.append('b'))
+        start = time.time()
+        while 'b' not in L and time.time() - start < 5:
+            time.sleep(0.01)
+        # #b isn't held up by the blocked snarf in #a.
+        self.assertEqual(L, ['b'])
+        self.assertEqual(executor.depths(), {('net', '#a'): 6})
+        lock.release()
+        self._wait(executor)
+        self.assertEqual(L, ['b', 0, 1, 2, 3, 4])
+
+    def testPerHost(self):
+        executor = commands.SnarfExecutor()
+        lock = threading.Semaphore(0)
+        L = []
+        perHost = conf.supybot.snarfers.perHost()
+        for i in range(perHost):
+            executor.submit(('net', '#%s' % i), 'http://slow.com/',
+                            lock.acquire)
+        executor.submit(('net', '#x'), 'http://SLOW.com/', lambda: L.append(1))
+        executor.submit(('net', '#y'), 'http://fast.com/', lambda: L.append(2))
+        start = time.time()
+        while not L and time.time() - start < 5:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(L, [2])
+        for i in range(perHost):
+            lock.release()
+        self._wait(executor)
+        self.assertEqual(L, [2, 1])
+
+    def testMaximumQueued(self):
+        executor = commands.SnarfExecutor()
+        lock = threading.Semaphore(0)
+        key = ('net', '#a')
+        maximum = conf.supybot.snarfers.maximumQueued()
+        for i in range(maximum):
+            self.failUnless(executor.submit(key, 'http://a.com/',
+                                            lock.acquire))
+        self.failIf(executor.submit(key, 'http://a.com/', lock.acquire))
+        self.assertEqual(executor.dropped, 1)
+        self.assertEqual(executor.maxDepth, maximum)
+        for i in range(maximum):
+            lock.release()
+        self._wait(executor)
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -0,0 +1,190 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import os
+import re
+
+import supybot.dbi as dbi
+
+class IndexedMappingTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = conf.supybot.directories.data.dirize('Test.indexed.db')
+        self.flatFilename = conf.supybot.directories.data.dirize('Test.flat.db')
+        for filename in (self.filename, self.filename + '.index',
+                         self.flatFilename):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def testGetSetRemove(self):
+        mapping = dbi.IndexedMapping(self.filename)
+        self.assertEqual(mapping.add('foo'), 1)
+        self.assertEqual(mapping.add('bar'), 2)
+        self.assertEqual(mapping.get(1), 'foo')
+        mapping.set(1, 'baz')
+        self.assertEqual(mapping.get(1), 'baz')
+        self.assertEqual(mapping.get(2), 'bar')
+        mapping.remove(2)
+        self.assertRaises(dbi.NoRecordError, mapping.get, 2)
+        self.assertRaises(dbi.NoRecordError, mapping.remove, 2)
+        self.assertEqual(list(mapping), [(1, 'baz')])
+        self.assertEqual(len(mapping), 1)
+        self.assertEqual(mapping.add('qux'), 3)
+        mapping.close()
+
+    def testReopen(self):
+        mapping = dbi.IndexedMapping(self.filename)
+        for s in ('foo', 'bar', 'baz'):
+            mapping.add(s)
+        mapping.remove(2)
+        mapping.set(3, 'quux')
+        mapping.close()
+        mapping = dbi.IndexedMapping(self.filename)
+        self.assertEqual(list(mapping), [(1, 'foo'), (3, 'quux')])
+        self.assertEqual(mapping.add('bar'), 4)
+        mapping.close()
+
+    def testFreeSpaceReusedAfterVacuum(self):
+        mapping = dbi.IndexedMapping(self.filename)
+        for s in ('foo', 'bar', 'baz'):
+            mapping.add(s)
+        size = os.path.getsize(self.filename)
+        mapping.remove(1)
+        mapping.add('qux')
+        self.failUnless(os.path.getsize(self.filename) > size)
+        mapping.remove(4)
+        mapping.vacuum()
+        self.assertEqual(os.path.getsize(self.filename), size)
+        mapping.add('qux')
+        self.assertEqual(os.path.getsize(self.filename), size)
+        self.assertEqual(mapping.get(5), 'qux')
+        mapping.close()
+
+    def testTornAppendIgnored(self):
+        mapping = dbi.IndexedMapping(self.filename)
+        mapping.add('foo')
+        mapping.close()
+        fd = file(self.filename, 'ab')
+        fd.write('a record without its index ent')
+        fd.close()
+        mapping = dbi.IndexedMapping(self.filename)
+        self.assertEqual(list(mapping), [(1, 'foo')])
+        self.assertEqual(mapping.add('bar'), 2)
+        self.assertEqual(mapping.get(2), 'bar')
+        mapping.close()
+
+    def testConvertFlatfile(self):
+        flat = dbi.FlatfileMapping(self.flatFilename)
+        for s in ('foo', 'bar', 'baz'):
+            flat.add(s)
+        flat.remove(2)
+        flat.close()
+        mapping = dbi.IndexedMapping(self.filename)
+        self.assertEqual(list(mapping), [(1, 'foo'), (3, 'baz')])
+        self.assertEqual(mapping.add('qux'), 4)
+        mapping.close()
+        self.assertRaises(dbi.Error, dbi.convertFlatfile,
+                          self.flatFilename, self.filename)
+
+    def testDB(self):
+        class Record(dbi.Record):
+            __fields__ = ['text']
+        db = dbi.DB(self.filename, Mapping='indexed', Record=Record)
+        id = db.add(Record(text='foo'))
+        self.assertEqual(db.get(id).text, 'foo')
+        self.assertEqual(db.size(), 1)
+        db.close()
+
+
+class Note(dbi.Record):
+    __fields__ = ['by', 'at', 'text']
+
+class NoteDB(dbi.DB):
+    Record = Note
+    indexes = {'by': str.lower}
+
+class DBSelectTestCase(SupyTestCase):
+    notes = [('jemfinch', 3, 'foo bar'), ('Strike', 1, 'baz'),
+             ('JEMFINCH', 2, 'qux'), ('bwp', 4, 'bar baz')]
+    def _makeDB(self, mapping):
+        # Not Select.<mapping>.db, lest the indexed database import the
+        # flat one.
+        filename = conf.supybot.directories.data.dirize('Select-%s.db' %
+                                                        mapping)
+        for fn in (filename, filename + '.index'):
+            if os.path.exists(fn):
+                os.remove(fn)
+        db = NoteDB(filename, Mapping=mapping)
+        for (by, at, text) in self.notes:
+            db.add(Note(by=by, at=at, text=text))
+        return db
+
+    def _ids(self, *args, **kwargs):
+        return [record.id for record in self.db.select(*args, **kwargs)]
+
+    def testSelect(self):
+        for mapping in ('flat', 'indexed'):
+            self.db = self._makeDB(mapping)
+            self.assertEqual(self._ids(), [1, 2, 3, 4])
+            self.assertEqual(self._ids(lambda r: r.at > 2), [1, 4])
+            self.assertEqual(self._ids(where=[dbi.Contains('text', 'BAR')]),
+                             [1, 4])
+            self.assertEqual(self._ids(where=[dbi.Range('at', 2, 3)]), [1, 3])
+            where = [dbi.Not(dbi.Matches('text', re.compile('^ba')))]
+            self.assertEqual(self._ids(where=where), [1, 3])
+            self.assertEqual(self._ids(order='at'), [2, 3, 1, 4])
+            self.assertEqual(self._ids(order='at', reverse=True, limit=2),
+                             [4, 1])
+            self.assertEqual(self._ids(reverse=True, limit=1), [4])
+            self.db.close()
+
+    def testSecondaryIndex(self):
+        for mapping in ('flat', 'indexed'):
+            self.db = self._makeDB(mapping)
+            where = [dbi.Equals('by', 'jemfinch', str.lower)]
+            self.assertEqual(self._ids(where=where), [1, 3])
+            self.assertEqual(self._ids(where=where, reverse=True, limit=1),
+                             [3])
+            self.db.set(3, Note(by='Strike', at=2, text='qux'))
+            self.db.remove(1)
+            self.db.add(Note(by='jemfinch', at=5, text='quux'))
+            self.assertEqual(self._ids(where=where), [5])
+            where = [dbi.Equals('by', 'strike', str.lower)]
+            self.assertEqual(self._ids(where=where), [2, 3])
+            # Without the index's normalizer, the index can't be used.
+            self.assertEqual(self._ids(where=[dbi.Equals('by', 'Strike')]),
+                             [2, 3])
+            self.db.close()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,162 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+from supybot.test import *
+
+import time
+import socket
+
+import supybot.irclib as irclib
+import supybot.drivers as drivers
+import supybot.schedule as schedule
+import supybot.drivers.Select as Select
+
+network = conf.registerNetwork('selecttest')
+
+class SelectDriverTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.listener.settimeout(5)
+        network.servers.setValue(['127.0.0.1:%s' %
+                                  self.listener.getsockname()[1]])
+        self.originalPoll = conf.supybot.drivers.poll()
+        conf.supybot.drivers.poll.setValue(0.1)
+        self.ircs = []
+        self.poller = Select.poller
+
+    def tearDown(self):
+        for driver in self.poller.drivers[:]:
+            driver.die()
+            driver._reallyDie()
+        drivers.run()
+        for irc in self.ircs:
+            if irc in world.ircs:
+                world.ircs.remove(irc)
+        self.listener.close()
+        conf.supybot.drivers.poll.setValue(self.originalPoll)
+        SupyTestCase.tearDown(self)
+
+    def makeDriver(self):
+        irc = irclib.Irc('selecttest')
+        self.ircs.append(irc)
+        driver = Select.SelectDriver(irc)
+        irc.driver = driver
+        (server, _) = self.listener.accept()
+        server.settimeout(5)
+        return (driver, server)
+
+    def readLines(self, server, n):
+        data = ''
+        while data.count('\n') < n:
+            self.poller.run()
+            s = server.recv(4096)
+            self.failUnless(s, 'Connection closed.')
+            data += s
+        return data.splitlines()
+
+    def testRegisterUnregister(self):
+        (driver, server) = self.makeDriver()
+        self.failUnless(driver in self.poller.drivers)
+        self.failUnless(self.poller.inDriverLoop())
+        driver.die()
+        driver.flush()
+        self.failIf(driver in self.poller.drivers)
+        self.failIf(self.poller.inDriverLoop())
+        drivers.run()
+        self.failIf(self.poller.name() in drivers._drivers)
+        self.assertEqual(server.recv(4096), '')
+
+    def testReadAndWrite(self):
+        (driver, server) = self.makeDriver()
+        lines = self.readLines(server, 2)
+        self.failUnless([s for s in lines if s.startswith('NICK ')])
+        self.failUnless([s for s in lines if s.startswith('USER ')])
+        server.sendall('PING :selecttest\r\n')
+        self.assertEqual(self.readLines(server, 1), ['PONG :selecttest'])
+
+    def testReconnect(self):
+        (driver, server) = self.makeDriver()
+        self.failUnless(driver.connected)
+        server.close()
+        self.poller.run()
+        self.failIf(driver.connected)
+        self.failIf(driver.nextReconnectTime is None)
+        driver.nextReconnectTime = time.time() - 1
+        self.poller.run()
+        (server, _) = self.listener.accept()
+        server.settimeout(5)
+        self.failUnless(driver.connected)
+        self.failUnless(driver.nextReconnectTime is None)
+        lines = self.readLines(server, 2)
+        self.failUnless([s for s in lines if s.startswith('NICK ')])
+        server.close()
+
+    def testTimeout(self):
+        (driver, server) = self.makeDriver()
+        self.readLines(server, 2)
+        self.failUnless(self.poller.timeout([driver]) <= 0.1)
+        driver.nextReconnectTime = time.time() + 0.05
+        try:
+            self.failUnless(self.poller.timeout([driver]) <= 0.05)
+        finally:
+            driver.nextReconnectTime = None
+        name = schedule.addEvent(lambda: None, time.time() + 0.02)
+        try:
+            self.failUnless(self.poller.timeout([driver]) <= 0.02)
+        finally:
+            schedule.removeEvent(name)
+        driver.irc.sendMsg(ircmsgs.ping('selecttest'))
+        self.assertEqual(self.poller.timeout([driver]), 0)
+        # Nothing to do, so we should wait out the whole timeout.
+        self.readLines(server, 1)
+        start = time.time()
+        self.poller.run()
+        self.failUnless(time.time() - start >= 0.05)
+        server.close()
+
+    def testRejoinsDriverLoop(self):
+        (driver, server) = self.makeDriver()
+        drivers.run()
+        self.failUnless(drivers._drivers.get(self.poller.name()) is self.poller)
+        # As drivers.run does when we raise an uncaught exception.
+        drivers.remove(self.poller.name())
+        drivers.run()
+        self.failIf(self.poller.name() in drivers._drivers)
+        self.failIf(self.poller.inDriverLoop())
+        (otherDriver, otherServer) = self.makeDriver()
+        drivers.run()
+        self.failUnless(drivers._drivers.get(self.poller.name()) is self.poller)
+        self.readLines(otherServer, 2)
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
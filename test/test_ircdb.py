@@ -397,6 +397,66 @@ class UsersDictionaryTestCase(IrcdbTestCase):
         u2.addHostmask('*!xyzzy@baz.domain.c?m')
         self.assertRaises(ValueError, self.users.setUser, u2)
 
+    def testGetUserIdAfterHostmaskChanges(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.addHostmask('*!*@*.domain.com')
+        self.users.setUser(u)
+        self.assertEqual(self.users.getUserId('foo!bar@baz.domain.com'), u.id)
+        self.assertEqual(self.users.getUserId('foo!bar@BAZ.Domain.com'), u.id)
+        self.assertRaises(KeyError, self.users.getUserId, 'foo!bar@domain.org')
+        u.removeHostmask('*!*@*.domain.com')
+        u.addHostmask('foo!bar@baz.domain.org')
+        self.users.setUser(u)
+        self.assertRaises(KeyError,
+                          self.users.getUserId, 'foo!bar@qux.domain.com')
+        self.assertEqual(self.users.getUserId('foo!bar@baz.domain.org'), u.id)
+        self.users.delUser(u.id)
+        self.assertRaises(KeyError,
+                          self.users.getUserId, 'foo!bar@baz.domain.org')
+
+    def testGetUserIdByAuth(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        self.users.setUser(u)
+        u.addAuth('foo!bar@baz.domain.com')
+        self.users.setUser(u, flush=False)
+        self.assertEqual(self.users.getUserId('foo!bar@baz.domain.com'), u.id)
+
+    def testFlushOnlyWhenChanged(self):
+        world.testing = True # So we're not writing in the background.
+        self.users.filename = self.filename
+        u = self.users.newUser()
+        u.name = 'foo'
+        self.users.setUser(u)
+        self.failUnless(os.path.exists(self.filename))
+        os.remove(self.filename)
+        self.users.flush()
+        self.failIf(os.path.exists(self.filename))
+        u.addCapability('bar')
+        self.users.flush()
+        self.failUnless(os.path.exists(self.filename))
+
+
+class HostmaskIndexTestCase(SupyTestCase):
+    def testMatches(self):
+        index = ircdb.HostmaskIndex()
+        index.add(1, 'foo!bar@baz.domain.com')
+        index.add(2, '*!*@*.domain.com')
+        index.add(3, '*!bar@*')
+        index.add(4, 'qux!*@host.domain.c?m')
+        self.assertEqual(index.matches('foo!bar@baz.domain.com'),
+                         set([1, 2, 3]))
+        self.assertEqual(index.matches('FOO!bar@baz.DOMAIN.com'),
+                         set([1, 2, 3]))
+        self.assertEqual(index.matches('qux!quux@host.domain.com'),
+                         set([2, 4]))
+        self.assertEqual(index.matches('qux!quux@domain.org'), set())
+        index.remove(2, '*!*@*.domain.com')
+        self.assertEqual(index.matches('foo!bar@baz.domain.com'), set([1, 3]))
+        index.removeId(1)
+        self.assertEqual(index.matches('foo!bar@baz.domain.com'), set([3]))
+
 
 class CheckCapabilityTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
@@ -546,6 +606,34 @@ class CheckCapabilityTestCase(IrcdbTestCase):
         self.failUnless(self.checkCapability(self.antichanfoo,
                                              self.antichancap))
 
+    def testCachedResultsInvalidated(self):
+        self.failUnless(self.checkCapability(self.nothing, self.cap))
+        id = self.users.getUserId('nothing')
+        u = self.users.getUser(id)
+        u.addCapability(self.anticap)
+        self.failIf(self.checkCapability(self.nothing, self.cap))
+        u.addCapability(self.cap)
+        self.failUnless(self.checkCapability(self.nothing, self.cap))
+        u.ignore = True
+        self.failIf(self.checkCapability(self.nothing, self.cap))
+        u.ignore = False
+        try:
+            original = conf.supybot.capabilities.default()
+            self.assertEqual(self.checkCapability(self.nothing, 'bar'),
+                             original)
+            conf.supybot.capabilities.default.setValue(not original)
+            self.assertEqual(self.checkCapability(self.nothing, 'bar'),
+                             not original)
+        finally:
+            conf.supybot.capabilities.default.setValue(original)
+        self.channels.setChannel(self.channel, self.channelnothing)
+        self.failUnless(self.checkCapability(self.nothing, self.chancap))
+        self.channelnothing.setDefaultCapability(False)
+        try:
+            self.failIf(self.checkCapability(self.nothing, self.chancap))
+        finally:
+            self.channelnothing.setDefaultCapability(True)
+
     def testSecurefoo(self):
         self.failUnless(self.checkCapability(self.securefoo, self.cap))
         id = self.users.getUserId(self.securefoo)
@@ -30,11 +30,13 @@
 from supybot.test import *
 
 import copy
+import time
 import pickle
 
 import supybot.conf as conf
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
 
 # The test framework used to provide these, but not it doesn't.  We'll add
 # messages to as we find bugs (if indeed we find bugs).
@@ -181,6 +183,61 @@ class IrcMsgQueueTestCase(SupyTestCase):
         self.assertEqual(self.mode, q.dequeue())
         self.assertEqual(self.msg, q.dequeue())
 
+    def testTargetsTakeTurns(self):
+        q = irclib.IrcMsgQueue()
+        for msg in self.msgs[:3]:
+            q.enqueue(msg)
+        other = ircmsgs.privmsg('#bar', 'hello')
+        q.enqueue(other)
+        self.assertEqual(self.msgs[0], q.dequeue())
+        self.assertEqual(other, q.dequeue())
+        self.assertEqual(self.msgs[1], q.dequeue())
+        self.assertEqual(self.msgs[2], q.dequeue())
+
+    def testTargetTurnsIgnoreCase(self):
+        q = irclib.IrcMsgQueue()
+        q.enqueue(self.msgs[0])
+        q.enqueue(ircmsgs.privmsg('#FOO', '1'))
+        other = ircmsgs.privmsg('#bar', 'hello')
+        q.enqueue(other)
+        self.assertEqual(self.msgs[0], q.dequeue())
+        self.assertEqual(other, q.dequeue())
+        self.assertEqual(ircmsgs.privmsg('#FOO', '1'), q.dequeue())
+
+    def testPenalty(self):
+        configVar = conf.supybot.protocols.irc.queuing.penalty
+        original = configVar()
+        try:
+            configVar.setValue(True)
+            q = irclib.IrcMsgQueue()
+            msgs = [ircmsgs.privmsg('#foo', str(i)) for i in range(20)]
+            for msg in msgs:
+                q.enqueue(msg)
+            sent = []
+            msg = q.dequeue()
+            while msg is not None:
+                sent.append(msg)
+                msg = q.dequeue()
+            self.failUnless(sent)
+            self.assertEqual(sent, msgs[:len(sent)])
+            self.failUnless(len(q))
+            window = configVar.window()
+            self.failIf(q.penalty() > window)
+            self.failIf(q.penalty() + q.cost(msgs[len(sent)]) <= window)
+            self.failUnless(q.nextSendTime() > time.time())
+        finally:
+            configVar.setValue(original)
+
+    def testWaitStatistics(self):
+        q = irclib.IrcMsgQueue()
+        self.assertEqual(q.oldestWait(), 0)
+        q.enqueue(self.msg)
+        self.failUnless(q.oldestWait() >= 0)
+        q.dequeue()
+        self.assertEqual(q.sent, 1)
+        self.failUnless(q.maxWait >= 0)
+        self.failUnless(q.penalty() > 0)
+
 
 class ChannelStateTestCase(SupyTestCase):
     def testPickleCopy(self):
@@ -224,6 +281,34 @@ class ChannelStateTestCase(SupyTestCase):
         self.failIf('quuz' in c.halfops)
         self.failIf('quuz' in c.voices)
 
+    def testMembers(self):
+        c = irclib.ChannelState()
+        c.addUser('@Foo[]')
+        c.addUser('+bar')
+        c.addUser('baz')
+        self.assertEqual(len(c.users), 3)
+        self.assertEqual(len(c.ops), 1)
+        self.failUnless('foo{}' in c.users)
+        self.failUnless(c.isOp('FOO{}'))
+        self.assertEqual(list(c.ops), ['Foo[]'])
+        c.ops.add('qux') # Modes can come before we know they've joined.
+        self.failUnless(c.isOp('qux'))
+        self.failIf('qux' in c.users)
+        self.assertEqual(len(c.users), 3)
+        c.replaceUser('foo[]', 'Quuz')
+        self.assertEqual(c.users, ircutils.IrcSet(['Quuz', 'bar', 'baz']))
+        self.failUnless(c.isOp('quuz'))
+        self.failIf(c.isOp('foo[]'))
+        c.voices.remove('bar')
+        self.failIf(c.voices)
+        self.assertRaises(KeyError, c.voices.remove, 'bar')
+        c1 = pickle.loads(pickle.dumps(c))
+        self.assertEqual(len(c1.users), 3)
+        self.assertEqual(len(c1.ops), 2)
+        for nick in ('quuz', 'bar', 'baz', 'qux'):
+            c.removeUser(nick)
+        self.failIf(c.users or c.ops or c.nicks)
+
 
 class IrcStateTestCase(SupyTestCase):
     class FakeIrc:
@@ -257,6 +342,56 @@ class IrcStateTestCase(SupyTestCase):
         self.failUnless('baz' in st.channels['#foo'].users)
         self.failUnless(st.channels['#foo'].isOp('baz'))
 
+    def testQuitAndNickTaggedWithChannels(self):
+        st = irclib.IrcState()
+        for channel in ('#foo', '#bar', '#baz'):
+            st.channels[channel] = irclib.ChannelState()
+        st.channels['#foo'].addUser('bar')
+        st.channels['#bar'].addUser('@bar')
+        m = ircmsgs.IrcMsg(':bar!asfd@asdf.com NICK qux')
+        st.addMsg(self.irc, m)
+        L = m.tagged('channels')
+        L.sort()
+        self.assertEqual(L, ['#bar', '#foo'])
+        m = ircmsgs.quit(prefix='qux!asfd@asdf.com')
+        st.addMsg(self.irc, m)
+        L = m.tagged('channels')
+        L.sort()
+        self.assertEqual(L, ['#bar', '#foo'])
+        for chan in st.channels.itervalues():
+            self.failIf('qux' in chan.users)
+        m = ircmsgs.quit(prefix='qux!asfd@asdf.com')
+        st.addMsg(self.irc, m)
+        self.assertEqual(m.tagged('channels'), [])
+
+    def testChannelsOf(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.IrcMsg(prefix='server',
+                                           command='353',
+                                           args=('nick', '=', '#foo',
+                                                 '@bar +baz')))
+        st.addMsg(self.irc, ircmsgs.join('#BAR', prefix='Bar!u@h'))
+        L = st.channelsOf('BAR')
+        L.sort()
+        self.assertEqual(L, ['#bar', '#foo'])
+        self.assertEqual(st.channelsOf('baz'), ['#foo'])
+        self.assertEqual(st.channelsOf('qux'), [])
+        st.addMsg(self.irc, ircmsgs.part('#bar', prefix='bar!u@h'))
+        self.assertEqual(st.channelsOf('bar'), ['#foo'])
+        st.addMsg(self.irc, ircmsgs.kick('#foo', 'baz', prefix='bar!u@h'))
+        self.assertEqual(st.channelsOf('baz'), [])
+        st.addMsg(self.irc, ircmsgs.IrcMsg(':bar!u@h NICK qux'))
+        self.assertEqual(st.channelsOf('bar'), [])
+        self.assertEqual(st.channelsOf('qux'), ['#foo'])
+        self.assertEqual(st.copy().channelsOf('qux'), ['#foo'])
+        st.addMsg(self.irc, ircmsgs.part('#foo', prefix=self.irc.prefix))
+        self.assertEqual(st.channelsOf('qux'), [])
+        self.assertEqual(st.channelsOf('nick'), ['#bar'])
+        st.reset()
+        self.assertEqual(st.channelsOf('nick'), [])
+
     def testHistory(self):
         if len(msgs) < 10:
             return
@@ -378,6 +513,65 @@ class IrcStateTestCase(SupyTestCase):
         self.assert_(st.addMsg(self.irc, ircmsgs.IrcMsg('MODE foo +i')) or 1)
 
 
+class NicksToHostmasksTestCase(SupyTestCase):
+    class FakeIrc:
+        nick = 'nick'
+        prefix = 'nick!user@host'
+    irc = FakeIrc()
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.maxHostmasks = conf.supybot.protocols.irc.maxHostmasks()
+        self.timeout = conf.supybot.protocols.irc.hostmaskTimeout()
+
+    def tearDown(self):
+        conf.supybot.protocols.irc.maxHostmasks.setValue(self.maxHostmasks)
+        conf.supybot.protocols.irc.hostmaskTimeout.setValue(self.timeout)
+        SupyTestCase.tearDown(self)
+
+    def testMaxHostmasks(self):
+        conf.supybot.protocols.irc.maxHostmasks.setValue(8)
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='inchan!u@h'))
+        for i in range(100):
+            st.addMsg(self.irc, ircmsgs.privmsg('nick', 'hi',
+                                                prefix='nick%s!u@h' % i))
+            self.failUnless(len(st.nicksToHostmasks) <= 8 + 8 // 4 + 2)
+        self.failUnless('nick99' in st.nicksToHostmasks)
+        self.failIf('nick0' in st.nicksToHostmasks)
+        self.assertEqual(st.nickToHostmask('inchan'), 'inchan!u@h')
+        self.assertEqual(st.nickToHostmask('nick'), self.irc.prefix)
+        (size, pinned, hits, misses, expired, bytes) = \
+               st.nicksToHostmasks.stats()
+        self.assertEqual(size, len(st.nicksToHostmasks))
+        self.assertEqual(pinned, 2)
+        self.failUnless(hits and misses and expired and bytes)
+
+    def testRecentlyUsedAreKept(self):
+        conf.supybot.protocols.irc.maxHostmasks.setValue(8)
+        st = irclib.IrcState()
+        for i in range(100):
+            st.addMsg(self.irc, ircmsgs.privmsg('nick', 'hi',
+                                                prefix='nick%s!u@h' % i))
+            st.nickToHostmask('nick0')
+        self.failUnless('nick0' in st.nicksToHostmasks)
+
+    def testHostmaskTimeout(self):
+        conf.supybot.protocols.irc.hostmaskTimeout.setValue(10)
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='inchan!u@h'))
+        st.addMsg(self.irc, ircmsgs.privmsg('nick', 'hi', prefix='foo!u@h'))
+        st.nicksToHostmasks.expire(time.time() + 5)
+        self.failUnless('foo' in st.nicksToHostmasks)
+        st.nicksToHostmasks.expire(time.time() + 20)
+        self.failIf('foo' in st.nicksToHostmasks)
+        self.failUnless('inchan' in st.nicksToHostmasks)
+        st.addMsg(self.irc, ircmsgs.part('#foo', prefix='inchan!u@h'))
+        st.nicksToHostmasks.expire(time.time() + 20)
+        self.failIf('inchan' in st.nicksToHostmasks)
+
+
 class IrcTestCase(SupyTestCase):
     def setUp(self):
         self.irc = irclib.Irc('test')
@@ -127,6 +127,31 @@ class IrcMsgTestCase(SupyTestCase):
         m.tag('repliedTo', 12)
         self.assertEqual(m.repliedTo, 12)
 
+    def testServerTags(self):
+        s = '@aaa=bbb;ccc;example.com/ddd=eee\\s\\:\\\\x;fff= ' \
+            ':nick!ident@host.com PRIVMSG me :Hello'
+        m = ircmsgs.IrcMsg(s)
+        self.assertEqual(m.serverTags, {'aaa': 'bbb', 'ccc': None,
+                                        'example.com/ddd': 'eee ;\\x',
+                                        'fff': None})
+        self.assertEqual(m.prefix, 'nick!ident@host.com')
+        self.assertEqual(m.args, ('me', 'Hello'))
+        self.assertEqual(ircmsgs.IrcMsg(msg=m).serverTags, m.serverTags)
+        self.assertEqual(pickle.loads(pickle.dumps(m)).serverTags,
+                         m.serverTags)
+        self.assertEqual(ircmsgs.privmsg('foo', 'bar').serverTags, {})
+
+    def testPrefixSplitting(self):
+        for prefix in ['nick!user@host', 'irc.server.net', 'nick', '',
+                       '!user@host', 'nick!@host', 'nick!user@', 'a!b!c@d@e',
+                       'nick!us er@host', 'n@ck!user@host']:
+            m = ircmsgs.IrcMsg(prefix=prefix, command='PING', args=('x',))
+            if ircutils.isUserHostmask(prefix):
+                expected = ircutils.splitHostmask(prefix)
+            else:
+                expected = (prefix,)*3
+            self.assertEqual((m.nick, m.user, m.host), expected)
+
 class FunctionsTestCase(SupyTestCase):
     def testIsAction(self):
         L = [':jemfinch!~jfincher@ts26-2.homenet.ohio-state.edu PRIVMSG'
@@ -30,5 +30,163 @@
 
 from supybot.test import *
 
+import os
+
+import supybot.conf as conf
 import supybot.irclib as irclib
 import supybot.plugins as plugins
+
+class ChannelUserDBTestCase(SupyTestCase):
+    class DB(plugins.ChannelUserDB):
+        def serialize(self, v):
+            return [v]
+
+        def deserialize(self, channel, id, L):
+            return L[0]
+
+    filename = conf.supybot.directories.data.dirize('ChannelUserDBTestCase.db')
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def tearDown(self):
+        for filename in (self.filename, self.filename + '.journal'):
+            if os.path.exists(filename):
+                os.remove(filename)
+        SupyTestCase.tearDown(self)
+
+    def testFlushesOnlyWhenDirty(self):
+        db = self.DB(self.filename)
+        self.failIf(db.dirty)
+        db['#foo', 1] = 'bar'
+        self.failUnless(db.dirty)
+        db.flush()
+        self.failIf(db.dirty)
+        os.remove(db.journalFilename)
+        db.flush()
+        self.failIf(os.path.exists(db.journalFilename))
+
+    def testJournal(self):
+        db = self.DB(self.filename)
+        db['#foo', 1] = 'bar'
+        db['#foo', 'baz'] = 'qux'
+        db.flush()
+        self.failIf(os.path.exists(self.filename))
+        del db['#foo', 1]
+        db['#bar', 2] = 'quux'
+        db.flush()
+        db = self.DB(self.filename)
+        self.assertEqual(db.journalLength, 4)
+        self.failIf(('#foo', 1) in db)
+        self.assertEqual(db['#foo', 'baz'], 'qux')
+        self.assertEqual(db['#bar', 2], 'quux')
+        db.close()
+        self.assertEqual(os.path.getsize(db.journalFilename), 0)
+        db = self.DB(self.filename)
+        self.assertEqual(db.journalLength, 0)
+        self.assertEqual(len(db), 2)
+        self.assertEqual(db['#foo', 'baz'], 'qux')
+
+    def testCompaction(self):
+        db = self.DB(self.filename)
+        db.minimumJournalLength = 3
+        for i in range(3):
+            db['#foo', 1] = str(i)
+            db.flush()
+        self.assertEqual(db.journalLength, 3)
+        self.failIf(os.path.exists(self.filename))
+        db['#foo', 1] = '3'
+        db.flush()
+        self.assertEqual(db.journalLength, 0)
+        db = self.DB(self.filename)
+        self.assertEqual(len(db), 1)
+        self.assertEqual(db['#foo', 1], '3')
+
+    def testFailedCompactionIsRetried(self):
+        db = self.DB(self.filename)
+        db['#foo', 1] = 'bar'
+        db.flush()
+        journal = file(db.journalFilename).read()
+        os.mkdir(self.filename) # So it can't be written.
+        try:
+            db.compact()
+            self.failUnless(db.dirty)
+            # The journal wasn't emptied, so nothing's lost from disk.
+            self.assertEqual(file(db.journalFilename).read(), journal)
+            self.assertEqual(self.DB(self.filename)['#foo', 1], 'bar')
+        finally:
+            os.rmdir(self.filename)
+        db['#foo', 2] = 'baz'
+        db.flush()
+        self.failIf(db.dirty)
+        self.assertEqual(os.path.getsize(db.journalFilename), 0)
+        db = self.DB(self.filename)
+        self.assertEqual(db['#foo', 1], 'bar')
+        self.assertEqual(db['#foo', 2], 'baz')
+
+    def testOldJournalIsSkipped(self):
+        db = self.DB(self.filename)
+        db['#foo', 1] = 'bar'
+        db.flush()
+        journal = file(db.journalFilename).read()
+        del db['#foo', 1]
+        db['#foo', 2] = 'baz'
+        db.compact()
+        # As if we died after writing the file but before emptying the
+        # journal.
+        fd = file(db.journalFilename, 'w')
+        fd.write(journal)
+        fd.close()
+        db = self.DB(self.filename)
+        self.failIf(('#foo', 1) in db)
+        self.assertEqual(db['#foo', 2], 'baz')
+        # What's journaled after that is still read.
+        db['#foo', 3] = 'qux'
+        db.flush()
+        db = self.DB(self.filename)
+        self.failIf(('#foo', 1) in db)
+        self.assertEqual(db['#foo', 3], 'qux')
+
+    def testFailedJournalAppendIsRetried(self):
+        db = self.DB(self.filename)
+        db['#foo', 1] = 'bar'
+        os.mkdir(db.journalFilename) # So it can't be appended to.
+        try:
+            db.flush()
+            self.failUnless(db.dirty)
+        finally:
+            os.rmdir(db.journalFilename)
+        db.flush()
+        self.failIf(db.dirty)
+        self.assertEqual(self.DB(self.filename)['#foo', 1], 'bar')
+
+    def testDeletingEverything(self):
+        db = self.DB(self.filename)
+        db['#foo', 1] = 'bar'
+        db.compact()
+        del db['#foo', 1]
+        db.flush()
+        self.assertEqual(db.journalLength, 1)
+        db.close()
+        self.failIf(db.dirty)
+        self.assertEqual(db.journalLength, 0)
+        self.assertEqual(os.path.getsize(db.journalFilename), 0)
+        self.assertEqual(len(self.DB(self.filename)), 0)
+
+    def testMarkChanged(self):
+        class ListDB(plugins.ChannelUserDB):
+            def serialize(self, v):
+                return v
+            def deserialize(self, channel, id, L):
+                return L
+        db = ListDB(self.filename)
+        db['#foo', 1] = ['bar']
+        db.flush()
+        db['#foo', 1][0] = 'baz'
+        self.failIf(db.dirty)
+        db.markChanged('#foo', 1)
+        db.flush()
+        self.assertEqual(ListDB(self.filename)['#foo', 1], ['baz'])
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
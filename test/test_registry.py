@@ -29,6 +29,7 @@
 
 from supybot.test import *
 
+import os
 import re
 
 import supybot.conf as conf
@@ -174,4 +175,43 @@ class ValuesTestCase(SupyTestCase):
         registry.open(filename)
         self.assertEqual(conf.supybot.reply.whenAddressedBy.chars(), '\\')
 
+    def testSnapshotOnlyWhenChanged(self):
+        filename = conf.supybot.directories.conf.dirize('snapshot.conf')
+        registry.close(conf.supybot, filename)
+        self.failUnless(os.path.exists(filename))
+        # The first might have had values reloaded from an earlier open.
+        registry.close(conf.supybot, filename)
+        self.assertEqual(registry.snapshot(conf.supybot, filename), None)
+        original = conf.supybot.reply.whenAddressedBy.chars()
+        try:
+            conf.supybot.reply.whenAddressedBy.chars.set('?')
+            s = registry.snapshot(conf.supybot, filename)
+            self.failUnless('supybot.reply.whenAddressedBy.chars: ?' in s)
+        finally:
+            conf.supybot.reply.whenAddressedBy.chars.set(original)
+        os.remove(filename)
+        self.failUnless(registry.snapshot(conf.supybot, filename))
+
+    def testSnapshotSeesChangesInPlace(self):
+        filename = conf.supybot.directories.conf.dirize('inplace.conf')
+        registry.close(conf.supybot, filename)
+        registry.close(conf.supybot, filename)
+        self.assertEqual(registry.snapshot(conf.supybot, filename), None)
+        capabilities = conf.supybot.capabilities()
+        capabilities.add('-snapshot')
+        try:
+            # Nothing's looked at until we're told something changed.
+            self.assertEqual(registry.snapshot(conf.supybot, filename), None)
+            registry.changed()
+            s = registry.snapshot(conf.supybot, filename)
+            self.failUnless(s and '-snapshot' in s)
+        finally:
+            capabilities.remove('-snapshot')
+            registry.changed()
+        registry.close(conf.supybot, filename)
+        # A change that changes nothing isn't written.
+        registry.changed()
+        self.assertEqual(registry.snapshot(conf.supybot, filename), None)
+        os.remove(filename)
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
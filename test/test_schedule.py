@@ -73,6 +73,40 @@ class TestSchedule(SupyTestCase):
         sched.run()
         self.assertEqual(i[0], 1)
 
+    def testRemoveAndReadd(self):
+        sched = schedule.Schedule()
+        i = [0]
+        def inc():
+            i[0] += 1
+        def add10():
+            i[0] += 10
+        now = time.time()
+        sched.addEvent(inc, now - 1, 'test')
+        sched.removeEvent('test')
+        sched.addEvent(add10, now + 60, 'test')
+        sched.run()
+        self.assertEqual(i[0], 0)
+        self.assertEqual(sched.events.keys(), ['test'])
+
+    def testNextDeadline(self):
+        sched = schedule.Schedule()
+        self.assertEqual(sched.nextDeadline(), None)
+        now = time.time()
+        first = sched.addEvent(lambda: None, now + 10)
+        sched.addEvent(lambda: None, now + 20)
+        self.assertEqual(sched.nextDeadline(), now + 10)
+        sched.removeEvent(first)
+        self.assertEqual(sched.nextDeadline(), now + 20)
+
+    def testManyRemovals(self):
+        sched = schedule.Schedule()
+        now = time.time()
+        names = [sched.addEvent(lambda: None, now + i) for i in range(100)]
+        for name in names[:-1]:
+            sched.removeEvent(name)
+        self.failUnless(len(sched.schedule) < 100)
+        self.assertEqual(sched.nextDeadline(), now + 99)
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
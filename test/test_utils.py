@@ -32,6 +32,9 @@ from supybot.test import *
 
 import time
 import pickle
+import urllib2
+import threading
+import BaseHTTPServer
 import supybot.utils as utils
 from supybot.utils.structures import *
 
@@ -510,11 +513,112 @@ class NetTest(SupyTestCase):
         self.failUnless(f('2001::'))
         self.failUnless(f('2001:888:0:1::666'))
 
+class WebTestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    pages = {
+        '/fresh': ({'Cache-Control': 'max-age=60'}, 'fresh'),
+        '/etag': ({'Cache-Control': 'no-cache', 'ETag': '"1"'}, 'etag'),
+        '/nostore': ({'Cache-Control': 'no-store'}, 'nostore'),
+        '/big': ({}, 'x' * 100000),
+        }
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        (headers, body) = self.pages[self.path]
+        if 'ETag' in headers and \
+           self.headers.get('If-None-Match') == headers['ETag']:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        for (header, value) in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
 class WebTest(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                WebTestHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        t = threading.Thread(target=self.server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.cache = utils.web.cache
+        utils.web.cache = utils.web.ResponseCache(memorySize=100000)
+
+    def tearDown(self):
+        utils.web.cache = self.cache
+        utils.web.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        SupyTestCase.tearDown(self)
+
     def testGetDomain(self):
         url = 'http://slashdot.org/foo/bar.exe'
         self.assertEqual(utils.web.getDomain(url), 'slashdot.org')
 
+    def testKeepAlive(self):
+        for _ in range(3):
+            self.assertEqual(utils.web.getUrl(self.url + '/nostore'),
+                             'nostore')
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def testCache(self):
+        for _ in range(2):
+            self.assertEqual(utils.web.getUrl(self.url + '/fresh'), 'fresh')
+            self.assertEqual(utils.web.getUrl(self.url + '/etag'), 'etag')
+        # The fresh page isn't asked for again, the other is revalidated.
+        self.assertEqual(self.server.requests, ['/fresh', '/etag', '/etag'])
+        self.assertEqual(utils.web.cache.hits, 1)
+        self.assertEqual(utils.web.cache.revalidated, 1)
+        fd = utils.web.getUrlFd(self.url + '/fresh')
+        self.assertEqual(fd.info()['Cache-Control'], 'max-age=60')
+        self.assertEqual(self.server.connections, 1)
+
+    def testCallersRequestUnchanged(self):
+        request = urllib2.Request(self.url + '/etag')
+        for _ in range(2):
+            fd = utils.web.getUrlFd(request)
+            self.assertEqual(fd.read(), 'etag')
+            fd.close()
+        self.assertEqual(utils.web.cache.revalidated, 1)
+        self.failIf(request.has_header('If-none-match'))
+
+    def testCacheIsOptIn(self):
+        self.failIf(self.cache.enabled())
+
+    def testDiskCache(self):
+        directory = os.path.join(conf.supybot.directories.data(), 'testweb')
+        utils.web.cache = utils.web.ResponseCache(diskSize=100000,
+                                                  directory=directory)
+        utils.web.getUrl(self.url + '/fresh')
+        utils.web.cache = utils.web.ResponseCache(diskSize=100000,
+                                                  directory=directory)
+        self.assertEqual(utils.web.getUrl(self.url + '/fresh'), 'fresh')
+        self.assertEqual(self.server.requests, ['/fresh'])
+        utils.web.getUrl(self.url + '/big')
+        self.failUnless(utils.web.cache.diskUsed <= 100000)
+
+    def testIterUrl(self):
+        chunks = list(utils.web.iterUrl(self.url + '/big', size=2500))
+        self.assertEqual(map(len, chunks), [1024, 1024, 452])
+        # A page that wasn't read to the end isn't cached.
+        self.assertEqual(utils.web.cache.memoryUsed, 0)
+        self.assertEqual(utils.web.getUrl(self.url + '/big', 10), 'x' * 10)
+
     if network:
         def testGetUrlWithSize(self):
             url = 'http://slashdot.org/'
@@ -0,0 +1,87 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# Copyright (c) 2011, Supybot contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+from supybot.test import *
+
+import os
+import time
+
+class WriterTestCase(SupyTestCase):
+    filename = conf.supybot.directories.data.dirize('WriterTestCase.txt')
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        self.flushers = world.flushers[:]
+        world.flushers[:] = []
+        world.testing = False
+
+    def tearDown(self):
+        world.testing = True
+        world.dying = False
+        world.flushers[:] = self.flushers
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        SupyTestCase.tearDown(self)
+
+    def slowWrite(self, filename, data):
+        time.sleep(0.5)
+        fd = file(filename, 'w')
+        fd.write(data)
+        fd.close()
+
+    def testFlushWhenDyingFinishesWriting(self):
+        world._write(self.slowWrite, self.filename, ('foo',))
+        self.failIf(os.path.exists(self.filename))
+        world.dying = True
+        world.flush()
+        self.assertEqual(file(self.filename).read(), 'foo')
+
+    def testFailedWritesAreRedoneWhenDying(self):
+        written = []
+        def failingWrite(filename, data):
+            time.sleep(0.5)
+            raise IOError, 'Disk full.'
+        def flusher():
+            if not written:
+                written.append(True)
+                if world.dying:
+                    world.writeFile(self.filename, 'foo')
+                else:
+                    world._write(failingWrite, self.filename, ('foo',),
+                                 onError=lambda: written.pop())
+        world.flushers.append(flusher)
+        world.flush()
+        world.dying = True
+        world.flush()
+        self.assertEqual(file(self.filename).read(), 'foo')
+
+
+# vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79: